@@ -1,18 +1,35 @@
+import io
 import logging
+import math
+import operator
+import struct
 import threading
-from datetime import datetime
-from typing import Tuple, Any, List, Iterator
+import time
+import uuid
+import weakref
+from datetime import datetime, date, timedelta
+from typing import Tuple, Any, List, Iterator, Union, Dict, Generator, Iterable, Sequence, Optional, Callable
 
 import psycopg2.pool
+from psycopg2 import sql as pgsql
 import rootpath
 from deprecated import deprecated
 
 rootpath.append()
 from paths import DATABASE_CONFIG_PATH
 from backend.utilities.ini_parser import parse
+from backend.query_registry import QueryRegistry
 
 logger = logging.getLogger('TaskManager')
 
+# default number of rows transferred per round trip by server-side cursors
+STREAM_ITERSIZE = 2000
+# default longest time (in seconds) a stream may keep its pooled connection checked out, e.g. for a slow client
+STREAM_MAX_SECONDS = 120
+
+# characters that have to be escaped in COPY text format
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
 
 def synchronized(func):
     func.__lock__ = threading.Lock()
@@ -24,9 +41,76 @@ def synchronized(func):
     return lock_func
 
 
+class ConnectionMetrics:
+    """thread-safe counters describing how the connection pool is used"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0  # number of connections handed out by the pool
+        self.wait_time = 0.0  # total seconds spent waiting for a free connection
+        self.max_wait_time = 0.0  # longest single wait, in seconds
+        self.in_use = 0  # connections currently checked out
+        self.errors = 0  # database errors raised while a connection was checked out
+        self.liveness_checks = 0  # checks run on connections that had been idle for too long
+        self.reconnects = 0  # dead connections discarded and replaced
+        self.backend_count = None  # sum(numbackends) of pg_stat_database, from the status sampler
+        self.backend_max = None  # max_connections of the server, from the status sampler
+        self.sampled_at = None  # time of the last sample, as unix timestamp
+
+    def record_checkout(self, waited: float) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+
+    def record_checkin(self, failed: bool) -> None:
+        with self._lock:
+            self.in_use -= 1
+            if failed:
+                self.errors += 1
+
+    def record_liveness_check(self, alive: bool) -> None:
+        with self._lock:
+            self.liveness_checks += 1
+            if not alive:
+                self.reconnects += 1
+
+    def record_backends(self, count: int, maximum: int) -> None:
+        with self._lock:
+            self.backend_count = count
+            self.backend_max = maximum
+            self.sampled_at = time.time()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'wait_time': self.wait_time,
+                'avg_wait_time': self.wait_time / self.checkouts if self.checkouts else 0.0,
+                'max_wait_time': self.max_wait_time,
+                'in_use': self.in_use,
+                'errors': self.errors,
+                'liveness_checks': self.liveness_checks,
+                'reconnects': self.reconnects,
+                'backend_count': self.backend_count,
+                'backend_max': self.backend_max,
+                'sampled_at': self.sampled_at,
+            }
+
+
 class Connection:
     _pool = None
     _sem_remaining = None  # type: threading.Semaphore
+    _config = None  # type: Dict[str, str]
+    _last_used = weakref.WeakKeyDictionary()  # connection -> time.monotonic() of its last checkin
+    _metrics = ConnectionMetrics()
+    _sampler = None  # type: threading.Thread
+
+    # connections idle for longer than this (in seconds) are checked with a cheap query before being handed out
+    IDLE_CHECK_SECONDS = 60
+    # default interval (in seconds) of the background sampler of pg_stat_database
+    SAMPLE_INTERVAL_SECONDS = 60
 
     @synchronized
     def __init__(self):
@@ -37,31 +121,102 @@ class Connection:
 
     def __enter__(self, *args, **kwargs):
         """Context Manager enter point, returns an available connection from the _pool"""
+        start = time.monotonic()
         Connection._sem_remaining.acquire(blocking=True)
-        self.conn = Connection._pool.getconn(*args, **kwargs)
-        self.get_connection_status(self.conn)
+        try:
+            self.conn = Connection._get_live_connection(*args, **kwargs)
+        except Exception:
+            Connection._sem_remaining.release()
+            raise
+        Connection._metrics.record_checkout(time.monotonic() - start)
         return self.conn
 
     def __exit__(self, exc_type, exc_val, exc_tb) -> None:
         """Context Manager exit point, put the occupied connection back into the _pool"""
-        Connection._pool.putconn(self.conn)
+        Connection._last_used[self.conn] = time.monotonic()
+        Connection._metrics.record_checkin(exc_type is not None and issubclass(exc_type, psycopg2.Error))
+        Connection._pool.putconn(self.conn, close=bool(self.conn.closed))
         Connection._sem_remaining.release()
 
+    @staticmethod
+    def _get_live_connection(*args, **kwargs):
+        """
+        take a connection from the _pool, replacing it while it has been idle for too long and is found dead,
+        e.g. every pooled connection after a database restart, at most once per connection of the pool
+        """
+        for _ in range(Connection._pool.maxconn):
+            conn = Connection._pool.getconn(*args, **kwargs)
+            last_used = Connection._last_used.get(conn)
+            if not conn.closed and (last_used is None or time.monotonic() - last_used <= Connection.IDLE_CHECK_SECONDS):
+                return conn
+            alive = Connection._is_alive(conn)
+            Connection._metrics.record_liveness_check(alive)
+            if alive:
+                return conn
+            logger.warning("[DATABASE] discarding a dead connection from the pool")
+            Connection._pool.putconn(conn, close=True)
+        # as many dead connections discarded as the pool holds, this one is newly opened
+        return Connection._pool.getconn(*args, **kwargs)
+
+    @staticmethod
+    def _is_alive(connection) -> bool:
+        if connection.closed:
+            return False
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
     @staticmethod
     @deprecated(reason="__call__ will no longer be provided in future, please always use context manager (with)")
     def __call__(*args, **kwargs):
         """returns a newly created connection, which is not maintained by the _pool"""
-        connection = psycopg2.connect(*args, **parse(DATABASE_CONFIG_PATH, 'postgresql',
-                                                     unwanted_fields=["minconn", "maxconn"]), **kwargs)
-        Connection.get_connection_status(connection)
-        return connection
+        config = Connection.config()
+        for field in ["minconn", "maxconn"]:
+            config.pop(field, None)
+        return psycopg2.connect(*args, **config, **kwargs)
+
+    @staticmethod
+    def config() -> Dict[str, str]:
+        """returns the postgresql section of the database config, parsed once and cached"""
+        if Connection._config is None:
+            Connection._config = parse(DATABASE_CONFIG_PATH, 'postgresql')
+        return dict(Connection._config)
 
     @staticmethod
-    def config():
-        return parse(DATABASE_CONFIG_PATH, 'postgresql')
+    def metrics() -> Dict[str, Any]:
+        """returns a snapshot of the connection pool counters"""
+        return Connection._metrics.snapshot()
 
     @staticmethod
-    def get_connection_status(connection):
+    @synchronized
+    def start_status_sampler(interval: float = SAMPLE_INTERVAL_SECONDS) -> None:
+        """
+        starts a daemon thread sampling the backend count of the server every `interval` seconds,
+        the latest sample is reported by metrics(). calling it more than once has no effect.
+        """
+        if Connection._sampler is not None:
+            return
+
+        def sample():
+            while True:
+                try:
+                    with Connection() as connection:
+                        Connection.get_connection_status(connection)
+                        connection.rollback()
+                except psycopg2.Error:
+                    logger.error("[DATABASE] failed to sample connection status")
+                time.sleep(interval)
+
+        Connection._sampler = threading.Thread(target=sample, name='connection-status-sampler', daemon=True)
+        Connection._sampler.start()
+
+    @staticmethod
+    def get_connection_status(connection) -> Tuple[int, int]:
         cursor = connection.cursor()
         cursor.execute("SELECT sum(numbackends) FROM pg_stat_database;")
         connection_count, = cursor.fetchone()
@@ -72,6 +227,8 @@ class Connection:
             f"[DATABASE] HOST = {Connection.config().get('host')}, CONNECTION COUNT "
             f"= {connection_count}, MAXIMUM = {connection_max_count}")
         cursor.close()
+        Connection._metrics.record_backends(int(connection_count), int(connection_max_count))
+        return connection_count, connection_max_count
 
     @staticmethod
     def sql_execute(sql: str) -> Iterator:
@@ -88,6 +245,72 @@ class Connection:
             cursor.close()
             return iter(rows)
 
+    @staticmethod
+    def sql_execute_prepared(name: str, params: Sequence[Any] = ()) -> Iterator:
+        """to execute a statement declared in the QueryRegistry and fetch all results"""
+        logger.info(f"SQL (prepared): {name} {params}")
+        with Connection() as connection:
+            cursor = connection.cursor()
+            QueryRegistry.execute(cursor, name, params)
+            rows = cursor.fetchall()
+            cursor.close()
+            return iter(rows)
+
+    @staticmethod
+    def sql_execute_stream(sql: str, params: Union[Tuple, Dict, None] = None,
+                           itersize: int = STREAM_ITERSIZE, max_seconds: float = STREAM_MAX_SECONDS) -> Iterator:
+        """
+        to execute an SQL query and fetch results lazily through a named (server-side) cursor
+
+        rows are transferred from the server in batches of `itersize`, so memory usage is bounded by the batch
+        size rather than the size of the result set. the pooled connection stays checked out until the last batch
+        is fetched, which is yielded after the connection is handed back, so that a result of a single batch never
+        holds the connection while it is consumed, or until the returned iterator is closed (e.g. by `close()` or
+        by leaving a `for` loop early and dropping it).
+
+        :param sql: SELECT query, may contain psycopg2 placeholders
+        :param params: parameters for the placeholders in sql
+        :param itersize: number of rows fetched per round trip
+        :param max_seconds: the stream raises TimeoutError once it held the connection for longer than that, or
+                            once the query ran for longer than that (statement_timeout of its transaction)
+        :return: generator of result rows
+        """
+        logger.info(f"SQL (stream): {sql}")
+        if any([keyword in sql.upper() for keyword in ["INSERT", "UPDATE"]]):
+            logger.error("You are running INSERT or UPDATE in a read-only stream, transaction aborted. Please retry "
+                         "with sql_execute_commit")
+            return iter([])
+        return Connection._stream_rows(sql, params, itersize, max_seconds)
+
+    @staticmethod
+    def _stream_rows(sql: str, params: Union[Tuple, Dict, None], itersize: int, max_seconds: float) -> Generator:
+        with Connection() as connection:
+            deadline = time.monotonic() + max_seconds
+            # a unique name makes psycopg2 DECLARE a server-side cursor
+            cursor = connection.cursor(name=f'stream_{uuid.uuid4().hex}')
+            try:
+                # a query slower than that is cancelled by the server, on the first fetch, before any row is yielded
+                with connection.cursor() as settings:
+                    settings.execute('SET LOCAL statement_timeout = %s', (int(max_seconds * 1000),))
+                cursor.execute(sql, params)
+                while True:
+                    try:
+                        rows = cursor.fetchmany(itersize)
+                    except psycopg2.extensions.QueryCanceledError as err:
+                        logger.error(f"[DATABASE] stream query cancelled after {max_seconds}s: {sql}")
+                        raise TimeoutError(f'stream query ran for more than {max_seconds}s') from err
+                    if len(rows) < itersize:
+                        break  # the last batch, yielded once the connection is back in the pool
+                    yield from rows
+                    if time.monotonic() > deadline:
+                        logger.error(f"[DATABASE] stream aborted after {max_seconds}s: {sql}")
+                        raise TimeoutError(f'stream held its connection for more than {max_seconds}s')
+            finally:
+                cursor.close()
+                # named cursors live inside a transaction, end it before handing the connection back
+                connection.rollback()
+        yield from rows
+
     @staticmethod
     def sql_execute_commit(sql: object) -> None:
         """to execute and commit an SQL query"""
@@ -100,6 +323,72 @@ class Connection:
             cursor.close()
 
     @staticmethod
+    def copy_to_staging(cursor, table: str, columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> str:
+        """
+        to bulk load rows into a temporary staging table shaped like (columns of) table, using COPY FROM STDIN
+
+        the staging table is not WAL-logged and is dropped when the surrounding transaction ends.
+        rows are consumed lazily from the iterable, so generators are streamed to the server without being
+        materialized in memory. they are sent in the binary format when every column has a type of
+        _BINARY_ENCODERS (numbers, text, date, timestamp), so that values are packed and not formatted and parsed,
+        in the text format otherwise, e.g. for geometry columns given as WKT.
+
+        :param cursor: cursor of the connection whose transaction the staging table belongs to
+        :param table: target table the staging table copies its column types from
+        :param columns: column names, in the order of the values in each row
+        :param rows: iterable of value tuples
+        :return: name of the staging table
+        """
+        staging = f'staging_{uuid.uuid4().hex}'
+        column_list = pgsql.SQL(', ').join(map(pgsql.Identifier, columns))
+        cursor.execute(pgsql.SQL('CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA').format(
+            pgsql.Identifier(staging), column_list, pgsql.Identifier(table)))
+        cursor.execute(pgsql.SQL('SELECT {} FROM {} LIMIT 0').format(column_list, pgsql.Identifier(staging)))
+        encoders = [_BINARY_ENCODERS.get(column.type_code) for column in cursor.description]
+        if all(encoders):
+            copy, reader = 'COPY {} ({}) FROM STDIN WITH (FORMAT binary)', _CopyBinaryReader(rows, encoders)
+        else:
+            copy, reader = 'COPY {} ({}) FROM STDIN', _CopyRowReader(rows)
+        cursor.copy_expert(pgsql.SQL(copy).format(pgsql.Identifier(staging), column_list).as_string(cursor), reader)
+        return staging
+
+    @staticmethod
+    def copy_rows(table: str, columns: Sequence[str], rows: Iterable[Sequence[Any]],
+                  on_conflict: Optional[str] = 'DO NOTHING', connection=None) -> int:
+        """
+        to bulk insert rows with COPY, merging them into table with a single INSERT ... SELECT statement
+
+        :param table: target table
+        :param columns: column names, in the order of the values in each row
+        :param rows: iterable of value tuples
+        :param on_conflict: conflict clause following `ON CONFLICT`, e.g. '(id) DO UPDATE SET a = EXCLUDED.a',
+                            None to insert without a conflict clause
+        :param connection: if given, the rows are loaded inside this connection's transaction and not committed,
+                           otherwise a pooled connection is used and committed
+        :return: number of rows inserted or updated in table
+        """
+        if connection is None:
+            with Connection() as connection:
+                rowcount = Connection.copy_rows(table, columns, rows, on_conflict, connection)
+                connection.commit()
+                return rowcount
+
+        cursor = connection.cursor()
+        try:
+            staging = Connection.copy_to_staging(cursor, table, columns, rows)
+            column_list = pgsql.SQL(', ').join(map(pgsql.Identifier, columns))
+            merge = pgsql.SQL('INSERT INTO {} ({}) SELECT {} FROM {}').format(
+                pgsql.Identifier(table), column_list, column_list, pgsql.Identifier(staging))
+            if on_conflict:
+                merge += pgsql.SQL(' ON CONFLICT ' + on_conflict)
+            cursor.execute(merge)
+            logger.info(f"[DATABASE] COPY into {table}, affected rows: {cursor.rowcount}")
+            return cursor.rowcount
+        finally:
+            cursor.close()
+
+    @staticmethod
+    @deprecated(reason="sql_execute_values builds the whole statement in memory, please use copy_rows instead")
     def sql_execute_values(sql: str, value_tuples: List[Tuple[Any]], ignore_duplicate: bool = True) -> None:
         """to execute and commit an SQL query with multiple value tuples"""
         value_tuples_sql = ", ".join(
@@ -112,6 +401,135 @@ class Connection:
             logger.info("[DATABASE] Nothing to commit")
 
 
+class _CopyRowReader(io.TextIOBase):
+    """file-like object serializing rows into COPY text format on demand, as read by cursor.copy_expert"""
+
+    def __init__(self, rows: Iterable[Sequence[Any]]):
+        super().__init__()
+        self._rows = iter(rows)
+        self._buffer = ''
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> str:
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        for row in self._rows:
+            line = '\t'.join(map(_copy_value, row)) + '\n'
+            chunks.append(line)
+            length += len(line)
+            if 0 <= size <= length:
+                break
+        data = ''.join(chunks)
+        if size < 0:
+            self._buffer = ''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+
+class _CopyBinaryReader(io.RawIOBase):
+    """file-like object serializing rows into COPY binary format on demand, one encoder per column"""
+
+    def __init__(self, rows: Iterable[Sequence[Any]], encoders: Sequence[Callable[[Any], bytes]]):
+        super().__init__()
+        self._rows = iter(rows)
+        self._encoders = encoders
+        self._field_count = struct.pack('>h', len(encoders))
+        self._buffer = _COPY_BINARY_HEADER
+        self._done = False
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while not self._done and (size < 0 or length < size):
+            row = next(self._rows, None)
+            if row is None:
+                chunks.append(_COPY_BINARY_TRAILER)
+                self._done = True
+                break
+            chunk = _copy_binary_row(row, self._encoders, self._field_count)
+            chunks.append(chunk)
+            length += len(chunk)
+        data = b''.join(chunks)
+        if size < 0:
+            self._buffer = b''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def _copy_binary_row(row: Sequence[Any], encoders: Sequence[Callable[[Any], bytes]], field_count: bytes) -> bytes:
+    """a row in COPY binary format: its field count, then the length and the bytes of every field, -1 for NULL"""
+    fields = [field_count]
+    for value, encode in zip(row, encoders):
+        if value is None:
+            fields.append(_COPY_BINARY_NULL)
+        else:
+            data = encode(value)
+            fields.append(struct.pack('>i', len(data)))
+            fields.append(data)
+    return b''.join(fields)
+
+
+# COPY binary format, https://www.postgresql.org/docs/current/sql-copy.html
+_COPY_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+_COPY_BINARY_TRAILER = struct.pack('>h', -1)
+_COPY_BINARY_NULL = struct.pack('>i', -1)
+# dates and timestamps are sent relative to the postgres epoch
+_POSTGRES_EPOCH = datetime(2000, 1, 1)
+
+
+def _binary_date(value: date) -> bytes:
+    if isinstance(value, datetime):
+        value = value.date()
+    return struct.pack('>i', (value - _POSTGRES_EPOCH.date()).days)
+
+
+def _binary_timestamp(value: date) -> bytes:
+    """timestamp without time zone, an offset of value is dropped as the text input of postgres does"""
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, datetime.min.time())
+    return struct.pack('>q', (value.replace(tzinfo=None) - _POSTGRES_EPOCH) // timedelta(microseconds=1))
+
+
+# binary encoders by type oid of the column, integers must be integers (operator.index), as in the text format
+_BINARY_ENCODERS: Dict[int, Callable[[Any], bytes]] = {
+    16: lambda value: b'\x01' if value else b'\x00',  # bool
+    21: lambda value: struct.pack('>h', operator.index(value)),  # int2
+    23: lambda value: struct.pack('>i', operator.index(value)),  # int4
+    20: lambda value: struct.pack('>q', operator.index(value)),  # int8
+    700: lambda value: struct.pack('>f', value),  # float4
+    701: lambda value: struct.pack('>d', value),  # float8
+    25: lambda value: str(value).encode(),  # text
+    1043: lambda value: str(value).encode(),  # varchar
+    1042: lambda value: str(value).encode(),  # bpchar
+    1082: _binary_date,  # date
+    1114: _binary_timestamp,  # timestamp
+}
+
+
+def _copy_value(value: Any) -> str:
+    """serialize a single value into COPY text format"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, float):
+        if math.isinf(value):
+            return 'Infinity' if value > 0 else '-Infinity'
+        return float.__repr__(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return '\\\\x' + bytes(value).hex()
+    return str(value).translate(_COPY_ESCAPES)
+
+
 if __name__ == '__main__':
     # use as a context manager
     with Connection() as conn:
@@ -133,6 +551,13 @@ if __name__ == '__main__':
     for row in Connection.sql_execute("select * from pg_tables"):
         print(row)
 
+    # stream a large result set through a server-side cursor, batch by batch
+    for row in Connection.sql_execute_stream("select * from pg_tables", itersize=100):
+        print(row)
+
+    # bulk load rows through COPY and a staging table
+    Connection.copy_rows('images', ('id', 'image_url'), [(1, 'http://example.com/1.jpg')])
+
     # remains supported for now.
     for row in Connection().sql_execute("select * from pg_tables"):
         print(row)
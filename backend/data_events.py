@@ -0,0 +1,175 @@
+"""
+Change notifications between the data pipeline and the web server, over PostgreSQL LISTEN/NOTIFY.
+
+Dumpers call publish() inside the transaction that writes the data, the notification is delivered only if
+and when that transaction commits. Web processes subscribe() callbacks and start_listener() once.
+
+publish() also bumps the version of the table in data_version, the listener keeps the versions of all tables
+in memory (versions()), so that responses can be validated without querying the tables themselves.
+From SQL, publish with publish_data_event() (sql/data_events.sql), a bare pg_notify carries no version and
+the table is left out of versions() until it is published again.
+"""
+import json
+import logging
+import select
+import threading
+import time
+from datetime import date, datetime
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import psycopg2
+import psycopg2.extensions
+import rootpath
+
+rootpath.append()
+from backend.connection import Connection
+
+logger = logging.getLogger('TaskManager')
+
+CHANNEL = 'data_changed'
+# notification payloads are limited to 8000 bytes, larger date sets are announced as "all dates"
+MAX_DATES = 200
+
+Callback = Callable[[str, Optional[List[date]]], None]
+
+SQL_CREATE_DATA_VERSION = 'CREATE TABLE IF NOT EXISTS data_version ' \
+                          '(table_name varchar PRIMARY KEY, version bigint NOT NULL, modified_at timestamptz NOT NULL)'
+SQL_BUMP_DATA_VERSION = 'INSERT INTO data_version (table_name, version, modified_at) VALUES (%s, 1, now()) ' \
+                        'ON CONFLICT (table_name) DO UPDATE SET version = data_version.version + 1, ' \
+                        'modified_at = excluded.modified_at RETURNING version, modified_at'
+SQL_SELECT_DATA_VERSIONS = 'SELECT table_name, version, modified_at FROM data_version'
+
+_subscribers: List[Callback] = list()
+_listener: Optional[threading.Thread] = None
+_lock = threading.Lock()
+_data_version_created = False
+# table -> (version, modified_at), None until loaded by the listener
+_versions: Optional[Dict[str, Tuple[int, datetime]]] = None
+# tables notified without a version, left out of versions() until published with one
+_unversioned: Set[str] = set()
+
+
+def publish(cursor, table: str, dates: Optional[Iterable[date]] = None) -> None:
+    """
+    announces that rows of table changed, delivered to listeners when the cursor's transaction commits
+
+    :param cursor: cursor of the transaction writing the data
+    :param table: name of the changed table
+    :param dates: dates of the changed rows, None if unknown or not date based
+    """
+    dates = sorted({str(d) for d in dates}) if dates is not None else None
+    if dates is not None and len(dates) > MAX_DATES:
+        dates = None
+    _create_data_version()
+    cursor.execute(SQL_BUMP_DATA_VERSION, (table,))
+    version, modified_at = cursor.fetchone()
+    cursor.execute('SELECT pg_notify(%s, %s)', (CHANNEL, json.dumps(
+        {'table': table, 'dates': dates, 'version': version, 'modified_at': modified_at.isoformat()})))
+
+
+def _create_data_version() -> None:
+    """
+    creates data_version (also created by sql/data_events.sql) in a transaction of its own, committed before the
+    caller's one, which could roll back the creation with it
+    """
+    global _data_version_created
+    if _data_version_created:
+        return
+    with Connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(SQL_CREATE_DATA_VERSION)
+        connection.commit()
+        cursor.close()
+    _data_version_created = True
+
+
+def subscribe(callback: Callback) -> None:
+    """
+    registers callback(table, dates) to be called on the listener thread for every change,
+    dates is a list of datetime.date, or None if every date may have changed
+    """
+    with _lock:
+        _subscribers.append(callback)
+
+
+def versions() -> Optional[Dict[str, Tuple[int, datetime]]]:
+    """
+    (version, modified_at) of every table published so far, None while unknown (listener not connected),
+    tables never published, or last notified without a version, are missing
+    """
+    with _lock:
+        return dict(_versions) if _versions is not None else None
+
+
+def start_listener(timeout: float = 5) -> None:
+    """starts the daemon thread listening for changes, calling it more than once has no effect"""
+    global _listener
+    with _lock:
+        if _listener is None:
+            _listener = threading.Thread(target=_listen, args=(timeout,), name='data-event-listener', daemon=True)
+            _listener.start()
+
+
+def _listen(timeout: float) -> None:
+    while True:
+        connection = None
+        try:
+            # LISTEN needs a dedicated connection in autocommit mode, it can not come from the pool
+            config = Connection.config()
+            for field in ["minconn", "maxconn"]:
+                config.pop(field, None)
+            connection = psycopg2.connect(**config)
+            connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            cursor = connection.cursor()
+            cursor.execute(f'LISTEN {CHANNEL}')
+            logger.info(f'[DATA EVENTS] listening on {CHANNEL}')
+            # changes may have been missed while not listening
+            _load_versions(cursor)
+            while True:
+                if select.select([connection], [], [], timeout) == ([], [], []):
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    _dispatch(connection.notifies.pop(0).payload)
+        except psycopg2.Error:
+            logger.error('[DATA EVENTS] listener connection lost, reconnecting')
+            _set_versions(None)
+            if connection is not None:
+                connection.close()
+            time.sleep(timeout)
+
+
+def _load_versions(cursor) -> None:
+    cursor.execute(SQL_CREATE_DATA_VERSION)
+    cursor.execute(SQL_SELECT_DATA_VERSIONS)
+    _set_versions({table: (version, modified_at) for table, version, modified_at in cursor.fetchall()})
+
+
+def _set_versions(table_versions: Optional[Dict[str, Tuple[int, datetime]]]) -> None:
+    global _versions
+    with _lock:
+        if table_versions is not None:
+            for table in _unversioned:
+                table_versions.pop(table, None)
+        _versions = table_versions
+
+
+def _dispatch(payload: str) -> None:
+    event = json.loads(payload)
+    dates = [date.fromisoformat(d) for d in event['dates']] if event.get('dates') is not None else None
+    with _lock:
+        if 'version' not in event:
+            # a bare pg_notify, the table changed without its version being bumped
+            _unversioned.add(event['table'])
+            if _versions is not None:
+                _versions.pop(event['table'], None)
+        else:
+            _unversioned.discard(event['table'])
+            if _versions is not None and event['version'] > _versions.get(event['table'], (0, None))[0]:
+                _versions[event['table']] = event['version'], datetime.fromisoformat(event['modified_at'])
+        subscribers = list(_subscribers)
+    for callback in subscribers:
+        try:
+            callback(event['table'], dates)
+        except Exception:
+            logger.exception(f'[DATA EVENTS] subscriber failed on {event}')
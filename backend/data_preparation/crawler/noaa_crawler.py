@@ -17,17 +17,24 @@ from paths import GRIB2_DATA_DIR
 from backend.connection import Connection
 from backend.data_preparation.crawler.crawlerbase import CrawlerBase
 from backend.data_preparation.dumper.noaa_dumper import NOAADumper
+from backend.data_preparation.extractor.grib_extractor import GRIBRegion, REGIONS
 
 logger = logging.getLogger('TaskManager')
 
 
 class NOAACrawler(CrawlerBase):
+    # the wind field served by /data/wind is global whatever the region, its components are downloaded for the
+    # whole globe into a file of their own when the region is smaller
+    WIND_SUFFIX = '.wind.f000'
+
     def __init__(self):
         super().__init__()
         self.baseDir = 'http://nomads.ncep.noaa.gov/cgi-bin/filter_gfs_0p25.pl'
         self.useJavaConverter = False  # use grib2json?
         self.interval = 6
         self.select_exists = 'select reftime from noaa0p25_reftime'
+        # region of interest downloaded, REGIONS['global'] for the whole globe
+        self.region: GRIBRegion = REGIONS['conus']
 
     def start(self, end_clause=None):
         """
@@ -78,29 +85,55 @@ class NOAACrawler(CrawlerBase):
             'var_VGRD': 'on',
             'var_TMP': 'on',
             'var_SOILW': 'on',
-            'leftlon': 0,
-            'rightlon': 360,
-            'toplat': 90,
-            'bottomlat': -90,
+            'subregion': '',
+            'leftlon': self.region.left,
+            'rightlon': self.region.right,
+            'toplat': self.region.top,
+            'bottomlat': self.region.bottom,
             'dir': '/gfs.' + stamp2
         }
+        if self._download(qs, stamp + '.f000') and self.region != REGIONS['global']:
+            global_region = REGIONS['global']
+            self._download({
+                'file': qs['file'],
+                'lev_100_m_above_ground': 'on',
+                'var_UGRD': 'on',
+                'var_VGRD': 'on',
+                'subregion': '',
+                'leftlon': global_region.left,
+                'rightlon': global_region.right,
+                'toplat': global_region.top,
+                'bottomlat': global_region.bottom,
+                'dir': qs['dir']
+            }, stamp + NOAACrawler.WIND_SUFFIX)
+        return stamp
+
+    def _download(self, qs, filename: str) -> bool:
+        """downloads the file selected by the GET parameters qs into GRIB2_DATA_DIR, returns whether it was saved"""
         try:
             response = requests.get(url=self.baseDir, params=qs)
             if response.status_code != 200:
                 # try -6h
-                logger.error('file: ' + stamp + ' not found')
+                logger.error('file: ' + filename + ' not found')
             else:
                 # create dirs
                 if not os.path.isdir(GRIB2_DATA_DIR):
                     os.makedirs(GRIB2_DATA_DIR)
                 # write file
-                with open(os.path.join(GRIB2_DATA_DIR, stamp + '.f000'), 'wb') as f:
+                with open(os.path.join(GRIB2_DATA_DIR, filename), 'wb') as f:
                     f.write(response.content)
-                    logger.info('saved file: ' + stamp)
+                    logger.info('saved file: ' + filename)
+                return True
         except IOError:
             # try -6h
             logger.error('error: ' + traceback.format_exc())
-        return stamp
+        return False
+
+    @staticmethod
+    def wind_filepath(stamp: str, region: GRIBRegion) -> str:
+        """the downloaded file holding the global wind components of a timestamp"""
+        suffix = '.f000' if region == REGIONS['global'] else NOAACrawler.WIND_SUFFIX
+        return os.path.join(GRIB2_DATA_DIR, stamp + suffix)
 
     def get_exists(self):
         """get how far we went last time"""
@@ -123,8 +156,9 @@ class NOAACrawler(CrawlerBase):
     @staticmethod
     def remove_grib2_file(stamp):
         # clear cached grib2 data after finish
-        if os.path.isfile(os.path.join(GRIB2_DATA_DIR, stamp + '.f000')):
-            os.remove(os.path.join(GRIB2_DATA_DIR, stamp + '.f000'))
+        for suffix in ('.f000', NOAACrawler.WIND_SUFFIX):
+            if os.path.isfile(os.path.join(GRIB2_DATA_DIR, stamp + suffix)):
+                os.remove(os.path.join(GRIB2_DATA_DIR, stamp + suffix))
 
 
 if __name__ == '__main__':
@@ -13,8 +13,11 @@ import rootpath
 rootpath.append()
 
 from backend.data_preparation.dumper.dumperbase import DumperBase
+from backend import data_events
 from backend.connection import Connection
 from backend.data_preparation.crawler.fire_crawler import FireEvent
+from backend.utilities.tile_cache import TileCache
+from paths import FIRE_TILE_CACHE_DIR
 
 logger = logging.getLogger('TaskManager')
 
@@ -321,13 +324,22 @@ class FireDumper(DumperBase):
             # if there is more than one, new_id will be id + i
             # create the dictionary for all values in aggregated record
             fire_info_update_params, fire_merged_insert_params = self._generate_data(record, new_id)
-            # update their id in fire_info
-            # here, if the new_id is different from id, the fire with that name will be updated with the new id
-            self._generate_sql_statement_and_execute(self.SQL_UPDATE_FIRE_INFO, fire_info_update_params)
-            # insert this set in fire_aggregate
-            self._generate_sql_statement_and_execute(self.SQL_INSERT_FIRE_INTO_MERGED, fire_merged_insert_params)
+            with Connection() as conn:
+                cur = conn.cursor()
+                # update their id in fire_info
+                # here, if the new_id is different from id, the fire with that name will be updated with the new id
+                cur.execute(self.SQL_UPDATE_FIRE_INFO, fire_info_update_params)
+                # insert this set in fire_aggregate
+                cur.execute(self.SQL_INSERT_FIRE_INTO_MERGED, fire_merged_insert_params)
+                # announced in the transaction of the merge, listeners are notified if and only if it commits
+                data_events.publish(cur, 'fire_merged')
+                conn.commit()
+                cur.close()
             # insert this set into fire_crawl_history, mark it as crawled
             self.insert_history(FireEvent(year, state, name, new_id))
+        # fire-tiles are keyed by the version of fire_merged published above, the stale ones are no longer read
+        # and only their files are removed here
+        TileCache(FIRE_TILE_CACHE_DIR).invalidate()
         return new_id
 
 
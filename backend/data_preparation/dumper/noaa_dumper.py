@@ -1,67 +1,114 @@
 import datetime
+import gzip
+import hashlib
+import json
 import logging
-from ast import literal_eval as make_tuple
-from typing import Tuple, Generator
+import math
+from typing import Dict, Generator, List, Optional, Tuple
+
+import numpy as np
 
 import psycopg2.errors
-import psycopg2.extras
 import rootpath
 
 rootpath.append()
+from backend import data_events, raster_storage, region_membership
 from backend.connection import Connection
 from backend.data_preparation.dumper.dumperbase import DumperBase
+from backend.data_preparation.extractor.grib_extractor import GRIBEnum, GRIBGrid
 
 logger = logging.getLogger('TaskManager')
 
 
 class NOAADumper(DumperBase):
     sql_check_geom = 'SELECT table_name FROM information_schema.TABLES WHERE table_name = \'noaa0p25_geometry\''
-    sql_check_geom2 = 'SELECT * FROM noaa0p25_geometry WHERE gid=0'
+    sql_check_geom2 = 'SELECT count(DISTINCT gid) FROM noaa0p25_geometry WHERE gid = ANY(%s)'
+    sql_delete_geom = 'DELETE FROM noaa0p25_geometry WHERE gid = ANY(%s)'
     sql_create_geom = 'CREATE TABLE IF NOT EXISTS noaa0p25_geometry (geom geometry, gid int4)'
-    sql_insert_geom = 'INSERT INTO noaa0p25_geometry (geom, gid) VALUES %s'
-    sql_insert = 'INSERT INTO "noaa0p25" (tid, gid, ugnd, vgnd, tmp, soilw) VALUES %s ' \
-                 'ON CONFLICT (tid, gid) DO UPDATE SET ' \
-                 'ugnd = EXCLUDED.ugnd, vgnd = EXCLUDED.vgnd, tmp=EXCLUDED.tmp, soilw=EXCLUDED.soilw'
+    columns_geom = ('geom', 'gid')
+    columns = ('tid', 'gid', 'ugnd', 'vgnd', 'tmp', 'soilw')
+    on_conflict = '(tid, gid) DO UPDATE SET ' \
+                  'ugnd = EXCLUDED.ugnd, vgnd = EXCLUDED.vgnd, tmp=EXCLUDED.tmp, soilw=EXCLUDED.soilw'
     sql_insert_time = 'INSERT INTO "noaa0p25_reftime" (reftime, tid) VALUES (%s, %s)'
+    # wind field artifacts served by /data/wind: header (json), uv (float32 little-endian U then V values),
+    # json_gz (gzip'd grib2json view) and etag (digest of the content)
+    sql_create_wind = 'CREATE TABLE IF NOT EXISTS noaa0p25_wind (tid int4 PRIMARY KEY, header text, uv bytea, ' \
+                      'json_gz bytea, etag varchar(40))'
+    sql_upsert_wind = 'INSERT INTO noaa0p25_wind (tid, header, uv, json_gz, etag) VALUES (%s, %s, %s, %s, %s) ' \
+                      'ON CONFLICT (tid) DO UPDATE SET header = EXCLUDED.header, uv = EXCLUDED.uv, ' \
+                      'json_gz = EXCLUDED.json_gz, etag = EXCLUDED.etag'
+    # decimals of wind speeds (m/s) kept in the json view
+    WIND_JSON_DECIMALS = 2
 
     def __init__(self):
         super().__init__()
 
-    def insert(self, ugnd: dict, vgnd: dict, tmp: dict, soilw: dict, reftime: datetime, stamp: str) -> None:
+    # variables of the grid stored in noaa0p25, in the order of columns
+    MODES = (GRIBEnum.NOAA_WIND_U, GRIBEnum.NOAA_WIND_V, GRIBEnum.NOAA_TMP, GRIBEnum.NOAA_SOILW)
+
+    def insert(self, grid: GRIBGrid, reftime: datetime, stamp: str) -> None:
         """
 
-        :param ugnd: wind-U-component
-        :param vgnd: wind-V-component
-        :param tmp:  temperature
-        :param soilw: soil-moisture
+        :param grid: GRIBExtractor.extract_grid of NOAADumper.MODES (wind-U, wind-V, temperature, soil-moisture),
+                     of the whole globe or of a region
         :param reftime: datetime.datetime
         :param stamp: timestamp in string
         :return: None
         """
         with Connection() as conn:
-            self.check_geom(conn, ugnd)  # create mesh if not exist
+            self.check_geom(conn, grid)  # create mesh if not exist
 
             tid = int(stamp)
-            data = NOAADumper.data_gen(tid, soilw, tmp, ugnd, vgnd)  # data generator
+            data = NOAADumper.data_gen(tid, grid)  # data generator
 
             # insert data
             try:
                 cur = conn.cursor()
                 cur.execute(NOAADumper.sql_insert_time, (reftime, tid))
-                psycopg2.extras.execute_values(cur, NOAADumper.sql_insert, data, template=None, page_size=10000)
+                if raster_storage.ENABLED:
+                    rowcount = raster_storage.insert_noaa(cur, tid, NOAADumper.gids(grid), grid.shape, {
+                        column: grid.values[mode] for column, mode in zip(NOAADumper.columns[2:], NOAADumper.MODES)})
+                else:
+                    rowcount = Connection.copy_rows('noaa0p25', NOAADumper.columns, data, NOAADumper.on_conflict,
+                                                    conn)
+                data_events.publish(cur, 'noaa0p25', [reftime.date()])
 
             # FIXME: when will this error happen? does it terminate at the error point? also not able to find error
             #  reference to `psycopg2.errors.UniqueViolation`
             except psycopg2.errors.UniqueViolation:
                 logger.error('\n\tDuplicated Key')
             else:
-                self.inserted_count = cur.rowcount
-                logger.info('affected records: ' + str(cur.rowcount))
+                self.inserted_count = rowcount
+                logger.info('affected records: ' + str(rowcount))
                 conn.commit()
             finally:
                 cur.close()
 
-    def check_geom(self, conn, ugnd: dict) -> None:
+    def insert_wind_field(self, tid: int, records: List[Dict]) -> None:
+        """
+        builds and stores the wind field artifact of a tid
+
+        :param tid: timestamp id, as in noaa0p25
+        :param records: U and V records of GribConverter.wind_field
+        """
+        u, v = records
+        header = json.dumps({'tid': tid, **u['header']})
+        uv = np.concatenate((u['data'], v['data'])).astype('<f4').tobytes()
+        json_gz = gzip.compress(json.dumps(
+            [{'header': record['header'], 'data': np.round(record['data'], NOAADumper.WIND_JSON_DECIMALS).tolist()}
+             for record in records]).encode())
+        etag = hashlib.sha1(header.encode() + uv).hexdigest()
+
+        with Connection() as conn:
+            cur = conn.cursor()
+            cur.execute(NOAADumper.sql_create_wind)
+            cur.execute(NOAADumper.sql_upsert_wind, (tid, header, uv, json_gz, etag))
+            data_events.publish(cur, 'noaa0p25_wind')
+            conn.commit()
+            cur.close()
+        logger.info(f'wind field of {tid}: {len(uv)} bytes, json view {len(json_gz)} bytes gzip\'d')
+
+    def check_geom(self, conn, grid: GRIBGrid) -> None:
         """create geometry table if not exist"""
         cur = conn.cursor()
         # if table not exist
@@ -71,29 +118,40 @@ class NOAADumper(DumperBase):
             cur.execute(NOAADumper.sql_create_geom)
             conn.commit()
 
-        # if table is empty
-        cur.execute(self.sql_check_geom2)
-        geoms = cur.fetchall()
-        if not len(geoms):
-            mesh = NOAADumper.geom_gen(ugnd)
-            psycopg2.extras.execute_values(cur, NOAADumper.sql_insert_geom, mesh, template=None, page_size=10000)
+        # if the points of the grid are not all there, (re)insert them: the table is empty, or a region not within
+        # the ones dumped before. gids are indexes on the global grid, numbered as before regions were dumped,
+        # so that the rows of a global dump serve every region (test_noaa_gids.py)
+        gids = NOAADumper.gids(grid)
+        cur.execute(self.sql_check_geom2, (gids.tolist(),))
+        count, = cur.fetchone()
+        if count < len(gids):
+            cur.execute(NOAADumper.sql_delete_geom, (gids.tolist(),))
+            mesh = NOAADumper.geom_gen(grid)
+            Connection.copy_rows('noaa0p25_geometry', NOAADumper.columns_geom, mesh, None, conn)
+            region_membership.refresh_noaa_gids(cur, gids.tolist())
             conn.commit()
         cur.close()
 
     @staticmethod
-    def data_gen(tid: int, soilw: dict, tmp: dict, ugnd: dict, vgnd: dict) -> Generator[
-        Tuple[int, int, float, float, float, float], None, None]:
-        """generator: data"""
-        gid = 0
-        for key in ugnd.keys():
-            yield tid, gid, ugnd.get(key) + 0.0, vgnd.get(key) + 0.0, tmp.get(key) + 0.0, soilw.get(key) + 0.0
-            gid += 1
+    def gids(grid: GRIBGrid) -> np.ndarray:
+        """
+        gids of the points of a grid: their index on the global 0.25 degree grid, row-major from (90, 0),
+        so that the gids of a regional grid are the gids of the same points on the global grid
+        """
+        rows = np.rint((90 - grid.lats) * 4).astype(np.int32)
+        columns = np.rint(np.mod(grid.lons, 360) * 4).astype(np.int32) % 1440
+        return rows * 1440 + columns
+
+    @staticmethod
+    def data_gen(tid: int, grid: GRIBGrid) -> Generator[
+        Tuple[int, int, Optional[float], Optional[float], Optional[float], Optional[float]], None, None]:
+        """generator: data, missing values (NaN) as NULL"""
+        columns = [grid.values[mode].tolist() for mode in NOAADumper.MODES]
+        for gid, values in zip(NOAADumper.gids(grid).tolist(), zip(*columns)):
+            yield (tid, gid, *(None if math.isnan(value) else value for value in values))
 
     @staticmethod
-    def geom_gen(ugnd: dict) -> Generator[Tuple[str, int], None, None]:
-        """generator: geometry"""
-        gid = 0
-        for key in ugnd.keys():
-            x, y = make_tuple(key)
-            yield f'POINT({x} {y})', gid
-            gid += 1
+    def geom_gen(grid: GRIBGrid) -> Generator[Tuple[str, int], None, None]:
+        """generator: geometry, as POINT(lat lon)"""
+        for gid, lat, lon in zip(NOAADumper.gids(grid).tolist(), grid.lats.tolist(), grid.lons.tolist()):
+            yield f'POINT({lat} {lon})', gid
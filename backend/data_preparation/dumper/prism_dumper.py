@@ -4,11 +4,10 @@ import os
 import zipfile
 
 import numpy as np
-import psycopg2.errors
-import psycopg2.extras
 import rootpath
 
 rootpath.append()
+from backend import data_events, raster_storage
 from backend.connection import Connection
 from backend.data_preparation.dumper.dumperbase import DumperBase
 from backend.data_preparation.crawler.usgs_crawler import USGSCrawler
@@ -18,27 +17,12 @@ logger = logging.getLogger('TaskManager')
 
 
 class PRISMDumper(DumperBase):
-    INSERT_SQLS = {
-        'ppt': '''
-                insert into prism (date, gid, ppt) values %s
-                ON CONFLICT (date, gid) DO UPDATE SET
-                ppt=EXCLUDED.ppt
-            ''',
-        'tmax': '''
-                insert into prism (date, gid, tmax) values %s
-                ON CONFLICT (date, gid) DO UPDATE SET
-                tmax=EXCLUDED.tmax
-            ''',
-        'vpdmax': '''
-                insert into prism (date, gid, vpdmax) values %s
-                ON CONFLICT (date, gid) DO UPDATE SET
-                vpdmax=EXCLUDED.vpdmax
-            ''',
-        'usgs': '''
-                insert into usgs (date, gid, usgs) values %s
-                ON CONFLICT (date, gid) DO UPDATE SET
-                usgs=EXCLUDED.usgs
-            '''
+    # target table and conflict clause of each variable, rows are (date, gid, value)
+    COPY_TARGETS = {
+        'ppt': ('prism', '(date, gid) DO UPDATE SET ppt=EXCLUDED.ppt'),
+        'tmax': ('prism', '(date, gid) DO UPDATE SET tmax=EXCLUDED.tmax'),
+        'vpdmax': ('prism', '(date, gid) DO UPDATE SET vpdmax=EXCLUDED.vpdmax'),
+        'usgs': ('usgs', '(date, gid) DO UPDATE SET usgs=EXCLUDED.usgs'),
     }
     INSERT_INFOS = {
         'ppt': 'insert into prism_info (date, ppt) values (%s, %s) '
@@ -60,15 +44,20 @@ class PRISMDumper(DumperBase):
         :return: None
         """
         flattened = unflattened_data.flatten()
+        table, on_conflict = PRISMDumper.COPY_TARGETS[var_type]
         with Connection() as conn:
             cur = conn.cursor()
-            psycopg2.extras.execute_values(cur, PRISMDumper.INSERT_SQLS[var_type],
-                                           PRISMDumper.record_generator(date, flattened),
-                                           template=None, page_size=10000)
+            if raster_storage.ENABLED and table == 'prism':
+                self.inserted_count = raster_storage.insert_prism(cur, date, var_type, flattened)
+            else:
+                self.inserted_count = Connection.copy_rows(table, ('date', 'gid', var_type),
+                                                           PRISMDumper.record_generator(date, flattened), on_conflict,
+                                                           conn)
             if var_type == 'usgs':
                 cur.execute(PRISMDumper.INSERT_INFOS[var_type], (date,))
             else:
                 cur.execute(PRISMDumper.INSERT_INFOS[var_type], (date, 1))
+            data_events.publish(cur, table, [date])
             conn.commit()
             cur.close()
 
@@ -13,6 +13,7 @@ from backend.data_preparation.crawler.soil_mois_crawler import SoilMoisCrawler
 from backend.data_preparation.extractor.soil_mois_extractor import TiffExtractor
 
 from backend.data_preparation.dumper.dumperbase import DumperBase
+from backend import data_events
 from backend.connection import Connection
 
 logger = logging.getLogger('TaskManager')
@@ -23,9 +24,8 @@ class SoilMoisDumper(DumperBase):
     This class is responsible for dumping extracted NASAGrace data into database
     """
     TIME_FORMAT = "%Y%m%d"
-    INSERT_SOIL_MOISTURE = "INSERT INTO env_soil_moisture (gid, datetime, soil_moisture) " \
-                           "VALUES (%s, %s, %s) ON CONFLICT (gid, datetime) DO UPDATE " \
-                           "SET soil_moisture = excluded.soil_moisture"
+    COLUMNS = ('gid', 'datetime', 'soil_moisture')
+    ON_CONFLICT = '(gid, datetime) DO UPDATE SET soil_moisture = excluded.soil_moisture'
 
     def insert(self, date_str: str, weekly_soil_mois: np.array) -> None:
         """
@@ -35,19 +35,25 @@ class SoilMoisDumper(DumperBase):
         """
         flattened_data = weekly_soil_mois.flatten()
 
-        with Connection() as conn:
-            cur = conn.cursor()
-            for gid, val in enumerate(flattened_data.tolist()):
-                val = float('NaN') if val in [-999, -9999] else val
-                try:
-                    cur.execute(self.INSERT_SOIL_MOISTURE, (gid, datetime.datetime.strptime(date_str, "%Y%m%d"), val))
-                    self.inserted_count += cur.rowcount
-                    conn.commit()
-                except Exception:
-                    logger.error("error: " + traceback.format_exc())
+        date = datetime.datetime.strptime(date_str, self.TIME_FORMAT)
+        try:
+            with Connection() as connection:
+                self.inserted_count += Connection.copy_rows('env_soil_moisture', self.COLUMNS,
+                                                            self.record_generator(date, flattened_data),
+                                                            self.ON_CONFLICT, connection)
+                cur = connection.cursor()
+                data_events.publish(cur, 'env_soil_moisture', [date.date()])
+                connection.commit()
+                cur.close()
+        except Exception:
+            logger.error("error: " + traceback.format_exc())
 
-            logger.info(f'{date_str} finished, total inserted {self.inserted_count}')
-            cur.close()
+        logger.info(f'{date_str} finished, total inserted {self.inserted_count}')
+
+    @staticmethod
+    def record_generator(date: datetime.datetime, _data: np.array):
+        for gid, val in enumerate(_data.tolist()):
+            yield gid, date, float('NaN') if val in [-999, -9999] else val
 
 
 if __name__ == '__main__':
@@ -4,10 +4,10 @@ import traceback
 from typing import List, Dict, Tuple, Union
 
 import rootpath
-from psycopg2 import extras
 
 rootpath.append()
 
+from backend import data_events, tweet_rollups
 from backend.connection import Connection
 
 from backend.data_preparation.dumper.dumperbase import DumperBase
@@ -16,44 +16,43 @@ logger = logging.getLogger('TaskManager')
 
 
 class TweetDumper(DumperBase):
-    INSERT_WITH_LOCATION_QUERY = f"""
-INSERT INTO records (id, create_at, text, hash_tag, profile_pic, created_date_time, screen_name, user_name, 
-followers_count, favourites_count, friends_count, user_id, user_location, statuses_count, location) 
-VALUES %s 
-ON CONFLICT(id) DO UPDATE 
-SET create_at = excluded.create_at, text = excluded.text, hash_tag = excluded.hash_tag,  
-profile_pic = excluded.profile_pic, created_date_time = excluded.created_date_time,
-screen_name = excluded.screen_name, user_name = excluded.user_name, followers_count = excluded.followers_count, 
-favourites_count = excluded.favourites_count, friends_count= excluded.friends_count, user_id= excluded.user_id, 
-user_location= excluded.user_location, statuses_count= excluded.statuses_count, location = excluded.location;"""
+    COLUMNS = ('id', 'create_at', 'text', 'hash_tag', 'profile_pic', 'created_date_time', 'screen_name',
+               'user_name', 'followers_count', 'favourites_count', 'friends_count', 'user_id', 'user_location',
+               'statuses_count')
+    COLUMNS_WITH_LOCATION = COLUMNS + ('location',)
 
-    INSERT_WITHOUT_LOCATION_QUERY = f"""
-INSERT INTO records (id, create_at, text, hash_tag, profile_pic, created_date_time, screen_name, user_name, 
-followers_count, favourites_count, friends_count, user_id, user_location, statuses_count) 
-VALUES %s 
-ON CONFLICT(id) DO UPDATE 
+    ON_CONFLICT_UPDATE = """(id) DO UPDATE 
 SET create_at = excluded.create_at, text = excluded.text, hash_tag = excluded.hash_tag,  
 profile_pic = excluded.profile_pic, created_date_time = excluded.created_date_time,
 screen_name = excluded.screen_name, user_name = excluded.user_name, followers_count = excluded.followers_count, 
 favourites_count = excluded.favourites_count, friends_count= excluded.friends_count, user_id= excluded.user_id, 
-user_location= excluded.user_location, statuses_count= excluded.statuses_count;"""
-
-    INSERT_LOCATION_QUERY = "INSERT INTO records (id) VALUES %s ON CONFLICT(id) DO NOTHING"
+user_location= excluded.user_location, statuses_count= excluded.statuses_count"""
+
+    ON_CONFLICT_UPDATE_WITH_LOCATION = ON_CONFLICT_UPDATE + ", location = excluded.location"
+
+    # states, counties and cities containing each tweet, reassigned on every upsert once tweet_region is created
+    # and backfilled by region_membership.sql, with the index on id serving the delete
+    SQL_TWEET_REGION_EXISTS = "SELECT to_regclass('tweet_region') IS NOT NULL"
+    SQL_DELETE_TWEET_REGION = 'DELETE FROM tweet_region WHERE id = ANY(%(ids)s)'
+    SQL_INSERT_TWEET_REGION = '''INSERT INTO tweet_region (region_id, id)
+SELECT region.region_id, rec.id FROM records rec, (
+    SELECT state_id AS region_id, geom FROM us_states
+    UNION ALL SELECT county_id, geom FROM us_counties
+    UNION ALL SELECT city_id, geom FROM us_cities
+) AS region
+WHERE rec.id = ANY(%(ids)s) AND rec.location IS NOT NULL AND st_contains(region.geom, rec.location)'''
 
     def __init__(self):
         super().__init__()
         self.inserted_locations_count = 0
         self.inserted_count = 0
+        self.tweet_region_exists = False
 
     @staticmethod
     def _insert_ids(ids=List[Tuple[int]]):
         """insert given id list into the database"""
         logger.info("Inserting ids")
-        with Connection() as connection:
-            cur = connection.cursor()
-            extras.execute_values(cur, TweetDumper.INSERT_LOCATION_QUERY, ids)
-            connection.commit()
-            cur.close()
+        Connection.copy_rows('records', ('id',), ids)
 
     def insert(self, data_list: List[Union[Dict, int]], id_mode=False) -> None:
         """inserts the given list into the database"""
@@ -62,48 +61,59 @@ user_location= excluded.user_location, statuses_count= excluded.statuses_count;"
             # only insert ids without other data when id_mode == True
             self._insert_ids([(i,) for i in data_list])
         else:
-            records_with_location = []
-            records_without_location = []
+            # keyed by id, a batch merged in one statement must not update the same row twice
+            records_with_location = {}
+            records_without_location = {}
             for data in data_list:
+                record = (data['id'], data['date_time'], data['full_text'],
+                          ', '.join(data['hashtags']) if data['hashtags'] else None,
+                          data['profile_pic'],
+                          data['created_date_time'], data['screen_name'], data['user_name'],
+                          data['followers_count'], data['favourites_count'],
+                          data['friends_count'],
+                          data['user_id'], data['user_location'], data['statuses_count'])
                 if data['top_left'] is not None and data['bottom_right'] is not None:
                     # form tuples for data with locations
                     long_tl, lat_tl = data['top_left']
                     long_br, lat_br = data['bottom_right']
                     long = (long_tl + long_br) / 2
                     lat = (lat_br + lat_tl) / 2
-                    geom, = next(Connection.sql_execute(f'select st_makepoint({long},{lat})'))
-                    records_with_location.append((data['id'], data['date_time'], data['full_text'],
-                                                  ', '.join(data['hashtags']) if data['hashtags'] else None,
-                                                  data['profile_pic'],
-                                                  data['created_date_time'], data['screen_name'], data['user_name'],
-                                                  data['followers_count'], data['favourites_count'],
-                                                  data['friends_count'],
-                                                  data['user_id'], data['user_location'], data['statuses_count'], geom))
-
+                    # WKT is parsed by the geometry column itself, no round trip to st_makepoint needed
+                    records_with_location[data['id']] = record + (f'POINT({long} {lat})',)
                 else:
-                    records_without_location.append((data['id'], data['date_time'], data['full_text'],
-                                                     ', '.join(data['hashtags']) if data['hashtags'] else None,
-                                                     data['profile_pic'],
-                                                     data['created_date_time'], data['screen_name'], data['user_name'],
-                                                     data['followers_count'], data['favourites_count'],
-                                                     data['friends_count'],
-                                                     data['user_id'], data['user_location'], data['statuses_count']))
+                    records_without_location[data['id']] = record
 
+            ids = list(records_with_location.keys() | records_without_location.keys())
             try:
                 with Connection() as connection:
                     cur = connection.cursor()
-                    if records_with_location:
-                        extras.execute_values(cur, self.INSERT_WITH_LOCATION_QUERY, records_with_location)
-                        self.inserted_locations_count += cur.rowcount
-
-                    if records_without_location:
-                        extras.execute_values(cur, self.INSERT_WITHOUT_LOCATION_QUERY, records_without_location)
-                        self.inserted_count += cur.rowcount
+                    # rollups are maintained once built (tweet_rollups.py)
+                    with tweet_rollups.maintained(cur, ids):
+                        if records_with_location:
+                            self.inserted_locations_count += Connection.copy_rows(
+                                'records', self.COLUMNS_WITH_LOCATION, records_with_location.values(),
+                                self.ON_CONFLICT_UPDATE_WITH_LOCATION, connection)
+
+                        if records_without_location:
+                            self.inserted_count += Connection.copy_rows(
+                                'records', self.COLUMNS, records_without_location.values(), self.ON_CONFLICT_UPDATE,
+                                connection)
+
+                    if not self.tweet_region_exists:
+                        cur.execute(self.SQL_TWEET_REGION_EXISTS)
+                        self.tweet_region_exists, = cur.fetchone()
+                    if self.tweet_region_exists:
+                        cur.execute(self.SQL_DELETE_TWEET_REGION, {'ids': ids})
+                        cur.execute(self.SQL_INSERT_TWEET_REGION, {'ids': ids})
+
+                    # announce the changed days, delivered to listeners on commit
+                    data_events.publish(cur, 'records', {data['date_time'].date() for data in data_list
+                                                         if data['date_time'] is not None})
+                    cur.close()
                     # if the data is fetched from db and reprocessed,
                     # the values will be updated with the help of the ON CONFLICT DO UPDATE
                     # if the data is just crawled, the sql statement will just simply insert data into db
                     connection.commit()
-                    cur.close()
             except Exception as err:
                 logger.error(str(err) + traceback.format_exc())
             else:
@@ -4,6 +4,7 @@ from typing import Union, List, Dict, Generator, Tuple
 import rootpath
 
 rootpath.append()
+from backend import data_events
 from backend.connection import Connection
 from backend.data_preparation.dumper.dumperbase import DumperBase
 
@@ -13,7 +14,13 @@ logger = logging.getLogger('TaskManager')
 class URLDumper(DumperBase):
     def insert(self, data: Union[List, Dict]):
         if isinstance(data, dict):
-            Connection().sql_execute_values("insert into images(id,image_url) values ", self._gen_id_url_pair(data))
+            with Connection() as connection:
+                self.inserted_count += Connection.copy_rows('images', ('id', 'image_url'),
+                                                            self._gen_id_url_pair(data), connection=connection)
+                cur = connection.cursor()
+                data_events.publish(cur, 'images')
+                connection.commit()
+                cur.close()
 
     @staticmethod
     def _gen_id_url_pair(data) -> Generator[Tuple[int, str], None, None]:
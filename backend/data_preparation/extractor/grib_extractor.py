@@ -2,7 +2,9 @@ import json
 import os
 import pygrib
 from enum import Enum, auto
-from typing import Dict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
 
 import rootpath
 
@@ -22,11 +24,60 @@ class GRIBEnum(Enum):
     MOISTURE_MODE = auto()
 
 
+class GRIBGrid(NamedTuple):
+    """
+    variables of a grib file on its grid, flattened row-major: index i of every array is the grid point of gid i
+    (for the GFS 0.25 degree grid, gid = row * 1440 + column, rows from 90 to -90, columns from 0 to 359.75)
+    """
+    shape: Tuple[int, int]  # (rows, columns)
+    lats: np.ndarray  # float64
+    lons: np.ndarray  # float64
+    values: Dict['GRIBEnum', np.ndarray]  # float32, NaN where the message has no value
+
+
+class GRIBRegion(NamedTuple):
+    """bounding box of a region, longitudes in degrees east from 0 to 360 as on the GFS grid, left <= right"""
+    left: float
+    right: float
+    top: float
+    bottom: float
+
+    def contains(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        lons = np.mod(lons, 360)
+        return (lons >= self.left) & (lons <= self.right) & (lats >= self.bottom) & (lats <= self.top)
+
+    @staticmethod
+    def parse(value: str) -> 'GRIBRegion':
+        """
+        region of '<left>,<right>,<top>,<bottom>', longitudes in degrees east, negative ones (west) included
+
+        :raises ValueError: if the region is empty, or crosses the prime meridian (e.g. -10,10), which the
+                            regional grids can not since their columns must be contiguous from 0 to 360
+        """
+        left, right, top, bottom = (float(bound) for bound in value.split(','))
+        if right - left >= 360:
+            left, right = 0, 360  # every longitude, e.g. -180,180
+        # -180..180 to 0..360, the east end of the globe (360) is kept
+        left, right = left % 360, right if right == 360 else right % 360
+        if not (left < right and bottom < top):
+            raise ValueError(f'region {value} is empty or crosses the prime meridian, '
+                             f'longitudes normalized to 0..360: {left},{right}')
+        return GRIBRegion(left, right, top, bottom)
+
+
+# regions of interest, by name
+REGIONS: Dict[str, GRIBRegion] = {
+    'global': GRIBRegion(0, 360, 90, -90),
+    # contiguous united states, with a margin
+    'conus': GRIBRegion(234, 294, 50, 24),
+}
+
+
 class GRIBExtractor(ExtractorBase):
     NAMES = {
         # original version of these two attributes' names, but didn't work on my computer
-        GRIBEnum.NOAA_WIND_U_bak: {'100 metre U wind component'},
-        GRIBEnum.NOAA_WIND_V_bak: {'100 metre V wind component'},
+        GRIBEnum.NOAA_WIND_U_bak: {'name': '100 metre U wind component'},
+        GRIBEnum.NOAA_WIND_V_bak: {'name': '100 metre V wind component'},
         GRIBEnum.NOAA_WIND_U: {'name': 'U component of wind'},
         GRIBEnum.NOAA_WIND_V: {'name': 'V component of wind'},
         GRIBEnum.NOAA_TMP: {'name': 'Temperature'},
@@ -36,30 +87,116 @@ class GRIBExtractor(ExtractorBase):
                                  'scaledValueOfSecondFixedSurface': 10},
     }
 
+    # keys identifying a grid, messages with the same values share their lat/lon mesh
+    GRID_KEYS = ('gridType', 'Ni', 'Nj', 'latitudeOfFirstGridPointInDegrees', 'longitudeOfFirstGridPointInDegrees',
+                 'latitudeOfLastGridPointInDegrees', 'longitudeOfLastGridPointInDegrees',
+                 'iDirectionIncrementInDegrees', 'jDirectionIncrementInDegrees')
+    # grid definition -> flat (lats, lons), read only, shared by every extractor of the process
+    _latlons_cache: Dict[Tuple, Tuple[np.ndarray, np.ndarray]] = dict()
+    LATLONS_CACHE_SIZE = 4
+
     def __init__(self, filename: str):
         super().__init__()
         self.file_handler = pygrib.open(filename)
         self.data: Dict
 
-    def extract(self, mode: GRIBEnum) -> dict:
-        self.data = dict()  # creates a new dictionary to store data
-        go_on = False
+    def _select(self, mode: GRIBEnum):
+        """the single message of mode, raises ValueError if there is none"""
         try:
             prop_msg, = self.file_handler.select(**GRIBExtractor.NAMES[mode])
         except ValueError:
             # second chance?
-            if mode == GRIBEnum.NOAA_WIND_U or mode == GRIBEnum.NOAA_WIND_V:
-                try:
-                    prop_msg, = self.file_handler.select(**GRIBExtractor.NAMES[mode.value - 2])
-                except ValueError:
-                    print('error: grib-no-matches-found')
-                else:
-                    go_on = True
-            else:
-                print('error: grib-no-matches-found')
+            if mode != GRIBEnum.NOAA_WIND_U and mode != GRIBEnum.NOAA_WIND_V:
+                raise
+            prop_msg, = self.file_handler.select(**GRIBExtractor.NAMES[GRIBEnum(mode.value - 2)])
+        return prop_msg
+
+    @staticmethod
+    def _matches(message, selectors: Dict) -> bool:
+        return all(message.has_key(key) and message[key] == value for key, value in selectors.items())
+
+    def _scan(self, modes: Tuple[GRIBEnum, ...]) -> List:
+        """
+        the single message of every mode, found in one pass over the messages, which are not decoded
+
+        :raises ValueError: if a mode has no message, or more than one, as _select
+        """
+        candidates = {mode: [GRIBExtractor.NAMES[mode]] for mode in modes}
+        for mode in (GRIBEnum.NOAA_WIND_U, GRIBEnum.NOAA_WIND_V):
+            if mode in candidates:
+                # second chance, used only if the first selector matches nothing
+                candidates[mode].append(GRIBExtractor.NAMES[GRIBEnum(mode.value - 2)])
+        found = {(mode, rank): list() for mode, selectors in candidates.items() for rank in range(len(selectors))}
+        self.file_handler.seek(0)
+        for message in self.file_handler:
+            for mode, selectors in candidates.items():
+                for rank, selector in enumerate(selectors):
+                    if GRIBExtractor._matches(message, selector):
+                        found[mode, rank].append(message)
+
+        messages = list()
+        for mode, selectors in candidates.items():
+            matches = next((found[mode, rank] for rank in range(len(selectors)) if found[mode, rank]), [])
+            if len(matches) != 1:
+                raise ValueError(f'{len(matches)} messages of {mode.name}, expected 1')
+            messages.append(matches[0])
+        return messages
+
+    @staticmethod
+    def _latlons(message) -> Tuple[np.ndarray, np.ndarray]:
+        """flat lat/lon mesh of the grid of message, computed once per grid definition"""
+        key = tuple(message[key] if message.has_key(key) else None for key in GRIBExtractor.GRID_KEYS)
+        cached = GRIBExtractor._latlons_cache.get(key)
+        if cached is None:
+            lats, longs = message.latlons()
+            cached = lats.ravel(), longs.ravel()
+            for array in cached:
+                array.flags.writeable = False
+            if len(GRIBExtractor._latlons_cache) >= GRIBExtractor.LATLONS_CACHE_SIZE:
+                GRIBExtractor._latlons_cache.pop(next(iter(GRIBExtractor._latlons_cache)))
+            GRIBExtractor._latlons_cache[key] = cached
+        return cached
+
+    def extract_grid(self, *modes: GRIBEnum, region: Optional[GRIBRegion] = None) -> GRIBGrid:
+        """
+        array version of extract: the values of every mode on the grid, with the coordinates of its points.
+        the messages are found in a single pass over the file, and the lat/lon mesh is computed once per grid
+
+        :param region: if given, the grid is cropped to the rows and columns within it
+        :raises ValueError: if a mode has no message in the file, the messages are not on the same grid,
+                            or no point of the grid is in the region
+        """
+        messages = self._scan(modes)
+        grid_shape = shape = (messages[0]['Nj'], messages[0]['Ni'])
+        lats, longs = GRIBExtractor._latlons(messages[0])
+        inside = None
+        if region is not None:
+            # rows and columns of a regular grid, cropping keeps the grid rectangular
+            rows = region.contains(lats.reshape(grid_shape)[:, 0], region.left)
+            columns = region.contains(region.bottom, longs.reshape(grid_shape)[0, :])
+            inside = np.outer(rows, columns).ravel()
+            shape = (int(rows.sum()), int(columns.sum()))
+            if not all(shape):
+                raise ValueError(f'{region} contains no point of the grid')
+            lats, longs = lats[inside], longs[inside]
+        values = dict()
+        for mode, prop_msg in zip(modes, messages):
+            prop_values = prop_msg.values  # decodes the message
+            if prop_values.shape != grid_shape:
+                raise ValueError(f'{mode.name} is not on the grid of {modes[0].name}')
+            # masked (missing) values become NaN
+            values[mode] = np.ma.filled(np.ma.asarray(prop_values, dtype=np.float32), np.nan).ravel()
+            if inside is not None:
+                values[mode] = values[mode][inside]
+        return GRIBGrid(shape, lats, longs, values)
+
+    def extract(self, mode: GRIBEnum) -> dict:
+        self.data = dict()  # creates a new dictionary to store data
+        try:
+            prop_msg = self._select(mode)
+        except ValueError:
+            print('error: grib-no-matches-found')
         else:
-            go_on = True
-        if go_on:
             prop_values = prop_msg.values  # values under the started property
             lats, longs = prop_msg.latlons()
             for row_cnt in range(0, len(prop_values)):
@@ -85,6 +222,11 @@ if __name__ == '__main__':
     tmp = grib_extractor.extract(GRIBEnum.NOAA_TMP)
     soilw = grib_extractor.extract(GRIBEnum.NOAA_SOILW)
 
+    # or all of them at once, as arrays indexed by gid
+    grid = grib_extractor.extract_grid(GRIBEnum.NOAA_WIND_U, GRIBEnum.NOAA_WIND_V, GRIBEnum.NOAA_TMP,
+                                       GRIBEnum.NOAA_SOILW)
+    print(grid.shape, {mode.name: values.nbytes for mode, values in grid.values.items()})
+
     # to see the names of the attributes in the grib file
     grib_info_file = pygrib.open(os.path.join(GRIB2_DATA_DIR, '2019072218.f000')).read()
     for each_attribute in grib_info_file:
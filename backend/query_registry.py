@@ -0,0 +1,73 @@
+import logging
+import threading
+import weakref
+from typing import Dict, Sequence, Any, Set
+
+import psycopg2.errors
+import psycopg2.extensions
+
+logger = logging.getLogger('TaskManager')
+
+
+class QueryRegistry:
+    """
+    Registry of named SQL statements, declared once and server-side PREPAREd on each pooled connection.
+
+    Statements use PostgreSQL placeholders ($1, $2, ...). The first execution on a connection sends
+    `PREPARE name AS sql`, later executions only send `EXECUTE name (...)`, so the plan is reused.
+    Statements can not be used with named (server-side) cursors, since DECLARE does not accept EXECUTE.
+    """
+    _statements: Dict[str, str] = dict()
+    # connection -> names of the statements already prepared in its session
+    _prepared = weakref.WeakKeyDictionary()  # type: weakref.WeakKeyDictionary
+    _lock = threading.Lock()
+
+    @staticmethod
+    def register(name: str, sql: str) -> str:
+        """
+        declares a statement
+
+        :param name: statement name, must be a valid SQL identifier and unique within the process
+        :param sql: statement with $n placeholders
+        :return: the name, so that it can be kept as a module constant
+        """
+        with QueryRegistry._lock:
+            if QueryRegistry._statements.get(name, sql) != sql:
+                raise ValueError(f'Statement {name} is already registered with a different SQL')
+            QueryRegistry._statements[name] = sql
+        return name
+
+    @staticmethod
+    def execute(cursor, name: str, params: Sequence[Any] = ()) -> None:
+        """
+        executes a registered statement on the cursor, preparing it first if its connection has not yet
+
+        :param cursor: cursor of a pooled connection
+        :param name: name given to register()
+        :param params: values for $1, $2, ...
+        """
+        connection = cursor.connection
+        # the rollback below would discard earlier statements of the caller's transaction
+        idle = connection.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        try:
+            QueryRegistry._execute(cursor, connection, name, params)
+        except psycopg2.errors.InvalidSqlStatementName:
+            # the session lost its prepared statements (e.g. DISCARD ALL), they are prepared again on next use
+            QueryRegistry._prepared.pop(connection, None)
+            if not idle:
+                raise
+            # nothing of the caller is lost, retried at once
+            logger.warning(f"[DATABASE] prepared statement {name} vanished, preparing it again")
+            connection.rollback()
+            QueryRegistry._execute(cursor, connection, name, params)
+
+    @staticmethod
+    def _execute(cursor, connection, name: str, params: Sequence[Any]) -> None:
+        prepared: Set[str] = QueryRegistry._prepared.setdefault(connection, set())
+        if name not in prepared:
+            cursor.execute(f'PREPARE {name} AS {QueryRegistry._statements[name]}')
+            prepared.add(name)
+        if params:
+            cursor.execute(f'EXECUTE {name} ({", ".join(["%s"] * len(params))})', tuple(params))
+        else:
+            cursor.execute(f'EXECUTE {name}')
@@ -0,0 +1,133 @@
+"""
+Raster storage of the NOAA and PRISM grids, the alternative to the row per grid point tables noaa0p25 and prism.
+
+Each timestep of a variable is one row holding the whole grid as a real[], which TOAST compresses, and values
+at a set of gids are read with the server-side functions noaa0p25_raster_values and prism_raster_values.
+Enabled by `raster = true` in the [storage] section of configs/database.ini, the tables and functions are
+created by sql/raster_storage.sql. Dumpers keep publishing data events on 'noaa0p25' and 'prism'.
+"""
+import io
+import struct
+import uuid
+from datetime import date
+from typing import Any, Dict, Iterable, Sequence
+
+import numpy as np
+import rootpath
+
+rootpath.append()
+from backend.utilities.ini_parser import parse
+from paths import DATABASE_CONFIG_PATH
+
+# columns of the global 0.25 degree grid, gid = row * NOAA_COLUMNS + column
+NOAA_COLUMNS = 1440
+
+# grids are sent with COPY in the binary format, the values as float4 and never as text
+# (https://www.postgresql.org/docs/current/sql-copy.html, binary format)
+COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+COPY_TRAILER = struct.pack('>h', -1)
+FLOAT4_OID = 700
+# dates are sent as days since the postgres epoch
+POSTGRES_EPOCH = date(2000, 1, 1)
+
+NOAA_COLUMNS_RASTER = ('tid', 'variable', 'first_row', 'first_column', 'rows', 'columns', 'data')
+PRISM_COLUMNS_RASTER = ('date', 'variable', 'data')
+
+# rows are copied into a staging table, then merged, {staging} is its name
+SQL_STAGING = 'CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA'
+SQL_COPY_BINARY = 'COPY {staging} ({columns}) FROM STDIN WITH (FORMAT binary)'
+
+SQL_UPSERT_NOAA = '''
+INSERT INTO noaa0p25_raster (tid, variable, first_row, first_column, rows, columns, data)
+SELECT tid, variable, first_row, first_column, rows, columns, data FROM {staging}
+ON CONFLICT (tid, variable) DO UPDATE SET first_row = EXCLUDED.first_row, first_column = EXCLUDED.first_column,
+    rows = EXCLUDED.rows, columns = EXCLUDED.columns, data = EXCLUDED.data'''
+
+SQL_UPSERT_PRISM = '''
+INSERT INTO prism_raster (date, variable, data) SELECT date, variable, data FROM {staging}
+ON CONFLICT (date, variable) DO UPDATE SET data = EXCLUDED.data'''
+
+
+def enabled() -> bool:
+    """whether the raster storage is selected in the database config, row storage otherwise"""
+    try:
+        return parse(DATABASE_CONFIG_PATH, 'storage', 'raster').strip().lower() in ('true', 'yes', 'on', '1')
+    except KeyError:
+        return False
+
+
+ENABLED = enabled()
+
+
+def array_binary(values: np.ndarray) -> bytes:
+    """binary format of a one-dimensional real[] of values, NaN as NULL"""
+    values = np.asarray(values, dtype=np.float32).ravel()
+    if not len(values):
+        return struct.pack('>iii', 0, 0, FLOAT4_OID)
+    nulls = np.isnan(values)
+    # every element is its length then its value, a NULL element is the length -1 alone
+    elements = np.empty(len(values), dtype=[('length', '>i4'), ('value', '>f4')])
+    elements['length'] = np.where(nulls, -1, 4)
+    elements['value'] = values
+    keep = np.ones((len(values), 8), dtype=bool)
+    keep[nulls, 4:] = False
+    header = struct.pack('>iiiii', 1, int(nulls.any()), FLOAT4_OID, len(values), 1)
+    return header + elements.view(np.uint8).reshape(-1, 8)[keep].tobytes()
+
+
+def copy_binary(rows: Iterable[Sequence[Any]]) -> bytes:
+    """COPY data in the binary format of rows of int (int4), str (text), date and np.ndarray (real[]) fields"""
+    parts = [COPY_HEADER]
+    for row in rows:
+        parts.append(struct.pack('>h', len(row)))
+        for field in row:
+            if isinstance(field, np.ndarray):
+                data = array_binary(field)
+            elif isinstance(field, str):
+                data = field.encode()
+            elif isinstance(field, date):
+                data = struct.pack('>i', (field - POSTGRES_EPOCH).days)
+            else:
+                data = struct.pack('>i', int(field))
+            parts.append(struct.pack('>i', len(data)))
+            parts.append(data)
+    parts.append(COPY_TRAILER)
+    return b''.join(parts)
+
+
+def _upsert(cur, table: str, columns: Sequence[str], upsert: str, rows: Iterable[Sequence[Any]]) -> None:
+    staging = f'staging_{uuid.uuid4().hex}'
+    column_list = ', '.join(columns)
+    cur.execute(SQL_STAGING.format(staging=staging, columns=column_list, table=table))
+    cur.copy_expert(SQL_COPY_BINARY.format(staging=staging, columns=column_list), io.BytesIO(copy_binary(rows)))
+    cur.execute(upsert.format(staging=staging))
+
+
+def insert_noaa(cur, tid: int, gids: np.ndarray, shape, variables: Dict[str, np.ndarray]) -> int:
+    """
+    stores the grids of a tid, in the transaction of cur
+
+    :param gids: gids of the grid points, a row-major block of the global grid (NOAADumper.gids)
+    :param shape: (rows, columns) of the block
+    :param variables: column name in noaa0p25 -> values of the grid points
+    :return: number of grid points stored
+    """
+    rows, columns = shape
+    first_row, first_column = divmod(int(gids[0]), NOAA_COLUMNS)
+    block = ((first_row + np.arange(rows))[:, None] * NOAA_COLUMNS + first_column + np.arange(columns)).ravel()
+    if not np.array_equal(gids, block):
+        raise ValueError(f'grid of {tid} is not a row-major block of the global grid')
+    _upsert(cur, 'noaa0p25_raster', NOAA_COLUMNS_RASTER, SQL_UPSERT_NOAA,
+            [(tid, variable, first_row, first_column, rows, columns, values) for variable, values in variables.items()])
+    return len(gids)
+
+
+def insert_prism(cur, day: date, variable: str, values: np.ndarray) -> int:
+    """
+    stores the grid of a PRISM variable of a day, in the transaction of cur
+
+    :param values: flattened grid, values[gid]
+    :return: number of grid points stored
+    """
+    _upsert(cur, 'prism_raster', PRISM_COLUMNS_RASTER, SQL_UPSERT_PRISM, [(day, variable, values)])
+    return len(values)
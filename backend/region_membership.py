@@ -0,0 +1,45 @@
+"""
+Membership of NOAA grid points and tweets in administrative regions (states, counties, cities),
+in the tables region_noaa_gid and tweet_region of sql/region_membership.sql.
+
+The tables are backfilled by running sql/region_membership.sql, then kept up to date by the dumpers: TweetDumper
+assigns every upserted tweet, NOAADumper assigns grid points when it adds them to noaa0p25_geometry.
+Endpoints reading them check filled() first, an empty table means the backfill was not run.
+"""
+import logging
+from typing import Sequence, Set
+
+import rootpath
+
+rootpath.append()
+from backend.connection import Connection
+
+logger = logging.getLogger('TaskManager')
+
+# table -> whether it has a row, raising if it does not exist
+SQL_FILLED = 'SELECT EXISTS (SELECT 1 FROM {table})'
+
+SQL_REFRESH_NOAA_EXISTS = "SELECT to_regproc('refresh_region_noaa_gid') IS NOT NULL"
+SQL_REFRESH_NOAA = 'SELECT refresh_region_noaa_gid(%s)'
+
+# tables found filled, they are not emptied again
+_filled: Set[str] = set()
+
+
+def filled(table: str) -> bool:
+    """whether a membership table has rows, logged if it does not"""
+    if table not in _filled:
+        (exists,), = Connection.sql_execute(SQL_FILLED.format(table=table))
+        if not exists:
+            logger.error(f'{table} is empty, run sql/region_membership.sql')
+            return False
+        _filled.add(table)
+    return True
+
+
+def refresh_noaa_gids(cursor, gids: Sequence[int]) -> None:
+    """assigns grid points of noaa0p25_geometry to regions, in the transaction of cursor, once the backfill exists"""
+    cursor.execute(SQL_REFRESH_NOAA_EXISTS)
+    exists, = cursor.fetchone()
+    if exists:
+        cursor.execute(SQL_REFRESH_NOAA, (list(gids),))
@@ -2,10 +2,16 @@
 @author: Tingxuan Gu
 """
 import logging
+import multiprocessing
 import os
+import queue
 import sys
+import threading
 import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Generator, List, Optional, Tuple
 
 import rootpath
 
@@ -13,16 +19,47 @@ rootpath.append()
 from paths import GRIB2_DATA_DIR
 from backend.task.runnable import Runnable
 from backend.data_preparation.crawler.noaa_crawler import NOAACrawler
-from backend.data_preparation.extractor.grib_extractor import GRIBExtractor, GRIBEnum
+from backend.data_preparation.extractor.grib_extractor import GRIBExtractor, GRIBGrid, GRIBRegion, REGIONS
 from backend.data_preparation.dumper.noaa_dumper import NOAADumper
+from backend.utilities.grib_converter import GribConverter
 
 logger = logging.getLogger('TaskManager')
 
 
+def decode(stamp: str, region: GRIBRegion) -> Tuple[GRIBGrid, Optional[List[Dict]]]:
+    """
+    grid of the variables of noaa0p25 and global wind field records of a downloaded timestamp, None if it has no
+    wind. module level, to be run in a worker process
+
+    :param region: the grid is cropped to it, in case the file covers more than the requested region,
+                   the wind field is read from the global file of NOAACrawler.wind_filepath
+    :raises ValueError: if variables of noaa0p25 are missing
+    """
+    filepath = os.path.join(GRIB2_DATA_DIR, stamp + '.f000')
+    grid = GRIBExtractor(filepath).extract_grid(*NOAADumper.MODES, region=region)
+    wind_filepath = NOAACrawler.wind_filepath(stamp, region)
+    try:
+        wind = GribConverter.wind_field(wind_filepath) if os.path.isfile(wind_filepath) else None
+    except ValueError:
+        wind = None
+    return grid, wind
+
+
 class DataFromNoaa(Runnable):
     """
     This class is responsible for crawling data from NOAA, extracting them and dumping them into db.
+
+    With '-r <name>' (a name of REGIONS) or '-r <left>,<right>,<top>,<bottom>', only a region of the GFS grid is
+    downloaded and dumped, CONUS by default, '-r global' for the whole globe. Longitudes of a bounding box may be
+    given west of Greenwich as negative degrees (e.g. '-r -126,-66,50,24'), see GRIBRegion.parse.
+
+    With '-p', missing timestamps are backfilled by a pipeline: DOWNLOAD_WORKERS threads download files,
+    DECODE_WORKERS processes decode them and a single writer loads them into the database, the stages being
+    connected by queues of QUEUE_SIZE items, which caps the files on disk and the grids in memory.
     """
+    DOWNLOAD_WORKERS = 4
+    DECODE_WORKERS = min(4, os.cpu_count() or 1)
+    QUEUE_SIZE = 2
 
     def __init__(self):
         self.crawler = NOAACrawler()
@@ -33,9 +70,38 @@ class DataFromNoaa(Runnable):
         The key function called by task manager.
         :return: None
         """
-        for arg in sys.argv:
+        pipelined = False
+        for arg, value in zip(sys.argv, sys.argv[1:] + ['']):
             if arg == '-j':
                 self.crawler.useJavaConverter = True  # use java version of grib2json, if '-j' appeared
+            elif arg == '-p':
+                pipelined = True  # download, decode and dump several timestamps at once, if '-p' appeared
+            elif arg == '-r':
+                self.crawler.region = REGIONS[value] if value in REGIONS else GRIBRegion.parse(value)
+
+        if pipelined:
+            self.run_pipelined()
+        else:
+            for time_t in self.missing_times():
+                logger.info('start crawling')
+                # crawl the data from website
+                stamp = self.crawler.crawl(time_t)
+
+                # extract data from files
+                try:
+                    grid, wind = decode(stamp, self.crawler.region)
+                except Exception:
+                    logger.error(f'{stamp} not decoded, skipped: {traceback.format_exc()}')
+                else:
+                    logger.info('extraction finished')
+                    self.dump(time_t, stamp, grid, wind)
+                finally:
+                    # remove the dumped data file
+                    self.crawler.remove_grib2_file(stamp)
+        logger.info('time to sleep')
+
+    def missing_times(self) -> Generator[datetime, None, None]:
+        """timestamps of the last 240 hours not in the database yet, latest first"""
         exists_list = self.crawler.get_exists()
 
         # get data from noaa.gov
@@ -51,27 +117,91 @@ class DataFromNoaa(Runnable):
             microseconds=begin_time.microsecond)
         while time_t >= end_time:
             if (time_t,) not in exists_list:
-                logger.info('start crawling')
-                # crawl the data from website
-                stamp = self.crawler.crawl(time_t)
+                yield time_t
+            time_t -= timedelta(hours=self.crawler.interval)
 
-                # extract data from files
-                extractor = GRIBExtractor(os.path.join(GRIB2_DATA_DIR, stamp + '.f000'))
-                ugnd = extractor.extract(GRIBEnum.NOAA_WIND_U)
-                vgnd = extractor.extract(GRIBEnum.NOAA_WIND_V)
-                tmp = extractor.extract(GRIBEnum.NOAA_TMP)
-                soilw = extractor.extract(GRIBEnum.NOAA_SOILW)
-                logger.info('extraction finished')
+    def dump(self, time_t: datetime, stamp: str, grid: GRIBGrid, wind: Optional[List[Dict]]) -> None:
+        # dump the extracted data into database
+        self.dumper.insert(grid, time_t, stamp)
+        logger.info('dumping finished')
 
-                # dump the extracted data into database
-                self.dumper.insert(ugnd, vgnd, tmp, soilw, time_t, stamp)
-                logger.info('dumping finished')
+        # build the wind field served by /data/wind
+        if wind is None:
+            logger.error(f'no wind components in {stamp}, wind field not built')
+        else:
+            self.dumper.insert_wind_field(int(stamp), wind)
 
-                # remove the dumped data file
-                self.crawler.remove_grib2_file(stamp)
+    def run_pipelined(self) -> None:
+        times = queue.Queue()
+        downloaded = queue.Queue(maxsize=self.QUEUE_SIZE)
+        decoded = queue.Queue(maxsize=self.QUEUE_SIZE)
 
-            time_t -= timedelta(hours=self.crawler.interval)
-        logger.info('time to sleep')
+        def download(time_t: datetime) -> Optional[Tuple[datetime, str]]:
+            stamp = self.crawler.crawl(time_t)
+            if not os.path.isfile(os.path.join(GRIB2_DATA_DIR, stamp + '.f000')):
+                return None  # not published (yet), logged by the crawler
+            return time_t, stamp
+
+        # workers are spawned, not forked: the pool starts them lazily, once the threads below hold locks
+        with ProcessPoolExecutor(self.DECODE_WORKERS, mp_context=multiprocessing.get_context('spawn')) as pool:
+            def decode_in_pool(item: Tuple[datetime, str]) -> Optional[Tuple]:
+                time_t, stamp = item
+                decoded_item = None
+                try:
+                    decoded_item = (time_t, stamp, *pool.submit(decode, stamp, self.crawler.region).result())
+                except Exception:
+                    # any error of the decoders, e.g. RuntimeError of pygrib, or a broken pool
+                    logger.error(f'{stamp} not decoded, skipped: {traceback.format_exc()}')
+                finally:
+                    if decoded_item is None:
+                        # the file is removed by the writer once dumped, here if it never reaches it
+                        self.crawler.remove_grib2_file(stamp)
+                return decoded_item
+
+            DataFromNoaa._stage(download, self.DOWNLOAD_WORKERS, times, downloaded, self.DECODE_WORKERS)
+            DataFromNoaa._stage(decode_in_pool, self.DECODE_WORKERS, downloaded, decoded, 1)
+            for time_t in self.missing_times():
+                times.put(time_t)
+            for _ in range(self.DOWNLOAD_WORKERS):
+                times.put(None)
+
+            # the single writer, bulk loads one timestamp after another
+            for time_t, stamp, grid, wind in iter(decoded.get, None):
+                try:
+                    self.dump(time_t, stamp, grid, wind)
+                except Exception:
+                    logger.error(f'{stamp} not dumped: {traceback.format_exc()}')
+                finally:
+                    self.crawler.remove_grib2_file(stamp)
+
+    @staticmethod
+    def _stage(work: Callable, workers: int, source: queue.Queue, sink: queue.Queue, sink_workers: int) -> None:
+        """
+        starts threads putting work(item) of every item of source into sink, None results are dropped.
+        source is closed by one None per worker, sink is closed the same way for sink_workers once they are done
+        """
+
+        def worker():
+            for item in iter(source.get, None):
+                try:
+                    result = work(item)
+                except Exception:
+                    logger.error('error: ' + traceback.format_exc())
+                    continue
+                if result is not None:
+                    sink.put(result)
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+
+        def close():
+            for thread in threads:
+                thread.join()
+            for _ in range(sink_workers):
+                sink.put(None)
+
+        threading.Thread(target=close, daemon=True).start()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,157 @@
+import math
+import struct
+import time
+import unittest
+from datetime import date, datetime
+
+import psycopg2
+import rootpath
+
+rootpath.append()
+from backend import connection
+from backend.connection import Connection, _BINARY_ENCODERS, _CopyBinaryReader, _CopyRowReader, _copy_value
+
+
+def read_all(reader, size: int):
+    """everything a reader gives, read in chunks of size as copy_expert does"""
+    chunks = []
+    while True:
+        chunk = reader.read(size)
+        if not chunk:
+            return type(chunk)().join(chunks)
+        chunks.append(chunk)
+
+
+def read_binary_rows(data: bytes) -> list:
+    """rows of COPY binary data, as lists of the raw bytes of the fields, None for NULL"""
+    header = connection._COPY_BINARY_HEADER
+    assert data.startswith(header)
+    rows, offset = [], len(header)
+    while True:
+        count, = struct.unpack_from('>h', data, offset)
+        offset += 2
+        if count == -1:
+            break
+        row = []
+        for _ in range(count):
+            size, = struct.unpack_from('>i', data, offset)
+            offset += 4
+            row.append(None if size == -1 else data[offset:offset + size])
+            offset += max(size, 0)
+        rows.append(row)
+    assert offset == len(data)
+    return rows
+
+
+class CopyTextTest(unittest.TestCase):
+    def test_values(self):
+        self.assertEqual(_copy_value(None), '\\N')
+        self.assertEqual(_copy_value(True), 't')
+        self.assertEqual(_copy_value(math.nan), 'nan')
+        self.assertEqual(_copy_value(-math.inf), '-Infinity')
+        self.assertEqual(_copy_value(0.1), '0.1')
+        self.assertEqual(_copy_value(datetime(2019, 8, 1, 10, 30)), '2019-08-01T10:30:00')
+        self.assertEqual(_copy_value(b'\x00\xff'), '\\\\x00ff')
+
+    def test_escapes(self):
+        self.assertEqual(_copy_value('a\tb\nc\rd\\e'), 'a\\tb\\nc\\rd\\\\e')
+
+    def test_reader_in_chunks(self):
+        rows = [(1, 'a\tb', None), (2, 'c', 0.5)]
+        self.assertEqual(read_all(_CopyRowReader(rows), 3), '1\ta\\tb\t\\N\n2\tc\t0.5\n')
+
+
+class CopyBinaryTest(unittest.TestCase):
+    def test_reader_in_chunks(self):
+        encoders = [_BINARY_ENCODERS[oid] for oid in (20, 701, 25)]
+        data = read_all(_CopyBinaryReader([(1, math.nan, 'a\tb'), (2, None, None)], encoders), 5)
+        first, second = read_binary_rows(data)
+        self.assertEqual(struct.unpack('>q', first[0])[0], 1)
+        self.assertTrue(math.isnan(struct.unpack('>d', first[1])[0]))
+        self.assertEqual(first[2], b'a\tb')
+        self.assertEqual(second[1:], [None, None])
+
+    def test_no_rows(self):
+        self.assertEqual(read_binary_rows(read_all(_CopyBinaryReader([], [_BINARY_ENCODERS[23]]), 4)), [])
+
+    def test_dates(self):
+        self.assertEqual(struct.unpack('>i', _BINARY_ENCODERS[1082](date(2000, 1, 3)))[0], 2)
+        self.assertEqual(struct.unpack('>q', _BINARY_ENCODERS[1114](datetime(2000, 1, 1, 0, 0, 1, 5)))[0], 1000005)
+        self.assertEqual(struct.unpack('>q', _BINARY_ENCODERS[1114](date(1999, 12, 31)))[0], -86400 * 10 ** 6)
+
+    def test_integers_are_not_truncated(self):
+        with self.assertRaises(TypeError):
+            _BINARY_ENCODERS[23](1.5)
+
+
+class CopyRowsTest(unittest.TestCase):
+    """copy_rows against the database of configs/database.ini, in both formats, skipped without a database"""
+
+    def setUp(self):
+        try:
+            self.pooled = Connection()
+            self.connection = self.pooled.__enter__()
+        except (KeyError, psycopg2.Error) as err:
+            self.skipTest(f'no database: {err}')
+
+    def tearDown(self):
+        self.connection.rollback()
+        self.pooled.__exit__(None, None, None)
+
+    def round_trip(self, types: str, rows: list) -> list:
+        cur = self.connection.cursor()
+        cur.execute(f'CREATE TEMP TABLE copy_test ({types}) ON COMMIT DROP')
+        columns = [f'c{i}' for i in range(len(rows[0]))]
+        Connection.copy_rows('copy_test', columns, rows, None, self.connection)
+        cur.execute('SELECT * FROM copy_test')
+        return cur.fetchall()
+
+    def test_binary(self):
+        rows = [(1, 2 ** 40, 0.25, math.nan, 'a\tb\nc\\', date(2019, 8, 1), datetime(2019, 8, 1, 10, 30, 0, 7), True),
+                (2, None, None, None, None, None, None, None)]
+        result = self.round_trip('c0 int4, c1 int8, c2 float4, c3 float8, c4 text, c5 date, c6 timestamp, c7 bool',
+                                 rows)
+        self.assertTrue(math.isnan(result[0][3]))
+        self.assertEqual(result[0][:3] + result[0][4:], rows[0][:3] + rows[0][4:])
+        self.assertEqual(result[1], rows[1])
+
+    def test_text(self):
+        # numeric has no binary encoder, the rows are sent in the text format
+        rows = [(1, 'a\tb\nc\\', math.nan), (2, None, None)]
+        result = self.round_trip('c0 int4, c1 text, c2 numeric', rows)
+        self.assertEqual(result[0][1], 'a\tb\nc\\')
+        self.assertTrue(math.isnan(result[0][2]))
+        self.assertEqual(result[1], rows[1])
+
+
+class StreamTimeoutTest(unittest.TestCase):
+    """the limits of sql_execute_stream against the database of configs/database.ini, skipped without a database"""
+
+    def setUp(self):
+        try:
+            with Connection():
+                pass
+        except (KeyError, psycopg2.Error) as err:
+            self.skipTest(f'no database: {err}')
+
+    def test_slow_query_is_cancelled_before_the_first_row(self):
+        rows = Connection.sql_execute_stream('SELECT pg_sleep(2)', max_seconds=0.5)
+        with self.assertRaises(TimeoutError):
+            next(rows)
+        # the timeout was local to the transaction of the stream
+        with Connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute('SHOW statement_timeout')
+            self.assertNotEqual(cursor.fetchone()[0], '500ms')
+            connection.rollback()
+
+    def test_slow_consumer(self):
+        rows = Connection.sql_execute_stream('SELECT generate_series(1, 10)', itersize=2, max_seconds=0.2)
+        self.assertEqual(next(rows), (1,))
+        time.sleep(0.3)
+        with self.assertRaises(TimeoutError):
+            list(rows)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import json
+import unittest
+
+import rootpath
+from flask import Flask
+
+rootpath.append()
+from backend.utilities import json_response
+from backend.utilities.json_response import stream_json_array
+
+
+def timing_out(items: list):
+    """yields items, then raises TimeoutError as Connection.sql_execute_stream does past its deadline"""
+    yield from items
+    raise TimeoutError('stream held its connection for more than 1s')
+
+
+class StreamJsonArrayTest(unittest.TestCase):
+    def setUp(self):
+        self.context = Flask(__name__).test_request_context()
+        self.context.push()
+        self.chunk_size = json_response.STREAM_CHUNK_SIZE
+
+    def tearDown(self):
+        json_response.STREAM_CHUNK_SIZE = self.chunk_size
+        self.context.pop()
+
+    def body(self, response) -> list:
+        return json.loads(b''.join(response.response))
+
+    def test_items(self):
+        response = stream_json_array(iter([{'id': '1'}, [2, None]]), compress=False)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), [{'id': '1'}, [2, None]])
+
+    def test_timeout_before_the_first_byte(self):
+        response = stream_json_array(timing_out([1, 2]), compress=False)
+        self.assertEqual(response.status_code, 504)
+
+    def test_timeout_while_sending(self):
+        # every item is a chunk of its own, the first one is sent before the stream times out
+        json_response.STREAM_CHUNK_SIZE = 1
+        response = stream_json_array(timing_out([1, 2]), compress=False)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), [1, 2, {'error': 'stream held its connection for more than 1s'}])
+
+    def test_timeout_right_after_a_chunk(self):
+        json_response.STREAM_CHUNK_SIZE = 1
+        response = stream_json_array(timing_out([1]), compress=False)
+        self.assertEqual(self.body(response), [1, {'error': 'stream held its connection for more than 1s'}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+import numpy as np
+import rootpath
+
+rootpath.append()
+from backend.data_preparation.dumper.noaa_dumper import NOAADumper
+from backend.data_preparation.extractor.grib_extractor import REGIONS, GRIBGrid
+
+
+def gfs_grid(region=None) -> GRIBGrid:
+    """the lat/lon mesh of the global GFS 0.25 degree grid, rows from 90 to -90, cropped to a region if given"""
+    lats, lons = np.meshgrid(np.linspace(90, -90, 721), np.arange(1440) * 0.25, indexing='ij')
+    lats, lons = lats.ravel(), lons.ravel()
+    shape = (721, 1440)
+    if region is not None:
+        rows = region.contains(lats.reshape(shape)[:, 0], region.left)
+        columns = region.contains(region.bottom, lons.reshape(shape)[0, :])
+        inside = np.outer(rows, columns).ravel()
+        shape = (int(rows.sum()), int(columns.sum()))
+        lats, lons = lats[inside], lons[inside]
+    return GRIBGrid(shape, lats, lons, dict())
+
+
+class GidsTest(unittest.TestCase):
+    def test_global_gids_are_the_former_enumeration(self):
+        # before regions, gids enumerated the points of the global grid, rows stored then must stay valid
+        np.testing.assert_array_equal(NOAADumper.gids(gfs_grid()), np.arange(721 * 1440))
+
+    def test_regional_gids_are_global_gids(self):
+        grid = gfs_grid()
+        conus = gfs_grid(REGIONS['conus'])
+        gids = NOAADumper.gids(conus)
+        self.assertEqual(len(gids), conus.shape[0] * conus.shape[1])
+        # the same points, with the same gids, as in the global grid
+        np.testing.assert_array_equal(grid.lats[gids], conus.lats)
+        np.testing.assert_array_equal(grid.lons[gids], conus.lons)
+
+    def test_negative_longitudes(self):
+        grid = GRIBGrid((1, 2), np.array([0.0, 0.0]), np.array([-0.25, -120.0]), dict())
+        np.testing.assert_array_equal(NOAADumper.gids(grid), [360 * 1440 + 1439, 360 * 1440 + 960])
+
+
+if __name__ == '__main__':
+    unittest.main()
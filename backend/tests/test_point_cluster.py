@@ -0,0 +1,91 @@
+import unittest
+
+import numpy as np
+import rootpath
+
+rootpath.append()
+from backend.utilities.point_cluster import ClusterIndex, KDTree, lat_y, lng_x, merge_levels, x_lng, y_lat
+
+
+class KDTreeTest(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(0)
+        # more points than a leaf, so that the tree is split
+        self.xs = random.uniform(0, 1, 1000)
+        self.ys = random.uniform(0, 1, 1000)
+        self.tree = KDTree(self.xs, self.ys)
+
+    def test_range_matches_brute_force(self):
+        for box in [(0.2, 0.3, 0.6, 0.5), (0, 0, 1, 1), (0.9, 0.9, 0.95, 0.95), (2, 2, 3, 3)]:
+            min_x, min_y, max_x, max_y = box
+            expected = np.flatnonzero((self.xs >= min_x) & (self.xs <= max_x) &
+                                      (self.ys >= min_y) & (self.ys <= max_y))
+            self.assertEqual(sorted(self.tree.range(*box).tolist()), expected.tolist())
+
+    def test_within_matches_brute_force(self):
+        for x, y, radius in [(0.5, 0.5, 0.1), (0, 0, 0.2), (0.3, 0.7, 0)]:
+            expected = np.flatnonzero((self.xs - x) ** 2 + (self.ys - y) ** 2 <= radius ** 2)
+            self.assertEqual(sorted(self.tree.within(x, y, radius).tolist()), expected.tolist())
+
+    def test_empty_tree(self):
+        tree = KDTree(np.empty(0), np.empty(0))
+        self.assertEqual(len(tree.range(0, 0, 1, 1)), 0)
+        self.assertEqual(len(tree.within(0.5, 0.5, 1)), 0)
+
+
+class ProjectionTest(unittest.TestCase):
+    def test_round_trip(self):
+        longs = np.array([-179.5, -120.0, 0.0, 45.25])
+        lats = np.array([-80.0, 0.0, 38.68, 80.0])
+        np.testing.assert_allclose(x_lng(lng_x(longs)), longs)
+        np.testing.assert_allclose(y_lat(lat_y(lats)), lats, atol=1e-9)
+
+
+class ClusterIndexTest(unittest.TestCase):
+    def setUp(self):
+        # two groups of close points, far from each other, and a tweet id above 2 ** 53
+        self.longs = np.array([-120.0, -120.001, -120.002, -80.0, -80.001])
+        self.lats = np.array([38.0, 38.001, 38.002, 35.0, 35.001])
+        self.ids = np.array([1074292053801140224, 2, 3, 4, 5], dtype=np.int64)
+        self.index = ClusterIndex(self.longs, self.lats, self.ids, max_zoom=10)
+        self.bbox = (-180, -85, 180, 85)
+
+    def test_low_zoom_clusters_groups(self):
+        xs, ys, counts, ids = self.index.get_clusters(self.bbox, 3)
+        self.assertEqual(sorted(counts.tolist()), [2, 3])
+        self.assertEqual(ids.tolist(), [-1, -1])
+
+    def test_counts_are_kept_at_every_zoom(self):
+        for zoom in range(0, 12):
+            _, _, counts, _ = self.index.get_clusters(self.bbox, zoom)
+            self.assertEqual(counts.sum(), 5)
+
+    def test_above_max_zoom_returns_raw_points(self):
+        xs, ys, counts, ids = self.index.get_clusters(self.bbox, 15)
+        self.assertEqual(sorted(ids.tolist()), sorted(self.ids.tolist()))
+        self.assertEqual(counts.tolist(), [1] * 5)
+        np.testing.assert_allclose(sorted(x_lng(xs)), sorted(self.longs))
+
+    def test_bbox_filters(self):
+        _, _, counts, _ = self.index.get_clusters((-125, 30, -100, 45), 15)
+        self.assertEqual(counts.sum(), 3)
+
+    def test_cluster_at_weighted_centroid(self):
+        xs, ys, counts, _ = self.index.get_clusters((-125, 30, -100, 45), 3)
+        self.assertEqual(counts.tolist(), [3])
+        self.assertAlmostEqual(float(x_lng(xs)[0]), -120.001, places=6)
+
+    def test_merge_levels_of_several_days(self):
+        other = ClusterIndex(np.array([-120.0005]), np.array([38.0005]), np.array([6]), max_zoom=10)
+        levels = [index.get_clusters(self.bbox, 3) for index in (self.index, other)]
+        _, _, counts, _ = merge_levels(levels, 3)
+        self.assertEqual(sorted(counts.tolist()), [2, 4])
+
+    def test_empty_index(self):
+        index = ClusterIndex(np.empty(0), np.empty(0), np.empty(0, dtype=np.int64))
+        _, _, counts, _ = index.get_clusters(self.bbox, 5)
+        self.assertEqual(len(counts), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import io
+import math
+import struct
+import unittest
+from datetime import date
+
+import numpy as np
+import rootpath
+
+rootpath.append()
+from backend import raster_storage
+from backend.raster_storage import COPY_HEADER, COPY_TRAILER, FLOAT4_OID, NOAA_COLUMNS, array_binary, copy_binary
+
+
+def read_array(data: bytes) -> list:
+    """values of the binary format of a one-dimensional real[], NULL as None"""
+    ndim, _, oid = struct.unpack_from('>iii', data)
+    if ndim == 0:
+        return []
+    length, lower_bound = struct.unpack_from('>ii', data, 12)
+    assert (ndim, oid, lower_bound) == (1, FLOAT4_OID, 1)
+    values, offset = [], 20
+    for _ in range(length):
+        size, = struct.unpack_from('>i', data, offset)
+        offset += 4
+        if size == -1:
+            values.append(None)
+        else:
+            values.append(struct.unpack_from('>f', data, offset)[0])
+            offset += size
+    assert offset == len(data)
+    return values
+
+
+def read_copy(data: bytes) -> list:
+    """rows of COPY binary data, as lists of the raw bytes of the fields"""
+    assert data.startswith(COPY_HEADER) and data.endswith(COPY_TRAILER)
+    rows, offset = [], len(COPY_HEADER)
+    while True:
+        count, = struct.unpack_from('>h', data, offset)
+        offset += 2
+        if count == -1:
+            break
+        row = []
+        for _ in range(count):
+            size, = struct.unpack_from('>i', data, offset)
+            row.append(data[offset + 4:offset + 4 + size])
+            offset += 4 + size
+        rows.append(row)
+    assert offset == len(data)
+    return rows
+
+
+class FakeCursor:
+    """records the statements and the COPY data sent"""
+
+    def __init__(self):
+        self.statements = []
+        self.copied = []
+
+    def execute(self, sql, params=None):
+        self.statements.append(sql)
+
+    def copy_expert(self, sql, file: io.BytesIO):
+        self.statements.append(sql)
+        self.copied.append(file.read())
+
+
+class ArrayBinaryTest(unittest.TestCase):
+    def test_values_round_trip(self):
+        values = np.array([1.5, -2.25, 0, 300.125], dtype=np.float32)
+        self.assertEqual(read_array(array_binary(values)), values.tolist())
+
+    def test_nan_as_null(self):
+        data = array_binary(np.array([math.nan, 1.0, math.nan]))
+        self.assertEqual(read_array(data), [None, 1.0, None])
+        self.assertEqual(struct.unpack_from('>i', data, 4)[0], 1)  # has nulls
+
+    def test_without_null(self):
+        self.assertEqual(struct.unpack_from('>i', array_binary(np.ones(3)), 4)[0], 0)
+
+    def test_empty(self):
+        self.assertEqual(read_array(array_binary(np.empty(0))), [])
+
+
+class CopyBinaryTest(unittest.TestCase):
+    def test_fields(self):
+        rows = read_copy(copy_binary([(7, 'tmp', date(2000, 1, 3), np.array([1.0]))]))
+        self.assertEqual(len(rows), 1)
+        tid, variable, day, data = rows[0]
+        self.assertEqual(struct.unpack('>i', tid)[0], 7)
+        self.assertEqual(variable, b'tmp')
+        self.assertEqual(struct.unpack('>i', day)[0], 2)
+        self.assertEqual(read_array(data), [1.0])
+
+
+class InsertNoaaTest(unittest.TestCase):
+    def test_block_is_stored(self):
+        # rows 10..11, columns 5..7 of the global grid
+        gids = ((10 + np.arange(2))[:, None] * NOAA_COLUMNS + 5 + np.arange(3)).ravel()
+        cur = FakeCursor()
+        stored = raster_storage.insert_noaa(cur, 2019072218, gids, (2, 3), {
+            'tmp': np.arange(6, dtype=np.float32), 'soilw': np.full(6, math.nan)})
+        self.assertEqual(stored, 6)
+        rows = read_copy(cur.copied[0])
+        self.assertEqual(len(rows), 2)
+        tid, variable, first_row, first_column, block_rows, block_columns, data = rows[0]
+        self.assertEqual([struct.unpack('>i', field)[0] for field in (first_row, first_column, block_rows,
+                                                                      block_columns)], [10, 5, 2, 3])
+        self.assertEqual(variable, b'tmp')
+        self.assertEqual(read_array(data), list(range(6)))
+        self.assertEqual(read_array(rows[1][-1]), [None] * 6)
+        self.assertIn('ON CONFLICT', cur.statements[-1])
+
+    def test_not_a_block(self):
+        gids = np.array([0, 1, NOAA_COLUMNS + 2, NOAA_COLUMNS + 3])
+        with self.assertRaises(ValueError):
+            raster_storage.insert_noaa(FakeCursor(), 1, gids, (2, 2), {'tmp': np.zeros(4)})
+
+    def test_shape_mismatch(self):
+        with self.assertRaises(ValueError):
+            raster_storage.insert_noaa(FakeCursor(), 1, np.arange(4), (2, 3), {'tmp': np.zeros(4)})
+
+
+class InsertPrismTest(unittest.TestCase):
+    def test_grid_is_stored(self):
+        cur = FakeCursor()
+        self.assertEqual(raster_storage.insert_prism(cur, date(2019, 8, 6), 'ppt', np.array([0.5, math.nan])), 2)
+        day, variable, data = read_copy(cur.copied[0])[0]
+        self.assertEqual(struct.unpack('>i', day)[0], (date(2019, 8, 6) - date(2000, 1, 1)).days)
+        self.assertEqual(variable, b'ppt')
+        self.assertEqual(read_array(data), [0.5, None])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import threading
+import time
+import unittest
+import uuid
+
+import psycopg2
+import rootpath
+
+rootpath.append()
+from backend import tweet_rollups
+from backend.connection import Connection
+
+# a minimal records table, the columns read by the rollups
+SQL_CREATE_RECORDS = 'CREATE TABLE records (id bigint PRIMARY KEY, create_at timestamp, location geometry)'
+SQL_UPSERT_RECORDS = '''INSERT INTO records (id, create_at, location)
+SELECT * FROM unnest(%s::bigint[], %s::timestamp[], %s::text[]) ON CONFLICT (id) DO UPDATE
+SET create_at = excluded.create_at, location = excluded.location'''
+# the rollups computed from scratch, to compare the maintained ones with
+SQL_RECOUNT = '''SELECT create_at::date, count(*) FROM records
+WHERE location IS NOT NULL AND create_at IS NOT NULL GROUP BY 1 ORDER BY 1'''
+SQL_DAILY_COUNTS = 'SELECT day, cnt FROM tweet_daily_counts WHERE cnt <> 0 ORDER BY day'
+
+
+class MaintainedTest(unittest.TestCase):
+    """
+    the -1 / +1 bookkeeping of tweet_rollups.maintained, against the database of configs/database.ini,
+    in a schema of its own which is dropped afterwards, skipped without a database with PostGIS
+    """
+
+    def setUp(self):
+        self.schema = f'rollup_test_{uuid.uuid4().hex}'
+        try:
+            config = Connection.config()
+            for field in ["minconn", "maxconn"]:
+                config.pop(field, None)
+            self.connections = [psycopg2.connect(**config) for _ in range(2)]
+        except (KeyError, psycopg2.Error) as err:
+            self.skipTest(f'no database: {err}')
+        cur = self.connections[0].cursor()
+        try:
+            cur.execute(f'CREATE SCHEMA {self.schema}')
+            cur.execute(f'SET search_path TO {self.schema}, public')
+            cur.execute(SQL_CREATE_RECORDS)
+        except psycopg2.Error as err:
+            self.connections[0].rollback()
+            self.tearDown()
+            self.skipTest(f'no PostGIS: {err}')
+        tweet_rollups.create_tables(cur)
+        self.connections[0].commit()
+        for connection in self.connections:
+            connection.cursor().execute(f'SET search_path TO {self.schema}, public')
+            connection.commit()
+        tweet_rollups._built = True
+
+    def tearDown(self):
+        tweet_rollups._built = False
+        for connection in self.connections:
+            connection.rollback()
+        cur = self.connections[0].cursor()
+        cur.execute(f'DROP SCHEMA IF EXISTS {self.schema} CASCADE')
+        self.connections[0].commit()
+        for connection in self.connections:
+            connection.close()
+
+    def upsert(self, connection, rows, hold: float = 0) -> None:
+        """upserts rows (id, create_at, WKT) with the rollups maintained, holding the transaction for a while"""
+        cur = connection.cursor()
+        ids, stamps, locations = map(list, zip(*rows))
+        with tweet_rollups.maintained(cur, ids):
+            time.sleep(hold)
+            cur.execute(SQL_UPSERT_RECORDS, (ids, stamps, locations))
+        connection.commit()
+
+    def assert_counts_match_records(self) -> None:
+        cur = self.connections[0].cursor()
+        cur.execute(SQL_RECOUNT)
+        expected = cur.fetchall()
+        cur.execute(SQL_DAILY_COUNTS)
+        self.assertEqual(cur.fetchall(), expected)
+        self.connections[0].commit()
+
+    def test_update_moves_counts(self):
+        self.upsert(self.connections[0], [(1, '2019-08-01 10:00', 'POINT(-120 38)'), (2, '2019-08-01 11:00', None)])
+        self.upsert(self.connections[0], [(1, '2019-08-02 10:00', 'POINT(-120 38)'),
+                                          (2, '2019-08-01 11:00', 'POINT(-121 37)')])
+        self.assert_counts_match_records()
+
+    def test_concurrent_overlapping_batches(self):
+        self.upsert(self.connections[0], [(1, '2019-08-01 10:00', 'POINT(-120 38)')])
+        # the first batch holds its transaction, the second one starts meanwhile with an overlapping id
+        first = threading.Thread(target=self.upsert, args=(
+            self.connections[0], [(1, '2019-08-02 10:00', 'POINT(-120 38)'), (2, '2019-08-02 10:00', 'POINT(-80 35)')],
+            1))
+        first.start()
+        time.sleep(0.3)
+        self.upsert(self.connections[1], [(1, '2019-08-03 10:00', 'POINT(-120 38)')])
+        first.join()
+        self.assert_counts_match_records()
+
+
+if __name__ == '__main__':
+    unittest.main()
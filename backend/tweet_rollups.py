@@ -0,0 +1,148 @@
+"""
+Rollup tables derived from records, maintained incrementally by TweetDumper.
+
+Every rollup is a sum over rows of records, so that a batch of upserted tweets is applied as
+`apply(cur, ids, -1)` before the merge (removing what the old rows contributed) and `apply(cur, ids, 1)`
+after it, in the same transaction, which maintained() does around the merge.
+
+Running this module is the setup step: it creates the rollup tables and builds them from the whole records
+table in one transaction, rerunning it rebuilds them. Until then they do not exist (built() is false), are not
+maintained and readers query records instead. Writers take LOCK_RECORDS before built(), so that a batch
+upserted during a rebuild is either in the records it reads or applied after it, and one writer after the
+other: two batches of overlapping ids applied at once would both remove the old rows, then both add the new ones.
+"""
+import logging
+from contextlib import contextmanager
+from typing import Iterator, Sequence
+
+import rootpath
+
+rootpath.append()
+from backend.connection import Connection
+
+logger = logging.getLogger('TaskManager')
+
+# zoom levels of the tweet density grid, a cell of a level is the XYZ map tile of that zoom
+GRID_ZOOMS = (4, 6, 8, 10, 12)
+
+SQL_CREATE_TWEET_GRID = '''
+CREATE TABLE IF NOT EXISTS tweet_grid (
+    zoom smallint, x int, y int, day date, cnt int NOT NULL, long_sum float8 NOT NULL, lat_sum float8 NOT NULL,
+    PRIMARY KEY (zoom, day, x, y)
+)'''
+
+# counts of located tweets per grid cell and day, with coordinate sums to place the cell at its centroid
+SQL_APPLY_TWEET_GRID = '''
+INSERT INTO tweet_grid (zoom, x, y, day, cnt, long_sum, lat_sum)
+SELECT z.zoom,
+       floor((r.long + 180) / 360 * 2 ^ z.zoom)::int,
+       floor((1 - ln(tan(radians(r.lat)) + 1 / cos(radians(r.lat))) / pi()) / 2 * 2 ^ z.zoom)::int,
+       r.create_at::date, %(sign)s * count(*), %(sign)s * sum(r.long), %(sign)s * sum(r.lat)
+FROM (
+    SELECT create_at, st_x(location) as long, greatest(least(st_y(location), 85.0511), -85.0511) as lat
+    FROM records WHERE location IS NOT NULL AND create_at IS NOT NULL AND {condition}
+) r, unnest(%(zooms)s::int[]) z(zoom)
+GROUP BY 1, 2, 3, 4
+ON CONFLICT (zoom, day, x, y) DO UPDATE SET cnt = tweet_grid.cnt + excluded.cnt,
+    long_sum = tweet_grid.long_sum + excluded.long_sum, lat_sum = tweet_grid.lat_sum + excluded.lat_sum'''
+
+SQL_CREATE_TWEET_DAILY_COUNTS = '''
+CREATE TABLE IF NOT EXISTS tweet_daily_counts (day date PRIMARY KEY, cnt int NOT NULL)'''
+
+# counts of located tweets per day, served by /tweet/tweet-count
+SQL_APPLY_TWEET_DAILY_COUNTS = '''
+INSERT INTO tweet_daily_counts (day, cnt)
+SELECT create_at::date, %(sign)s * count(*) FROM records
+WHERE location IS NOT NULL AND create_at IS NOT NULL AND {condition}
+GROUP BY 1
+ON CONFLICT (day) DO UPDATE SET cnt = tweet_daily_counts.cnt + excluded.cnt'''
+
+ROLLUPS = {
+    'tweet_grid': (SQL_CREATE_TWEET_GRID, SQL_APPLY_TWEET_GRID),
+    'tweet_daily_counts': (SQL_CREATE_TWEET_DAILY_COUNTS, SQL_APPLY_TWEET_DAILY_COUNTS),
+}
+
+
+# taken by rebuild() for the whole build, writes to records wait for it
+SQL_LOCK_RECORDS_SHARE = 'LOCK TABLE records IN SHARE MODE'
+# taken by writers first, before anything of the rollups is read or locked, a mode conflicting with itself
+# and with SHARE, so that writers wait for each other and for a rebuild
+SQL_LOCK_RECORDS = 'LOCK TABLE records IN SHARE ROW EXCLUSIVE MODE'
+
+SQL_BUILT = 'SELECT ' + ' AND '.join(f"to_regclass('{table}') IS NOT NULL" for table in ROLLUPS)
+
+# rollups never go away once built, a positive answer is kept
+_built = False
+
+
+def built(cursor=None) -> bool:
+    """
+    whether the rollups were built by rebuild(), from then on they are maintained by TweetDumper
+
+    :param cursor: asked in its transaction, a pooled connection otherwise
+    """
+    global _built
+    if not _built:
+        if cursor is None:
+            _built, = next(Connection.sql_execute(SQL_BUILT))
+        else:
+            cursor.execute(SQL_BUILT)
+            _built, = cursor.fetchone()
+    return _built
+
+
+@contextmanager
+def maintained(cursor, ids: Sequence[int]) -> Iterator[None]:
+    """
+    keeps the rollups in step with the upsert of the records of ids run in the with block,
+    in the transaction of cursor, which holds the lock of records until it ends
+    """
+    cursor.execute(SQL_LOCK_RECORDS)
+    # asked after waiting for a rebuild
+    rollups = built(cursor)
+    if rollups:
+        # remove what the current rows contribute to the rollups, they are added back after the merge
+        apply(cursor, ids, -1)
+    yield
+    if rollups:
+        apply(cursor, ids, 1)
+
+
+def create_tables(cursor) -> None:
+    for create, _ in ROLLUPS.values():
+        cursor.execute(create)
+
+
+def apply(cursor, ids: Sequence[int], sign: int) -> None:
+    """
+    adds (sign=1) or removes (sign=-1) the contribution of the records rows with the given ids to every rollup
+
+    :param cursor: cursor of the transaction upserting the records
+    :param ids: ids of the upserted records
+    :param sign: 1 after the upsert, -1 before it
+    """
+    if not ids:
+        return
+    for _, statement in ROLLUPS.values():
+        cursor.execute(statement.format(condition='id = ANY(%(ids)s)'),
+                       {'sign': sign, 'ids': list(ids), 'zooms': list(GRID_ZOOMS)})
+
+
+def rebuild() -> None:
+    """truncates every rollup and computes it again from the whole records table"""
+    with Connection() as connection:
+        cur = connection.cursor()
+        cur.execute(SQL_LOCK_RECORDS_SHARE)
+        create_tables(cur)
+        for table, (_, statement) in ROLLUPS.items():
+            logger.info(f'[ROLLUP] rebuilding {table}')
+            cur.execute(f'TRUNCATE {table}')
+            cur.execute(statement.format(condition='true'), {'sign': 1, 'zooms': list(GRID_ZOOMS)})
+        connection.commit()
+        cur.close()
+
+
+if __name__ == '__main__':
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler())
+    rebuild()
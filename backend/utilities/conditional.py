@@ -0,0 +1,102 @@
+"""
+Conditional GET for read endpoints, validated by the versions of the tables they read (data_events.versions()).
+
+Views declare their tables with @reads('records', ...). Their responses get a weak ETag and a Last-Modified
+derived from the table versions and the release of the code (ETAG_VERSION), and a request carrying a matching
+If-None-Match / If-Modified-Since is answered 304 before the view runs, without touching the database.
+Views reading a table without a known version (data_events.versions()) are not validated.
+"""
+import hashlib
+import time
+from datetime import datetime, timezone
+from typing import Callable, Optional, Set, Tuple
+
+from flask import Flask, Response, request as flask_request, current_app
+
+from backend import data_events
+
+# revalidate on every use, which is cheap since a 304 needs no database query
+DEFAULT_CACHE_CONTROL = 'no-cache'
+# suffixes Flask-Compress appends to the ETag of the responses it compresses
+COMPRESSED_ETAG_SUFFIXES = (':gzip', ':br', ':deflate')
+
+
+def reads(*tables: str) -> Callable:
+    """declares the tables a view function reads"""
+
+    def decorator(view: Callable) -> Callable:
+        view.data_tables = tables
+        return view
+
+    return decorator
+
+
+def init_app(app: Flask) -> None:
+    # a release changing the body of responses must change their validators, pin ETAG_VERSION to the release
+    # (e.g. the git commit) to share them between processes, it defaults to the start time of the process
+    app.config.setdefault('ETAG_VERSION', str(time.time()))
+    app.before_request(_answer_not_modified)
+    app.after_request(_add_validators)
+
+
+def _validators() -> Tuple[Optional[str], Optional[datetime]]:
+    """(etag, last modified) of the current request, (None, None) if it can not be validated"""
+    if flask_request.method not in ('GET', 'HEAD') or flask_request.endpoint is None:
+        return None, None
+    tables = getattr(current_app.view_functions.get(flask_request.endpoint), 'data_tables', None)
+    versions = data_events.versions()
+    if not tables or versions is None or any(table not in versions for table in tables):
+        return None, None
+    table_versions = [(table, *versions[table]) for table in sorted(tables)]
+    digest = hashlib.sha1(repr((current_app.config['ETAG_VERSION'], flask_request.endpoint,
+                                [(table, version) for table, version, _ in table_versions])).encode()).hexdigest()
+    modified = [modified_at for _, _, modified_at in table_versions if modified_at is not None]
+    return digest, max(modified) if modified else None
+
+
+def _answer_not_modified() -> Optional[Response]:
+    etag, last_modified = _validators()
+    if etag is None:
+        return None
+    if flask_request.if_none_match:
+        not_modified = flask_request.if_none_match.star_tag or etag in _client_etags()
+    else:
+        # HTTP dates are UTC with a precision of a second, depending on the version werkzeug parses them naive
+        since = flask_request.if_modified_since
+        not_modified = since is not None and last_modified is not None \
+            and last_modified.astimezone(timezone.utc).replace(tzinfo=None, microsecond=0) <= since.replace(tzinfo=None)
+    if not not_modified:
+        return None
+    response = Response(status=304)
+    _set_validators(response, etag, last_modified)
+    return response
+
+
+def _client_etags() -> Set[str]:
+    """entity tags of If-None-Match, weak or strong, without the suffix of Flask-Compress"""
+    tags = set()
+    for tag in flask_request.if_none_match.as_set(include_weak=True):
+        for suffix in COMPRESSED_ETAG_SUFFIXES:
+            if tag.endswith(suffix):
+                tag = tag[:-len(suffix)]
+                break
+        tags.add(tag)
+    return tags
+
+
+def _add_validators(response: Response) -> Response:
+    if response.status_code != 200 or 'ETag' in response.headers:
+        return response
+    etag, last_modified = _validators()
+    if etag is not None:
+        _set_validators(response, etag, last_modified)
+    return response
+
+
+def _set_validators(response: Response, etag: str, last_modified: Optional[datetime]) -> None:
+    # weak, the representation may still depend on headers (Accept, Accept-Encoding)
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    if 'Cache-Control' not in response.headers:
+        response.headers['Cache-Control'] = DEFAULT_CACHE_CONTROL
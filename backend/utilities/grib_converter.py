@@ -1,30 +1,50 @@
+from typing import Dict, List
+
 import numpy as np
 import pygrib
 
 
 class GribConverter:
     @staticmethod
-    def convert(filepath):
+    def header(g) -> Dict:
+        """grid description of a message, the header of the grib2json (leaflet-velocity) format"""
+        return {
+            'parameterCategory': g["parameterCategory"],
+            'parameterNumber': g['parameterNumber'],
+            'numberPoints': g['Ni'] * g['Nj'],
+            'nx': g['Ni'],
+            'ny': g['Nj'],
+            'lo1': g['longitudeOfFirstGridPointInDegrees'],
+            'lo2': g['longitudeOfLastGridPointInDegrees'],
+            'la1': g['latitudeOfFirstGridPointInDegrees'],
+            'la2': g['latitudeOfLastGridPointInDegrees'],
+            'dx': g['iDirectionIncrementInDegrees'],
+            'dy': g['jDirectionIncrementInDegrees'],
+        }
+
+    @staticmethod
+    def records(filepath, **selectors) -> List[Dict]:
+        """
+        messages of a grib file as {'header', 'data'}, data being the flat row-major values array,
+        all messages if no selectors are given, else the messages matching them (as pygrib's select)
+        """
         grib = pygrib.open(filepath)
-        result_list = list()
-        result = {'header': dict(), 'data': np.array(list())}
-        for g in grib:
-            for row in g['values']:
-                result['data'] = np.concatenate((result['data'], row), axis=0)
-            result['header'] = {
-                'parameterCategory': g["parameterCategory"],
-                'parameterNumber': g['parameterNumber'],
-                'numberPoints': len(result['data']),
-                'nx': g['Ni'],
-                'ny': g['Nj'],
-                'lo1': g['longitudeOfFirstGridPointInDegrees'],
-                'lo2': g['longitudeOfLastGridPointInDegrees'],
-                'la1': g['latitudeOfFirstGridPointInDegrees'],
-                'la2': g['latitudeOfLastGridPointInDegrees'],
-                'dx': g['iDirectionIncrementInDegrees'],
-                'dy': g['jDirectionIncrementInDegrees'],
-            }
+        messages = grib.select(**selectors) if selectors else grib
+        # missing values are masked, written as 0 like the grib2json converter does
+        result_list = [{'header': GribConverter.header(g), 'data': np.ma.filled(g['values'], 0.0).ravel()}
+                       for g in messages]
+        grib.close()
+        return result_list
+
+    @staticmethod
+    def wind_field(filepath) -> List[Dict]:
+        """the U and V component records of the wind in a grib file, in this order"""
+        return GribConverter.records(filepath, name='U component of wind') \
+            + GribConverter.records(filepath, name='V component of wind')
+
+    @staticmethod
+    def convert(filepath):
+        result_list = GribConverter.records(filepath)
+        for result in result_list:
             result['data'] = result['data'].tolist()
-            result_list.append(result)
-            result = {'header': dict(), 'data': list()}
         return result_list
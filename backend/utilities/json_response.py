@@ -0,0 +1,125 @@
+import itertools
+import json
+import zlib
+from typing import Any, Iterable, Iterator, List, Optional
+
+from flask import Response, json as flask_json, make_response, request as flask_request, stream_with_context
+
+# size of the chunks written by stream_json_array, before compression
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class RawJSON(str):
+    """
+    an already serialized JSON value (e.g. the text of st_asgeojson), written to the output as it is,
+    None (a NULL column) is written as null
+    """
+
+    def __new__(cls, value: Optional[str]):
+        return super().__new__(cls, 'null' if value is None else value)
+
+
+def dumps(obj: Any) -> str:
+    """
+    serializes dicts, lists and tuples like flask.json.dumps, except that RawJSON values are spliced verbatim,
+    so that pre-serialized fragments are never decoded and encoded again
+    """
+    parts: List[str] = list()
+    _encode(obj, parts)
+    return ''.join(parts)
+
+
+def json_response(obj: Any, status: int = 200) -> Response:
+    """a response of dumps(obj), the counterpart of flask.jsonify for objects holding RawJSON"""
+    return Response(dumps(obj), status=status, mimetype='application/json')
+
+
+def stream_json_array(items: Iterable[Any], compress: bool = True) -> Response:
+    """
+    a response streaming the JSON array of items, encoded one at a time and sent in chunks,
+    e.g. rows of Connection.sql_execute_stream, so that neither the items nor the body are ever held in full
+
+    the first chunk is encoded before the response is returned, so that a TimeoutError raised by items before
+    any byte is sent (e.g. a query cancelled by its statement_timeout) gives a 504 response. once the body is
+    being sent, a TimeoutError ends the array with an object {"error": message} in place of the remaining items,
+    so that the body is still valid JSON and the client can tell it was cut
+
+    :param items: values to serialize like dumps()
+    :param compress: gzip the stream when the client accepts it, responses are compressed here since
+                     Flask-Compress would buffer the whole stream to compress it
+    """
+    gzip = compress and 'gzip' in flask_request.headers.get('Accept-Encoding', '').lower()
+    chunks = _json_array_chunks(items)
+    try:
+        chunks = itertools.chain([next(chunks)], chunks)
+    except TimeoutError as err:
+        return make_response(str(err), 504)
+    response = Response(stream_with_context(_gzip_chunks(chunks) if gzip else chunks), mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def _json_array_chunks(items: Iterable[Any]) -> Iterator[bytes]:
+    parts: List[str] = ['[']
+    size = 1
+    count = 0
+    sent = False
+    try:
+        for item in items:
+            if count:
+                parts.append(', ')
+            start = len(parts)
+            _encode(item, parts)
+            count += 1
+            size += sum(len(part) for part in parts[start:])
+            if size >= STREAM_CHUNK_SIZE:
+                yield ''.join(parts).encode()
+                sent = True
+                parts.clear()
+                size = 0
+    except TimeoutError as err:
+        if not sent:
+            raise
+        # the status is already sent, the array ends with an error marker
+        if count:
+            parts.append(', ')
+        _encode({'error': str(err)}, parts)
+    parts.append(']')
+    yield ''.join(parts).encode()
+
+
+def _gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _encode(obj: Any, parts: List[str]) -> None:
+    if isinstance(obj, RawJSON):
+        parts.append(obj)
+    elif isinstance(obj, dict):
+        parts.append('{')
+        for i, (key, value) in enumerate(obj.items()):
+            if i:
+                parts.append(', ')
+            parts.append(json.dumps(str(key)))
+            parts.append(': ')
+            _encode(value, parts)
+        parts.append('}')
+    elif isinstance(obj, (list, tuple)):
+        parts.append('[')
+        for i, value in enumerate(obj):
+            if i:
+                parts.append(', ')
+            _encode(value, parts)
+        parts.append(']')
+    elif obj is None or isinstance(obj, (str, int, float)):
+        parts.append(json.dumps(obj))
+    else:
+        # e.g. datetime, encoded the way jsonify does
+        parts.append(flask_json.dumps(obj))
@@ -0,0 +1,160 @@
+"""
+Hierarchical greedy point clustering, in the manner of supercluster (mapbox), over a static KD-tree.
+
+Points are projected to the web mercator unit square. Starting from the raw points, every zoom level is built from
+the level above it: each point not yet taken absorbs its neighbours within `radius` pixels at that zoom into one
+cluster placed at their weighted centroid. Querying a zoom level is then a range search in the tree of that level.
+"""
+import math
+from typing import List, Tuple
+
+import numpy as np
+
+
+def lng_x(lng: np.ndarray) -> np.ndarray:
+    return np.asarray(lng, dtype=float) / 360 + 0.5
+
+
+def lat_y(lat: np.ndarray) -> np.ndarray:
+    sin = np.sin(np.radians(np.clip(np.asarray(lat, dtype=float), -85.0511, 85.0511)))
+    return 0.5 - 0.25 * np.log((1 + sin) / (1 - sin)) / math.pi
+
+
+def x_lng(x: np.ndarray) -> np.ndarray:
+    return (np.asarray(x) - 0.5) * 360
+
+
+def y_lat(y: np.ndarray) -> np.ndarray:
+    return np.degrees(2 * np.arctan(np.exp((180 - np.asarray(y) * 360) * math.pi / 180)) - math.pi / 2)
+
+
+class KDTree:
+    """static 2d KD-tree (as kdbush), points are sorted in place around medians, leaves are searched vectorized"""
+    LEAF_SIZE = 64
+
+    def __init__(self, xs: np.ndarray, ys: np.ndarray):
+        self.index = np.arange(len(xs))
+        self._xs = xs
+        self._ys = ys
+        self._sort(0, len(xs) - 1, 0)
+        self.xs = xs[self.index]
+        self.ys = ys[self.index]
+
+    def _sort(self, left: int, right: int, axis: int) -> None:
+        if right - left <= self.LEAF_SIZE:
+            return
+        middle = (left + right) // 2
+        segment = self.index[left:right + 1]
+        coordinates = (self._xs if axis == 0 else self._ys)[segment]
+        self.index[left:right + 1] = segment[np.argpartition(coordinates, middle - left)]
+        self._sort(left, middle - 1, 1 - axis)
+        self._sort(middle + 1, right, 1 - axis)
+
+    def range(self, min_x: float, min_y: float, max_x: float, max_y: float) -> np.ndarray:
+        """indices of the points within the box"""
+        return self._search(lambda xs, ys: (xs >= min_x) & (xs <= max_x) & (ys >= min_y) & (ys <= max_y),
+                            (min_x, min_y), (max_x, max_y))
+
+    def within(self, x: float, y: float, radius: float) -> np.ndarray:
+        """indices of the points within radius of (x, y)"""
+        r2 = radius * radius
+        return self._search(lambda xs, ys: (xs - x) ** 2 + (ys - y) ** 2 <= r2,
+                            (x - radius, y - radius), (x + radius, y + radius))
+
+    def _search(self, test, low: Tuple[float, float], high: Tuple[float, float]) -> np.ndarray:
+        found: List[np.ndarray] = list()
+        stack = [(0, len(self.index) - 1, 0)]
+        while stack:
+            left, right, axis = stack.pop()
+            if right < left:
+                continue
+            if right - left <= self.LEAF_SIZE:
+                block = slice(left, right + 1)
+                found.append(self.index[block][test(self.xs[block], self.ys[block])])
+                continue
+            middle = (left + right) // 2
+            if test(self.xs[middle], self.ys[middle]):
+                found.append(self.index[middle:middle + 1])
+            split = self.xs[middle] if axis == 0 else self.ys[middle]
+            if low[axis] <= split:
+                stack.append((left, middle - 1, 1 - axis))
+            if high[axis] >= split:
+                stack.append((middle + 1, right, 1 - axis))
+        return np.concatenate(found) if found else np.empty(0, dtype=int)
+
+
+# points of a zoom level: x, y (mercator unit square), count of raw points, id (-1 for clusters of several points)
+Level = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+def cluster_level(level: Level, tree: KDTree, radius: float) -> Level:
+    """greedy clustering of a level within radius (mercator units), using the tree of its points"""
+    xs, ys, counts, ids = level
+    taken = np.zeros(len(xs), dtype=bool)
+    out_x, out_y, out_count, out_id = list(), list(), list(), list()
+    for i in range(len(xs)):
+        if taken[i]:
+            continue
+        taken[i] = True
+        neighbors = tree.within(xs[i], ys[i], radius)
+        neighbors = neighbors[~taken[neighbors]]
+        if not len(neighbors):
+            out_x.append(xs[i])
+            out_y.append(ys[i])
+            out_count.append(counts[i])
+            out_id.append(ids[i])
+            continue
+        taken[neighbors] = True
+        members = np.append(neighbors, i)
+        weights = counts[members]
+        total = weights.sum()
+        out_x.append((xs[members] * weights).sum() / total)
+        out_y.append((ys[members] * weights).sum() / total)
+        out_count.append(total)
+        out_id.append(-1)
+    return (np.array(out_x, dtype=float), np.array(out_y, dtype=float),
+            np.array(out_count, dtype=np.int64), np.array(out_id, dtype=np.int64))
+
+
+class ClusterIndex:
+    """clusters of a fixed set of points at every zoom level from min_zoom to max_zoom, raw points above"""
+
+    def __init__(self, longs: np.ndarray, lats: np.ndarray, ids: np.ndarray,
+                 min_zoom: int = 0, max_zoom: int = 12, radius: int = 40, extent: int = 512):
+        """
+        :param radius: cluster radius, in pixels of a tile
+        :param extent: tile extent, in pixels
+        """
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.radius = radius
+        self.extent = extent
+        level = (lng_x(longs), lat_y(lats), np.ones(len(ids), dtype=np.int64), np.asarray(ids, dtype=np.int64))
+        self.levels = {max_zoom + 1: (level, KDTree(level[0], level[1]))}
+        for zoom in range(max_zoom, min_zoom - 1, -1):
+            level = cluster_level(level, self.levels[zoom + 1][1], self.zoom_radius(zoom))
+            self.levels[zoom] = (level, KDTree(level[0], level[1]))
+
+    def zoom_radius(self, zoom: int) -> float:
+        return self.radius / (self.extent * 2 ** zoom)
+
+    def get_clusters(self, bbox: Tuple[float, float, float, float], zoom: int) -> Level:
+        """points of the zoom level within bbox (west, south, east, north)"""
+        level, tree = self.levels[max(self.min_zoom, min(zoom, self.max_zoom + 1))]
+        west, south, east, north = bbox
+        found = tree.range(float(lng_x(west)), float(lat_y(north)), float(lng_x(east)), float(lat_y(south)))
+        return tuple(column[found] for column in level)
+
+
+def concat_levels(levels: List[Level]) -> Level:
+    if not levels:
+        return np.empty(0), np.empty(0), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return tuple(np.concatenate(columns) for columns in zip(*levels))
+
+
+def merge_levels(levels: List[Level], zoom: int, radius: int = 40, extent: int = 512) -> Level:
+    """clusters together the points of several indexes at the same zoom level (e.g. one index per day)"""
+    merged = concat_levels(levels)
+    if len(levels) < 2:
+        return merged
+    return cluster_level(merged, KDTree(merged[0], merged[1]), radius / (extent * 2 ** zoom))
@@ -0,0 +1,74 @@
+"""
+Compact binary encodings of tweet points, negotiated through the Accept header of the request.
+
+application/vnd.wildfires.points, little-endian, columns aligned for typed arrays (e.g. BigInt64Array):
+    uint32 count, uint32 version (1)
+    int64   id[count]
+    float32 lng[count]
+    float32 lat[count]
+    uint32  time[count], epoch seconds
+
+application/vnd.apache.arrow.stream, an Arrow IPC stream with the same columns,
+offered only when pyarrow is installed (optional dependency, `pip install pyarrow`)
+"""
+import importlib.util
+import struct
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+from flask import Response, make_response, request as flask_request
+
+JSON_MIMETYPE = 'application/json'
+POINTS_MIMETYPE = 'application/vnd.wildfires.points'
+ARROW_STREAM_MIMETYPE = 'application/vnd.apache.arrow.stream'
+POINTS_VERSION = 1
+
+# (epoch seconds, id, lng, lat)
+Point = Tuple[float, int, float, float]
+
+
+def _arrow_available() -> bool:
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+_OFFERED = [JSON_MIMETYPE, POINTS_MIMETYPE] + ([ARROW_STREAM_MIMETYPE] if _arrow_available() else [])
+
+
+def negotiate_binary() -> Optional[str]:
+    """returns the binary mimetype preferred by the request, None if it prefers JSON"""
+    best = flask_request.accept_mimetypes.best_match(_OFFERED, default=JSON_MIMETYPE)
+    return None if best == JSON_MIMETYPE else best
+
+
+def points_response(points: Iterable[Point], mimetype: str) -> Response:
+    """
+    a response of points in one of the binary encodings
+
+    :param points: (epoch seconds, id, lng, lat) of every point
+    :param mimetype: POINTS_MIMETYPE or ARROW_STREAM_MIMETYPE, as returned by negotiate_binary()
+    :return: the response, or a 504 response if points raise TimeoutError (e.g. Connection.sql_execute_stream)
+    """
+    try:
+        points = list(points)
+    except TimeoutError as err:
+        return make_response(str(err), 504)
+    columns = np.array(points, dtype=[('time', 'f8'), ('id', 'i8'), ('lng', 'f8'), ('lat', 'f8')])
+    ids = columns['id'].astype('<i8')
+    lngs = columns['lng'].astype('<f4')
+    lats = columns['lat'].astype('<f4')
+    times = columns['time'].astype('<u4')
+
+    if mimetype == ARROW_STREAM_MIMETYPE:
+        import pyarrow
+        batch = pyarrow.record_batch([ids, lngs, lats, times], names=['id', 'lng', 'lat', 'time'])
+        sink = pyarrow.BufferOutputStream()
+        with pyarrow.ipc.new_stream(sink, batch.schema) as writer:
+            writer.write_batch(batch)
+        body = sink.getvalue().to_pybytes()
+    else:
+        body = b''.join((struct.pack('<II', len(ids), POINTS_VERSION),
+                         ids.tobytes(), lngs.tobytes(), lats.tobytes(), times.tobytes()))
+
+    response = Response(body, mimetype=mimetype)
+    response.vary.add('Accept')
+    return response
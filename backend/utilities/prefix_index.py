@@ -0,0 +1,37 @@
+from bisect import bisect_left
+from typing import Any, Iterable, List, Tuple
+
+
+class PrefixIndex:
+    """
+    Case-insensitive prefix search over names, kept in sorted arrays and searched by binary search.
+
+    Entries are grouped in ranks, matches of a lower rank come first (e.g. states before counties before cities),
+    within a rank matches are ordered by name. An index is immutable, build a new one to reload.
+    """
+
+    def __init__(self, ranks: Iterable[Iterable[Tuple[str, Any]]]):
+        """
+        :param ranks: for each rank, the (name, value) entries, value is returned by search()
+        """
+        self._ranks: List[Tuple[List[str], List[Any]]] = list()
+        for entries in ranks:
+            entries = sorted(((name.lower(), value) for name, value in entries if name), key=lambda e: e[0])
+            self._ranks.append(([name for name, _ in entries], [value for _, value in entries]))
+
+    def search(self, prefix: str, limit: int = 10) -> List[Any]:
+        """returns up to limit distinct values whose name starts with prefix, ignoring case"""
+        prefix = prefix.lower()
+        result = list()
+        seen = set()
+        for names, values in self._ranks:
+            i = bisect_left(names, prefix)
+            while i < len(names) and names[i].startswith(prefix) and len(result) < limit:
+                if values[i] not in seen:
+                    seen.add(values[i])
+                    result.append(values[i])
+                i += 1
+        return result
+
+    def __len__(self) -> int:
+        return sum(len(names) for names, _ in self._ranks)
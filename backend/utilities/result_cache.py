@@ -0,0 +1,240 @@
+import pickle
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+
+class CacheStore(ABC):
+    """storage behind a ResultCache, keeps values with an expiry time and a set of tags for invalidation"""
+
+    @abstractmethod
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """returns (found, value), expired entries are not found"""
+        pass
+
+    @abstractmethod
+    def set(self, key: Hashable, value: Any, ttl: float, tags: Iterable[str]) -> None:
+        pass
+
+    @abstractmethod
+    def invalidate(self, tag: str) -> int:
+        """removes all entries carrying the tag, returns the number of removed entries"""
+        pass
+
+    @abstractmethod
+    def clear(self) -> None:
+        pass
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+
+class LocalStore(CacheStore):
+    """
+    in-process LRU store, bounded by the number of entries, and by their total size if maxbytes is given
+
+    :param sizeof: size of a value in bytes, len() by default, for values of str or bytes
+    """
+
+    def __init__(self, maxsize: int = 1024, maxbytes: Optional[int] = None, sizeof: Callable[[Any], int] = len):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self._entries = OrderedDict()  # key -> (value, expires_at, tags, size)
+        self._tags: Dict[str, set] = dict()  # tag -> keys
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.bytes = 0
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            value, expires_at, _, _ = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key: Hashable, value: Any, ttl: float, tags: Iterable[str]) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            tags = frozenset(tags)
+            size = self.sizeof(value) if self.maxbytes is not None else 0
+            self._entries[key] = (value, time.monotonic() + ttl, tags, size)
+            self.bytes += size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize or self.maxbytes is not None and self.bytes > self.maxbytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, tag: str) -> int:
+        with self._lock:
+            keys = self._tags.pop(tag, set())
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self.bytes = 0
+
+    def _remove(self, key: Hashable) -> None:
+        _, _, tags, size = self._entries.pop(key)
+        self.bytes -= size
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class RedisStore(CacheStore):
+    """
+    store shared by all web workers, kept in redis (optional dependency, `pip install redis`)
+    expiry is handled by redis, tags are redis sets of keys
+    """
+
+    def __init__(self, url: str = 'redis://localhost:6379/0', prefix: str = 'wildfires'):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def _key(self, key: Hashable) -> str:
+        return f'{self._prefix}:entry:{key!r}'
+
+    def _tag(self, tag: str) -> str:
+        return f'{self._prefix}:tag:{tag}'
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        value = self._redis.get(self._key(key))
+        if value is None:
+            return False, None
+        return True, pickle.loads(value)
+
+    def set(self, key: Hashable, value: Any, ttl: float, tags: Iterable[str]) -> None:
+        pipe = self._redis.pipeline()
+        pipe.set(self._key(key), pickle.dumps(value), ex=max(1, int(ttl)))
+        for tag in tags:
+            pipe.sadd(self._tag(tag), self._key(key))
+            pipe.expire(self._tag(tag), max(1, int(ttl)))
+        pipe.execute()
+
+    def invalidate(self, tag: str) -> int:
+        keys = self._redis.smembers(self._tag(tag))
+        if keys:
+            self._redis.delete(*keys)
+        self._redis.delete(self._tag(tag))
+        return len(keys)
+
+    def clear(self) -> None:
+        keys = list(self._redis.scan_iter(f'{self._prefix}:*'))
+        if keys:
+            self._redis.delete(*keys)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self._redis.scan_iter(f'{self._prefix}:entry:*'))
+
+
+class ResultCache:
+    """
+    Result cache with time-to-live, LRU bounded when kept in process, and tag based invalidation.
+
+    Every cache created is registered by name, so that the metrics of all of them can be reported together.
+    """
+    _instances: Dict[str, 'ResultCache'] = dict()
+
+    def __init__(self, name: str, ttl: float = 3600, maxsize: int = 1024, store: Optional[CacheStore] = None,
+                 maxbytes: Optional[int] = None):
+        self.name = name
+        self.ttl = ttl
+        self.store = store if store is not None else LocalStore(maxsize, maxbytes)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.hit_time = 0.0  # total seconds spent serving hits
+        self.miss_time = 0.0  # total seconds spent computing misses
+        ResultCache._instances[name] = self
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any], tags: Iterable[str] = ()) -> Any:
+        """
+        returns the cached value of key, or computes, caches and returns it
+
+        :param key: hashable cache key
+        :param compute: function producing the value on a miss
+        :param tags: tags of the entry, invalidate(tag) removes every entry with the tag
+        """
+        start = time.monotonic()
+        found, value = self.store.get(key)
+        if found:
+            with self._lock:
+                self.hits += 1
+                self.hit_time += time.monotonic() - start
+            return value
+        value = compute()
+        self.store.set(key, value, self.ttl, tags)
+        with self._lock:
+            self.misses += 1
+            self.miss_time += time.monotonic() - start
+        return value
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        returns (found, value) of key, for callers computing many misses at once,
+        which then set() the computed values themselves, miss times are not measured
+        """
+        start = time.monotonic()
+        found, value = self.store.get(key)
+        with self._lock:
+            if found:
+                self.hits += 1
+                self.hit_time += time.monotonic() - start
+            else:
+                self.misses += 1
+        return found, value
+
+    def set(self, key: Hashable, value: Any, tags: Iterable[str] = ()) -> None:
+        self.store.set(key, value, self.ttl, tags)
+
+    def invalidate(self, tag: str) -> None:
+        removed = self.store.invalidate(tag)
+        with self._lock:
+            self.invalidations += removed
+
+    def clear(self) -> None:
+        removed = len(self.store)
+        self.store.clear()
+        with self._lock:
+            self.invalidations += removed
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'size': len(self.store),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0.0,
+                'avg_hit_time': self.hit_time / self.hits if self.hits else 0.0,
+                'avg_miss_time': self.miss_time / self.misses if self.misses else 0.0,
+                'invalidations': self.invalidations,
+            }
+
+    @staticmethod
+    def all_metrics() -> Dict[str, Dict[str, Any]]:
+        """metrics of every cache created in this process, keyed by cache name"""
+        return {name: cache.metrics() for name, cache in ResultCache._instances.items()}
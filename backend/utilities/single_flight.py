@@ -0,0 +1,70 @@
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller computes the value, callers arriving while
+    it is in flight wait for it and share its value (or its exception). Nothing is kept once the call returns,
+    combine with a ResultCache to also reuse values over time.
+
+    Every instance is registered by name, so that the metrics of all of them can be reported together.
+    """
+    _instances: Dict[str, 'SingleFlight'] = dict()
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = dict()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.shared = 0  # calls answered by another caller's computation
+        SingleFlight._instances[name] = self
+
+    def do(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        returns compute(), or the value of the identical call already in flight
+
+        :param key: hashable key of the normalized call parameters
+        :param compute: function producing the value, called by one of the concurrent callers only
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = compute()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'calls': self.calls, 'shared': self.shared, 'in_flight': len(self._calls)}
+
+    @staticmethod
+    def all_metrics() -> Dict[str, Dict[str, Any]]:
+        """metrics of every single-flight group created in this process, keyed by name"""
+        return {name: group.metrics() for name, group in SingleFlight._instances.items()}
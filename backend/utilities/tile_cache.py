@@ -0,0 +1,96 @@
+import math
+import os
+import shutil
+import tempfile
+import uuid
+from typing import Optional, Tuple
+
+# half of the extent of the web mercator (EPSG:3857) projection, in meters
+MERCATOR_EXTENT = 20037508.342789244
+
+
+def tile_bounds_mercator(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """returns (xmin, ymin, xmax, ymax) of a XYZ tile, in web mercator meters"""
+    size = 2 * MERCATOR_EXTENT / 2 ** z
+    return (-MERCATOR_EXTENT + x * size, MERCATOR_EXTENT - (y + 1) * size,
+            -MERCATOR_EXTENT + (x + 1) * size, MERCATOR_EXTENT - y * size)
+
+
+def tile_bounds_lonlat(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """returns (west, south, east, north) of a XYZ tile, in degrees"""
+    n = 2 ** z
+
+    def lat(row: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360 - 180, lat(y + 1), (x + 1) / n * 360 - 180, lat(y)
+
+
+def lonlat_to_tile(lon: float, lat: float, z: int) -> Tuple[int, int]:
+    """returns (x, y) of the XYZ tile containing a point, points beyond the mercator latitudes are clamped"""
+    n = 2 ** z
+    lat = max(min(lat, 85.0511), -85.0511)
+    x = int((lon + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+class TileCache:
+    """
+    On-disk cache of encoded tiles, laid out as <directory>/<layer key>/<z>/<x>/<y>.<extension>
+
+    The directory is shared between processes: the web server reads and writes tiles,
+    the data pipeline calls invalidate() after it changes the underlying table.
+    With max_keys, putting a tile of a new layer key removes the least recently created keys beyond it.
+    """
+
+    def __init__(self, directory: str, extension: str = 'mvt', max_keys: Optional[int] = None):
+        self.directory = directory
+        self.extension = extension
+        self.max_keys = max_keys
+
+    def _path(self, key: str, z: int, x: int, y: int) -> str:
+        return os.path.join(self.directory, key, str(z), str(x), f'{y}.{self.extension}')
+
+    def get(self, key: str, z: int, x: int, y: int) -> Optional[bytes]:
+        try:
+            with open(self._path(key, z, x, y), 'rb') as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def put(self, key: str, z: int, x: int, y: int, tile: bytes) -> None:
+        path = self._path(key, z, x, y)
+        if self.max_keys is not None and not os.path.isdir(os.path.join(self.directory, key)):
+            self._evict_keys(self.max_keys - 1)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first, readers never see a partially written tile
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as file:
+            file.write(tile)
+        os.replace(temp_path, path)
+
+    def invalidate(self) -> None:
+        """removes every cached tile"""
+        TileCache._remove(self.directory)
+
+    def _evict_keys(self, keep: int) -> None:
+        """removes the oldest layer keys until keep of them are left"""
+        try:
+            keys = [entry for entry in os.scandir(self.directory)
+                    if entry.is_dir() and not entry.name.endswith('.trash')]
+        except OSError:
+            return
+        keys.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in keys[:max(0, len(keys) - keep)]:
+            TileCache._remove(entry.path)
+
+    @staticmethod
+    def _remove(directory: str) -> None:
+        # move the directory away first, so that no reader picks up a stale tile during the removal
+        trash = f'{directory}.{uuid.uuid4().hex}.trash'
+        try:
+            os.replace(directory, trash)
+        except OSError:
+            return  # not there, or removed by another process
+        shutil.rmtree(trash, ignore_errors=True)
@@ -0,0 +1,65 @@
+import json
+
+import matplotlib.path as mplPath
+import numpy as np
+
+
+class USBoundary:
+    """
+    Mainland US boundary (USbound.json), loaded once, answering point-in-boundary tests for arrays of points.
+
+    Points of the NOAA 0.25 degree lattice are answered from a mask precomputed over the whole lattice,
+    indexed by (round((90 - lat) * 4), round((long % 360) * 4)), other points are tested against the path.
+    """
+    LATTICE_STEP = 0.25
+
+    def __init__(self, path: str, accuracy: float = 0.001):
+        """
+        :param path: path of USbound.json
+        :param accuracy: the boundary is made this much larger, in degrees, to keep points right on its edge
+        """
+        with open(path) as json_file:
+            # every 5th vertex is precise enough for a mask on a 0.25 degree lattice
+            self.path = mplPath.Path(np.array(json.load(json_file)["mainland"][::5]))
+        self.accuracy = accuracy
+        self.lattice_mask = self._build_lattice_mask()
+
+    def contains_points(self, longs: np.ndarray, lats: np.ndarray, accuracy: float = None) -> np.ndarray:
+        """tests every (long, lat) against the boundary path, returns a boolean array"""
+        accuracy = self.accuracy if accuracy is None else accuracy
+        points = np.column_stack((np.asarray(longs, dtype=float) % -360, np.asarray(lats, dtype=float)))
+        # the sign of the radius growing the path depends on its orientation, accept either
+        return self.path.contains_points(points, radius=accuracy) | self.path.contains_points(points, radius=-accuracy)
+
+    def mask(self, longs: np.ndarray, lats: np.ndarray) -> np.ndarray:
+        """boolean array telling which (long, lat) are within the boundary, lattice points are looked up"""
+        longs = np.asarray(longs, dtype=float)
+        lats = np.asarray(lats, dtype=float)
+        rows = np.rint((90 - lats) / self.LATTICE_STEP)
+        cols = np.rint((longs % 360) / self.LATTICE_STEP)
+        on_lattice = (np.abs(90 - lats - rows * self.LATTICE_STEP) < 1e-6) \
+            & (np.abs(longs % 360 - cols * self.LATTICE_STEP) < 1e-6) \
+            & (rows >= 0) & (rows < self.lattice_mask.shape[0])
+        cols = cols.astype(int) % self.lattice_mask.shape[1]
+        result = np.zeros(longs.shape, dtype=bool)
+        result[on_lattice] = self.lattice_mask[rows[on_lattice].astype(int), cols[on_lattice]]
+        off_lattice = ~on_lattice
+        if off_lattice.any():
+            result[off_lattice] = self.contains_points(longs[off_lattice], lats[off_lattice])
+        return result
+
+    def _build_lattice_mask(self) -> np.ndarray:
+        rows = int(180 / self.LATTICE_STEP) + 1
+        cols = int(360 / self.LATTICE_STEP)
+        lattice_mask = np.zeros((rows, cols), dtype=bool)
+        # only the lattice points within the bounding box of the boundary can be inside it
+        (west, south), (east, north) = self.path.get_extents().get_points()
+        margin = self.LATTICE_STEP + self.accuracy
+        row_range = np.arange(max(0, int((90 - north - margin) / self.LATTICE_STEP)),
+                              min(rows, int((90 - south + margin) / self.LATTICE_STEP) + 1))
+        col_range = np.arange(int(((west - margin) % 360) / self.LATTICE_STEP),
+                              int(((east + margin) % 360) / self.LATTICE_STEP) + 1) % cols
+        grid_rows, grid_cols = np.meshgrid(row_range, col_range, indexing='ij')
+        inside = self.contains_points(grid_cols.ravel() * self.LATTICE_STEP, 90 - grid_rows.ravel() * self.LATTICE_STEP)
+        lattice_mask[grid_rows.ravel(), grid_cols.ravel()] = inside
+        return lattice_mask
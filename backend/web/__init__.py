@@ -9,6 +9,9 @@ import router.search_router
 import router.tweet_router
 import router.root_router
 import logging
+from backend import data_events
+from backend.connection import Connection
+from backend.utilities import conditional
 from flask_compress import Compress
 
 logging.basicConfig(level=logging.DEBUG)
@@ -22,6 +25,8 @@ def create_app(test_config=None):
     CORS(app)
     app.config.from_mapping(
         SECRET_KEY='dev',
+        # streamed responses compress themselves (json_response.stream_json_array), never buffer them
+        COMPRESS_STREAMS=False,
     )
 
     # TODO: implement a config file (ini / json)
@@ -38,6 +43,15 @@ def create_app(test_config=None):
     app.register_blueprint(router.tweet_router.bp)
     app.register_blueprint(router.root_router.bp)
     app.register_blueprint(router.dropdown_menu_router.bp)
+    # 304 for GET endpoints whose tables did not change since the client's copy
+    conditional.init_app(app)
+
+    # sample database backend counts in the background instead of on every connection checkout
+    Connection.start_status_sampler()
+    # invalidate cached results when the data pipeline commits new data
+    data_events.start_listener()
+    # autocomplete is served from memory once loaded in the background, reloaded when a boundary table changes
+    router.dropdown_menu_router.start_loading_place_index()
 
     return app
 
@@ -4,18 +4,130 @@
 import rootpath
 rootpath.append()
 
-import json
+import gzip
 import os
-from typing import List, Dict
+import struct
+from datetime import timedelta
+from typing import List, Dict, Optional
+import psycopg2.errors
+from dateutil import parser
+from backend import data_events, raster_storage, region_membership
+from backend.utilities.conditional import reads
 from backend.utilities.date_info_series import fill_series, gen_date_series
-import matplotlib.path as mplPath
+from backend.utilities.json_response import RawJSON, json_response
+from backend.utilities.result_cache import ResultCache
+from backend.utilities.single_flight import SingleFlight
+from backend.utilities.tile_cache import TileCache, tile_bounds_lonlat, tile_bounds_mercator
+from backend.utilities.us_boundary import USBoundary
 import numpy as np
-from flask import Blueprint, make_response, jsonify, send_from_directory, request as flask_request
+from flask import Blueprint, Response, make_response, jsonify, send_from_directory, request as flask_request
 from backend.connection import Connection
-from paths import BOUNDARY_PATH
+from backend.query_registry import QueryRegistry
+from paths import BOUNDARY_PATH, FIRE_TILE_CACHE_DIR
 
 bp = Blueprint('data', __name__, url_prefix='/data')
 
+# mainland US boundary, with a precomputed mask over the NOAA 0.25 degree lattice
+us_boundary = USBoundary(os.path.join(BOUNDARY_PATH, "USbound.json"))
+
+# simplification levels of fire geometries, selected by the 'size' field of requests
+SIZE_GETTERS = {0: "geom_full", 1: "geom_1e4", 2: "geom_1e3", 3: "geom_1e2", 4: "geom_center"}
+
+# aggregate_point stored procedure, (point_aggr_all.sql), or aggregate_point_raster (raster_storage.sql)
+QUERY_AGGREGATE_POINT = QueryRegistry.register(
+    'data_aggregation_point', 'SELECT * from {}($1, $2, $3, $4::timestamp, $5)'.format(
+        'aggregate_point_raster' if raster_storage.ENABLED else 'aggregate_point'))
+
+# point-aggregation responses, keyed by quantized request parameters
+aggregation_cache = ResultCache('aggregation', ttl=3600, maxsize=4096)
+# decimals of lat, lng and radius kept in the cache key, about 100 meters
+AGGREGATION_KEY_DECIMALS = 3
+
+# grid points of regions are precomputed in region_noaa_gid (region_membership.sql)
+if raster_storage.ENABLED:
+    # the gids of the region are looked up once, their values read from the array of each tid (raster_storage.sql)
+    QUERY_REGION = {var: QueryRegistry.register(f'data_region_{var}', f'''
+        select date(rft.reftime), avg(v.value) from noaa0p25_reftime rft,
+        noaa0p25_raster_values(rft.tid, '{var}', array(select gid from region_noaa_gid where region_id = $3)) v
+        where rft.reftime < $1::timestamp
+        and rft.reftime > $1::timestamp - $2::int * interval '1 day'
+        GROUP BY date(rft.reftime)
+    ''') for var in ('tmp', 'soilw')}
+else:
+    QUERY_REGION = {var: QueryRegistry.register(f'data_region_{var}', f'''
+        select date(rft.reftime), avg({var}) from noaa0p25 noaa
+        join noaa0p25_reftime rft on noaa.tid = rft.tid
+        join region_noaa_gid region on region.gid = noaa.gid
+        where region.region_id = $3
+        and rft.reftime < $1::timestamp
+        and rft.reftime > $1::timestamp - $2::int * interval '1 day'
+        GROUP BY date(rft.reftime)
+    ''') for var in ('tmp', 'soilw')}
+
+QUERY_POLYGON_AGGREGATOR = QueryRegistry.register(
+    'data_polygon_aggregator', 'SELECT * from Polygon_Aggregator_noaa0p25($1, $2, $3)')
+
+QUERY_RECENT_TEMP = QueryRegistry.register('data_recent_temp', '''
+    select t.lat, t.long, t.temperature from recent_temperature t
+    where t.endtime = (select max(t.endtime) from recent_temperature t
+    where t.endtime <(select max(t.endtime) from recent_temperature t))
+''')
+
+# concurrent identical fire-polygon requests share one query and its serialized response
+fire_polygon_flight = SingleFlight('fire-polygon')
+# decimals of request coordinates kept, identical up to about 10 cm, calls are coalesced on them
+COORDINATE_DECIMALS = 6
+
+QUERY_FIRE_POLYGON = {size: QueryRegistry.register(f'data_fire_polygon_{geom}', f'''
+    SELECT id, name, agency,start_time, end_time, st_asgeojson({geom}) as geom, max_area FROM fire_merged f 
+    WHERE ((($1::date <= f.end_time::date) AND ($1::date >= f.start_time::date)) 
+    OR (($2::date >= f.start_time::date) AND ($2::date <= f.end_time::date)) 
+    OR (($1::date <= f.start_time::date) AND ($2::date >= f.end_time::date))) 
+    AND (st_contains(ST_GeomFromText($3),f.{geom}) OR st_overlaps(ST_GeomFromText($3),f.{geom}))
+''') for size, geom in SIZE_GETTERS.items()}
+
+# simplification level of fire tiles, the first level whose max zoom is not below the tile zoom
+FIRE_TILE_LEVELS = [(3, "geom_center"), (6, "geom_1e2"), (9, "geom_1e3"), (12, "geom_1e4"), (None, "geom_full")]
+# fire-tiles are cached on disk per data version of fire_merged and date range, FireDumper removes them after
+# merging new fire records. A tile is put under the version read before its query, so that a tile computed
+# before a change is never found after it, and the least recent of FIRE_TILE_CACHE_KEYS date ranges are dropped
+FIRE_TILE_CACHE_KEYS = 64
+fire_tile_cache = TileCache(FIRE_TILE_CACHE_DIR, max_keys=FIRE_TILE_CACHE_KEYS)
+
+# fire geometries are stored in lon/lat without SRID, tiles are encoded in web mercator,
+# $1..$4 tile bounds in degrees, $5..$8 in meters, $9 start date, $10 end date
+QUERY_FIRE_TILE = {geom: QueryRegistry.register(f'data_fire_tile_{geom}', f'''
+    SELECT ST_AsMVT(tile.*, 'fire', 4096, 'geom') FROM (
+        SELECT id, name, agency, start_time::text as starttime, end_time::text as endtime, max_area as area,
+        ST_AsMVTGeom(ST_Transform(ST_SetSRID(f.{geom}, 4326), 3857), ST_MakeEnvelope($5, $6, $7, $8, 3857)) as geom
+        FROM fire_merged f
+        WHERE f.{geom} && ST_MakeEnvelope($1, $2, $3, $4)
+        AND $9::date <= f.end_time::date AND $10::date >= f.start_time::date
+    ) as tile
+''') for _, geom in FIRE_TILE_LEVELS}
+
+# wind field artifacts, built by NOAADumper.insert_wind_field
+QUERY_WIND_LATEST = QueryRegistry.register(
+    'data_wind_latest', 'SELECT tid, etag FROM noaa0p25_wind ORDER BY tid DESC LIMIT 1')
+QUERY_WIND_ETAG = QueryRegistry.register('data_wind_etag', 'SELECT tid, etag FROM noaa0p25_wind WHERE tid = $1')
+QUERY_WIND_ARTIFACT = QueryRegistry.register(
+    'data_wind_artifact', 'SELECT header, uv, json_gz FROM noaa0p25_wind WHERE tid = $1')
+# artifacts keyed by etag, a few fields are enough since clients ask for the latest one
+wind_cache = ResultCache('wind', ttl=24 * 3600, maxsize=8)
+# the latest field is revalidated on every use, a field requested by tid never changes
+WIND_CACHE_CONTROL_LATEST = 'public, no-cache'
+WIND_CACHE_CONTROL_TID = 'public, max-age=86400'
+
+QUERY_FIRE_WITH_ID = {size: QueryRegistry.register(f'data_fire_with_id_{geom}', f'''
+    SELECT id, name, if_sequence, agency, state, start_time, end_time, st_asgeojson({geom}) as geom,
+    st_asgeojson(st_envelope({geom})) as bbox, max_area FROM fire_merged where id = $1
+''') for size, geom in SIZE_GETTERS.items()}
+
+QUERY_FIRE_WITH_ID_SEPERATED = {size: QueryRegistry.register(f'data_fire_with_id_seperated_{geom}', f'''
+    SELECT f.id, f.name, f.if_sequence, f.agency, f.state, f.time,st_asgeojson(f.{geom}) as geom,
+    st_asgeojson(st_envelope(m.{geom})) as bbox, f.area FROM fire_merged m, fire f where f.id = $1 and m.id = f.id
+''') for size, geom in SIZE_GETTERS.items()}
+
 
 @bp.route("/aggregation", methods=['POST'])
 def aggregation():
@@ -26,92 +138,45 @@ def aggregation():
     :return:
     """
     request_json = flask_request.get_json(force=True)
-    lat = float(request_json['lat'])
-    lng = float(request_json['lng'])
-    radius = float(request_json['radius'])
-    timestamp_str = request_json['timestamp']
+    lat = round(float(request_json['lat']), AGGREGATION_KEY_DECIMALS)
+    lng = round(float(request_json['lng']), AGGREGATION_KEY_DECIMALS)
+    radius = round(float(request_json['radius']), AGGREGATION_KEY_DECIMALS)
+    # the window ends at the requested timestamp, which is kept whole in the key and in the query
+    stamp = parser.parse(request_json['timestamp'])
+    day = stamp.date()
     days = int(request_json.get('days', 7))
 
-    # generate date series. values are set to None/null
-    date_series = gen_date_series(days, timestamp_str)
+    def compute() -> bytes:
+        # one round trip, the stored procedure returns a gap-filled row per day with all the series
+        rows = list(Connection.sql_execute_prepared(QUERY_AGGREGATE_POINT,
+                                                    (lng, lat, radius, stamp, days)))  # lng lat +-180
+        return jsonify({'tmp': [(date, tmax) for date, _, tmax, _, _ in rows],
+                        'soilw': [(date, vpdmax) for date, _, _, vpdmax, _ in rows],
+                        'cnt_tweet': [(date, cnt_tweet) for date, cnt_tweet, _, _, _ in rows],
+                        'ppt': [(date, ppt) for date, _, _, _, ppt in rows]}).get_data()
 
-    # aggregate_tweet stored procedure, (point_aggr_tweet.sql)
-    query_tweet = 'SELECT * from aggregate_tweet(%s, %s, %s, TIMESTAMP %s, %s)'
-    query2_tmax = '''
-        select rft."date", avg(prism.tmax) from prism,
-        (
-            SELECT rft."date" from prism_info rft
-            where rft."date" <= TIMESTAMP %s -- UTC timezong
-            -- returning PDT without timezong label
-            and rft."date" > TIMESTAMP %s - ( %s || ' day')::interval
-        ) as rft,
-        (
-            select mesh.gid from us_mesh mesh 
-            WHERE st_dwithin(st_makepoint(%s, %s),mesh.geom, %s)
-        ) as gids
-        where prism.gid=gids.gid
-        and prism."date" = rft."date"
-        and prism.tmax != FLOAT 'NaN'
-        GROUP BY rft."date"
-    '''
-    query3_vpdmax = '''
-        select rft."date", avg(prism.vpdmax) from prism,
-        (
-            SELECT rft."date" from prism_info rft
-            where rft."date" <= TIMESTAMP %s -- UTC timezong
-            -- returning PDT without timezong label
-            and rft."date" > TIMESTAMP %s - ( %s || ' day')::interval
-        ) as rft,
-        (
-            select mesh.gid from us_mesh mesh 
-            WHERE st_dwithin(st_makepoint(%s, %s),mesh.geom, %s)
-        ) as gids
-        where prism.gid=gids.gid
-        and prism."date" = rft."date"
-        and prism.vpdmax != FLOAT 'NaN'
-        GROUP BY rft."date"
-    '''
-    query4_ppt = '''
-        select rft."date", avg(prism.ppt) from prism,
-        (
-            SELECT rft."date" from prism_info rft
-            where rft."date" <= TIMESTAMP %s -- UTC timezong
-            -- returning PDT without timezong label
-            and rft."date" > TIMESTAMP %s - ( %s || ' day')::interval
-        ) as rft,
-        (
-            select mesh.gid from us_mesh mesh 
-            WHERE st_dwithin(st_makepoint(%s, %s),mesh.geom, %s)
-        ) as gids
-        where prism.gid=gids.gid
-        and prism."date" = rft."date"
-        and prism.ppt != FLOAT 'NaN'
-        GROUP BY rft."date"
-    '''
-    with Connection() as conn:
-        cur = conn.cursor()
+    # tagged with every date of the window, new PRISM or tweet data of one of these dates invalidates the entry
+    body = aggregation_cache.get_or_compute((lat, lng, radius, stamp.isoformat(), days), compute,
+                                            [(day - timedelta(days=i)).isoformat() for i in range(days + 1)])
+    return make_response(body, 200, {'Content-Type': 'application/json'})
 
-        # tweet count from 'records'
-        cur.execute(query_tweet, (lng, lat, radius, timestamp_str, days))  # lng lat +-180
-        tweet = cur.fetchall()
-        tweet_series = fill_series(date_series, tweet)
-        # tmax, vpdmax from PRISM
-        cur.execute(query2_tmax, (timestamp_str, timestamp_str, days, lng, lat, radius))
-        temp = cur.fetchall()
-        temp_series = fill_series(date_series, temp)
-        cur.execute(query3_vpdmax, (timestamp_str, timestamp_str, days, lng, lat, radius))
-        mois = cur.fetchall()
-        mois_series = fill_series(date_series, mois)
-        # ppt from PRISM
-        cur.execute(query4_ppt, (timestamp_str, timestamp_str, days, lng, lat, radius))
-        ppt = cur.fetchall()
-        cur.close()
-        ppt_series = fill_series(date_series, ppt)
-    return make_response(jsonify({'tmp': temp_series, 'soilw': mois_series, 'cnt_tweet': tweet_series,
-                                      'ppt': ppt_series}))
+
+def _invalidate_aggregation(table: str, dates: Optional[List]) -> None:
+    """drops cached point-aggregations covering dates changed by PRISMDumper or TweetDumper"""
+    if table not in ('prism', 'records'):
+        return
+    if dates is None:
+        aggregation_cache.clear()
+    else:
+        for date in dates:
+            aggregation_cache.invalidate(date.isoformat())
+
+
+data_events.subscribe(_invalidate_aggregation)
 
 
 @bp.route('region-temp')
+@reads('noaa0p25')
 def region_temp():
     """
     (unused) average temperature in a administrative boundary
@@ -125,34 +190,15 @@ def region_temp():
     # generate date series. values are set to None/null
     date_series = gen_date_series(days, timestamp_str)
 
-    query = f'''
-    select date(rft.reftime), avg(tmp) from noaa0p25 noaa,
-    (
-        SELECT reftime, tid from noaa0p25_reftime rft
-        where rft.reftime < TIMESTAMP '{timestamp_str}'
-        and rft.reftime > TIMESTAMP '{timestamp_str}' - interval '{days} day'
-    ) as rft,
-    (
-        SELECT geometry.gid from noaa0p25_geometry_neg geometry,
-        (
-            SELECT geom from us_states WHERE state_id={region_id}
-            union
-            SELECT geom from us_counties WHERE county_id={region_id}
-            union
-            SELECT geom from us_cities WHERE city_id={region_id}
-        ) as region
-        where st_contains(region.geom, geometry.geom)
-    ) as gids
-    where noaa.gid=gids.gid
-    and noaa.tid = rft.tid
-    GROUP BY date(rft.reftime)
-    '''
-
+    if not region_membership.filled('region_noaa_gid'):
+        return make_response('region membership not computed, run sql/region_membership.sql', 503)
     return make_response(jsonify(
-        fill_series(date_series, Connection.sql_execute(query))))
+        fill_series(date_series,
+                    Connection.sql_execute_prepared(QUERY_REGION['tmp'], (timestamp_str, days, region_id)))))
 
 
 @bp.route('region-moisture')
+@reads('noaa0p25')
 def region_moisture():
     """
     (unused) average soil moisture in a administrative boundary
@@ -166,31 +212,11 @@ def region_moisture():
     # generate date series. values are set to None/null
     date_series = gen_date_series(days, timestamp_str)
 
-    query = f'''
-    select date(rft.reftime), avg(soilw) from noaa0p25 noaa,
-    (
-        SELECT reftime, tid from noaa0p25_reftime rft
-        where rft.reftime < TIMESTAMP '{timestamp_str}'
-        and rft.reftime > TIMESTAMP '{timestamp_str}' - interval '{days} day'
-    ) as rft,
-    (
-        SELECT geometry.gid from noaa0p25_geometry_neg geometry,
-        (
-            SELECT geom from us_states WHERE state_id={region_id}
-            union
-            SELECT geom from us_counties WHERE county_id={region_id}
-            union
-            SELECT geom from us_cities WHERE city_id={region_id}
-        ) as region
-        where st_contains(region.geom, geometry.geom)
-    ) as gids
-    where noaa.gid=gids.gid
-    and noaa.tid = rft.tid
-    GROUP BY date(rft.reftime)
-    '''
-
+    if not region_membership.filled('region_noaa_gid'):
+        return make_response('region membership not computed, run sql/region_membership.sql', 503)
     return make_response(jsonify(
-        fill_series(date_series, Connection.sql_execute(query))))
+        fill_series(date_series,
+                    Connection.sql_execute_prepared(QUERY_REGION['soilw'], (timestamp_str, days, region_id)))))
 
 
 @bp.route("/temp", methods=['POST'])
@@ -208,11 +234,10 @@ def temperature_in_screen():
     tid = request_json['tid']
     interval = request_json['interval']
 
-    query = "SELECT * from Polygon_Aggregator_noaa0p25(%s, %s, %s)"
     poly = 'polygon(({0} {1}, {0} {2}, {3} {2}, {3} {1}, {0} {1}))'.format(north, west, east, south)
     with Connection() as conn:
         cur = conn.cursor()
-        cur.execute(query, (poly, tid, interval))
+        QueryRegistry.execute(cur, QUERY_POLYGON_AGGREGATOR, (poly, tid, interval))
         resp = make_response(
             jsonify(
                 [{"lon": lon, "lat": lat, "temperature": temp} for lat, lon, temp, _ in cur.fetchall()]))
@@ -236,11 +261,10 @@ def soil_moisture_in_screen():
     tid = request_json['tid']
     interval = request_json['interval']
 
-    query = "SELECT * from Polygon_Aggregator_noaa0p25(%s, %s, %s)"
     poly = 'polygon(({0} {1}, {0} {2}, {3} {2}, {3} {1}, {0} {1}))'.format(north, west, east, south)
     with Connection() as conn:
         cur = conn.cursor()
-        cur.execute(query, (poly, tid, interval))
+        QueryRegistry.execute(cur, QUERY_POLYGON_AGGREGATOR, (poly, tid, interval))
         resp = make_response(
             jsonify([{"lon": lon, "lat": lat, "soilw": soilw} for lat, lon, _, soilw in cur.fetchall()]))
         cur.close()
@@ -250,11 +274,57 @@ def soil_moisture_in_screen():
 @bp.route("/wind")
 def wind():
     """
-    global wind. from a static file
-    :return:
+    global wind field of the latest tid, or of the tid given as parameter, whatever the region of the NOAA grid
+    (NOAACrawler.WIND_SUFFIX)
+
+    @:param tid: optional integer, timestamp id e.g. 2019072218
+    @:param format: 'json' (default) grib2json records as used by leaflet-velocity,
+                    'uv' binary: uint32 header length, json header padded to 4 bytes, float32 U values then V values
+    :return: the field, with a strong ETag, 304 when the client has it already
     """
-    # TODO: replace source of wind data to db
-    return make_response(send_from_directory('static/data', 'latest.json'))
+    tid = flask_request.args.get('tid', type=int)
+    binary = flask_request.args.get('format') == 'uv'
+    try:
+        rows = list(Connection.sql_execute_prepared(QUERY_WIND_ETAG, (tid,)) if tid is not None
+                    else Connection.sql_execute_prepared(QUERY_WIND_LATEST))
+    except psycopg2.errors.UndefinedTable:
+        rows = []
+    if not rows:
+        if tid is not None:
+            return make_response('wind field not found', 404)
+        # no wind field built yet, serve the file produced out of band
+        return make_response(send_from_directory('static/data', 'latest.json'))
+    tid, etag = rows[0]
+
+    gzipped = not binary and 'gzip' in flask_request.headers.get('Accept-Encoding', '').lower()
+    # one strong ETag per representation
+    etag = f'{etag}.uv' if binary else f'{etag}.json.gz' if gzipped else f'{etag}.json'
+    response = Response(mimetype='application/octet-stream' if binary else 'application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = WIND_CACHE_CONTROL_TID if 'tid' in flask_request.args \
+        else WIND_CACHE_CONTROL_LATEST
+    response.vary.add('Accept-Encoding')
+    if flask_request.if_none_match.contains(etag):
+        response.status_code = 304
+        return response
+
+    header, uv, json_gz = wind_cache.get_or_compute(etag.split('.')[0], lambda: _load_wind(tid))
+    if binary:
+        header = header.encode()
+        header += b' ' * (-len(header) % 4)  # keeps the float32 values 4-byte aligned
+        response.set_data(struct.pack('<I', len(header)) + header + uv)
+    elif gzipped:
+        # already compressed, Flask-Compress leaves responses with a Content-Encoding alone
+        response.headers['Content-Encoding'] = 'gzip'
+        response.set_data(json_gz)
+    else:
+        response.set_data(gzip.decompress(json_gz))
+    return response
+
+
+def _load_wind(tid: int):
+    header, uv, json_gz = next(Connection.sql_execute_prepared(QUERY_WIND_ARTIFACT, (tid,)))
+    return header, bytes(uv), bytes(json_gz)
 
 
 @bp.route("/rain_fall")
@@ -274,22 +344,15 @@ def send_temperature_data():
 
         :returns: a list of temp objects, with lat, long, and temp value
     """
-    temperature_fetch = Connection.sql_execute("select t.lat, t.long, t.temperature from recent_temperature t "
-                                                 "where t.endtime = (select max(t.endtime) from recent_temperature t"
-                                                 " where t.endtime <(select max(t.endtime) from recent_temperature t))")
-
-    temperature_data_celsius = []  # format temp data into a dictionary structure
+    rows = list(Connection.sql_execute_prepared(QUERY_RECENT_TEMP))
+    lats, longs, temps = (np.array(column, dtype=float) for column in zip(*rows)) if rows else ([], [], [])
 
-    for row in temperature_fetch:
-        temperature_object = {
-            "lat": row[0],
-            "long": row[1] % (-360),  # convert longtitude range
-            "temp": row[2] - 273.15,  # change temp into celsius
-        }
-
-        temperature_data_celsius.append(temperature_object)
-
-    temperature_data_us = points_in_us(temperature_data_celsius)  # restrict data within US boundary.
+    # restrict data within US boundary, lattice points are a single lookup in the precomputed mask
+    in_us = us_boundary.mask(longs, lats)
+    temperature_data_us = [{"lat": lat, "long": long % (-360), "temp": temp - 273.15}  # convert to celsius
+                           for lat, long, temp in zip(np.asarray(lats)[in_us].tolist(),
+                                                      np.asarray(longs)[in_us].tolist(),
+                                                      np.asarray(temps)[in_us].tolist())]
 
     resp = make_response(jsonify(temperature_data_us))
     resp.headers['Access-Control-Allow-Origin'] = '*'
@@ -306,47 +369,70 @@ def points_in_us(pnts: List[Dict[str, float]], accuracy=0.001):
     """
     if not isinstance(pnts, list):
         raise TypeError("Input should be list as : [dict, dict, ...]")
-
-    # TODO: move this bound file to database.
-    with open(os.path.join(BOUNDARY_PATH, "USbound.json")) as json_file:
-        data = json.load(json_file)
-        main_land_poly = mplPath.Path(np.array(data["mainland"][::5]))
-        result = []
-        for pnt in pnts:
-            if main_land_poly.contains_point([pnt['long'] % -360, pnt['lat']], radius=accuracy) \
-                    or main_land_poly.contains_point([pnt['long'] % -360, pnt['lat']], radius=-accuracy):
-                result.append(pnt)
-        return result
+    longs = np.array([pnt['long'] for pnt in pnts], dtype=float)
+    lats = np.array([pnt['lat'] for pnt in pnts], dtype=float)
+    if accuracy == us_boundary.accuracy:
+        inside = us_boundary.mask(longs, lats)
+    else:
+        inside = us_boundary.contains_points(longs, lats, accuracy)
+    return [pnt for pnt, keep in zip(pnts, inside) if keep]
 
 
 @bp.route("/fire-polygon", methods=['POST'])
 def fire():
     # return a json of all fire name, fire time, and fire geometry inside the bounding box
     request_json = flask_request.get_json(force=True)
-    north = request_json['northEast']['lat']
-    east = request_json['northEast']['lon']
-    south = request_json['southWest']['lat']
-    west = request_json['southWest']['lon']
+    north, east, south, west = (round(float(value), COORDINATE_DECIMALS) for value in (
+        request_json['northEast']['lat'], request_json['northEast']['lon'],
+        request_json['southWest']['lat'], request_json['southWest']['lon']))
     size = request_json['size']
     start_date = request_json['startDate'][:10]
     end_date = request_json['endDate'][:10]
-    size_getters = {0: "geom_full", 1: "geom_1e4", 2: "geom_1e3", 3: "geom_1e2",
-                    4: "geom_center"}
     poly = 'polygon(({0} {1}, {0} {2}, {3} {2}, {3} {1}, {0} {1}))'.format(east, south, north, west)
-    query = f"SELECT id, name, agency,start_time, end_time, st_asgeojson({size_getters[size]}) as geom, max_area FROM " \
-            f"fire_merged f WHERE ((('{start_date}'::date <= f.end_time::date) AND " \
-            f"('{start_date}'::date >= f.start_time::date)) OR (('{end_date}'::date >= f.start_time::date) " \
-            f"AND ('{end_date}'::date <= f.end_time::date)) OR (('{start_date}'::date <= f.start_time::date) " \
-            f"AND ('{end_date}'::date >= f.end_time::date) )) " \
-            f"AND (st_contains(ST_GeomFromText('{poly}'),f.{size_getters[size]}) " \
-            f"OR st_overlaps(ST_GeomFromText('{poly}'),f.{size_getters[size]}))"
-    return make_response(jsonify([{"type": "Feature",
-                                   "id": fid,
-                                   "properties": {"name": name, "agency": agency, "starttime": start_time,
-                                                  "endtime": end_time, "density": 520, "area": max_area},
-                                   "geometry": json.loads(geom)}
-                                  for fid, name, agency, start_time, end_time, geom, max_area
-                                  in Connection.sql_execute(query)]))
+
+    def compute() -> bytes:
+        return json_response([{"type": "Feature",
+                               "id": fid,
+                               "properties": {"name": name, "agency": agency, "starttime": start_time,
+                                              "endtime": end_time, "density": 520, "area": max_area},
+                               "geometry": RawJSON(geom)}
+                              for fid, name, agency, start_time, end_time, geom, max_area
+                              in Connection.sql_execute_prepared(QUERY_FIRE_POLYGON[size],
+                                                                 (start_date, end_date, poly))]).get_data()
+
+    body = fire_polygon_flight.do((size, start_date, end_date, poly), compute)
+    return make_response(body, 200, {'Content-Type': 'application/json'})
+
+
+@bp.route("/fire-tiles/<int:z>/<int:x>/<int:y>.mvt")
+@reads('fire_merged')
+def fire_tile(z: int, x: int, y: int):
+    # return a mapbox vector tile of the fires burning between startDate and endDate, one layer named 'fire'
+    if not (0 <= z <= 22 and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return make_response('tile out of range', 404)
+    try:
+        start_date = parser.parse(flask_request.args['startDate']).date()
+        end_date = parser.parse(flask_request.args['endDate']).date()
+    except (KeyError, ValueError):
+        return make_response('startDate and endDate are required dates', 400)
+    # not cached while the version of fire_merged is unknown
+    versions = data_events.versions()
+    version = versions.get('fire_merged') if versions is not None else None
+    key = f'{version[0]}_{start_date}_{end_date}' if version is not None else None
+    tile = fire_tile_cache.get(key, z, x, y) if key is not None else None
+    if tile is None:
+        geom = next(geom for max_zoom, geom in FIRE_TILE_LEVELS if max_zoom is None or z <= max_zoom)
+        with Connection() as conn:
+            cur = conn.cursor()
+            QueryRegistry.execute(cur, QUERY_FIRE_TILE[geom],
+                                  (*tile_bounds_lonlat(z, x, y), *tile_bounds_mercator(z, x, y), start_date, end_date))
+            row = cur.fetchone()
+            cur.close()
+        # ST_AsMVT of no rows is an empty tile, NULL on some PostGIS versions
+        tile = bytes(row[0]) if row is not None and row[0] is not None else b''
+        if key is not None:
+            fire_tile_cache.put(key, z, x, y, tile)
+    return make_response(tile, 200, {'Content-Type': 'application/vnd.mapbox-vector-tile'})
 
 
 @bp.route("/fire-with-id", methods=['POST'])
@@ -354,23 +440,17 @@ def fire_with_id():
     request_json = flask_request.get_json(force=True)
     id = request_json['id']
     size = request_json['size']
-    size_getters = {0: "geom_full", 1: "geom_1e4", 2: "geom_1e3", 3: "geom_1e2",
-                    4: "geom_center"}
-    query = f"SELECT " \
-            f"id, name, if_sequence, agency, state, start_time, end_time, st_asgeojson({size_getters[size]}) as geom," \
-            f" st_asgeojson(st_envelope({size_getters[size]})) as bbox, " \
-            f"max_area FROM fire_merged where id = {id}"
-    return make_response(jsonify([{"type": "Feature",
-                                   "id": fid,
-                                   "properties": {"name": name, "agency": agency, "if_sequence": if_sequence,
-                                                  "starttime": start_time,
-                                                  "endtime": end_time, "density": 520, "area": max_area,
-                                                  "state": state},
-                                   "geometry": json.loads(geom),
-                                   "bbox": json.loads(bbox)
-                                   }
-                                  for fid, name, if_sequence, agency, state, start_time, end_time, geom, bbox, max_area
-                                  in Connection.sql_execute(query)]))
+    return json_response([{"type": "Feature",
+                           "id": fid,
+                           "properties": {"name": name, "agency": agency, "if_sequence": if_sequence,
+                                          "starttime": start_time,
+                                          "endtime": end_time, "density": 520, "area": max_area,
+                                          "state": state},
+                           "geometry": RawJSON(geom),
+                           "bbox": RawJSON(bbox)
+                           }
+                          for fid, name, if_sequence, agency, state, start_time, end_time, geom, bbox, max_area
+                          in Connection.sql_execute_prepared(QUERY_FIRE_WITH_ID[size], (id,))])
 
 
 @bp.route("/fire-with-id-seperated", methods=['POST'])
@@ -378,19 +458,13 @@ def fire_with_id_seperated():
     request_json = flask_request.get_json(force=True)
     id = request_json['id']
     size = request_json['size']
-    size_getters = {0: "geom_full", 1: "geom_1e4", 2: "geom_1e3", 3: "geom_1e2",
-                    4: "geom_center"}
-    query = f"SELECT " \
-            f"f.id, f.name, f.if_sequence, f.agency, f.state, f.time,st_asgeojson(f.{size_getters[size]}) as geom," \
-            f" st_asgeojson(st_envelope(m.{size_getters[size]})) as bbox," \
-            f" f.area FROM fire_merged m, fire f where f.id = {id} and m.id = f.id"
-    return make_response(jsonify([{"type": "Feature",
-                                   "id": fid,
-                                   "properties": {"name": name, "agency": agency, "if_sequence": if_sequence,
-                                                  "time": time,
-                                                  "density": 520, "area": max_area, "state": state},
-                                   "geometry": json.loads(geom),
-                                   "bbox": json.loads(bbox)
-                                   }
-                                  for fid, name, if_sequence, agency, state, time, geom, bbox, max_area
-                                  in Connection.sql_execute(query)]))
+    return json_response([{"type": "Feature",
+                           "id": fid,
+                           "properties": {"name": name, "agency": agency, "if_sequence": if_sequence,
+                                          "time": time,
+                                          "density": 520, "area": max_area, "state": state},
+                           "geometry": RawJSON(geom),
+                           "bbox": RawJSON(bbox)
+                           }
+                          for fid, name, if_sequence, agency, state, time, geom, bbox, max_area
+                          in Connection.sql_execute_prepared(QUERY_FIRE_WITH_ID_SEPERATED[size], (id,))])
@@ -1,18 +1,84 @@
+import logging
+import threading
+import time
+from typing import List, Optional
+
 import rootpath
 
 rootpath.append()
 from flask import Blueprint, make_response, jsonify, request as flask_request
+from backend import data_events
 from backend.connection import Connection
+from backend.query_registry import QueryRegistry
+from backend.utilities.conditional import reads
+from backend.utilities.prefix_index import PrefixIndex
+
+logger = logging.getLogger('TaskManager')
 
 bp = Blueprint('dropdownMenu', __name__, url_prefix='/dropdownMenu')
 
+QUERY_FUZZY_SEARCH = QueryRegistry.register('dropdown_fuzzy_search', 'select * from fuzzy_search($1)')
+
+# every place name with its (city, county, state, id), in the ranks of fuzzy_search (autocomplete.sql)
+QUERY_PLACES = [
+    'select state_name, null, null, state_name, state_id from us_states',
+    '''select county_name, null, county_name, state_name, county_id from us_counties con, us_states sta
+    where con.state_id = sta.state_id''',
+    '''select city_name, city_name, county_name, state_name, city_id from us_cities cit, us_counties con, us_states sta
+    where cit.county_id = con.county_id and con.state_id = sta.state_id''',
+]
+PLACE_TABLES = ('us_states', 'us_counties', 'us_cities')
+
+# in-process prefix index of place names, None until loaded, then requests no longer reach the database
+place_index: Optional[PrefixIndex] = None
+# seconds between attempts of the initial load, while the database is not reachable
+PLACE_INDEX_RETRY_SECONDS = 60
+
+
+def load_place_index() -> None:
+    """
+    (re)builds the place name index from the boundary tables, called at app start and whenever a boundary
+    table changes, e.g. after `SELECT publish_data_event('us_cities')` (data_events.sql)
+    """
+    global place_index
+    place_index = PrefixIndex([[(name, tuple(place)) for name, *place in Connection.sql_execute_stream(query)]
+                               for query in QUERY_PLACES])
+    logger.info(f'[AUTOCOMPLETE] indexed {len(place_index)} place names')
+
+
+def start_loading_place_index() -> None:
+    """
+    loads the place index on a daemon thread, retried until it succeeds, so that the app starts without the database,
+    requests are served by fuzzy_search meanwhile
+    """
+
+    def load():
+        while True:
+            try:
+                load_place_index()
+                return
+            except Exception:
+                logger.exception(f'[AUTOCOMPLETE] place index not loaded, retried in {PLACE_INDEX_RETRY_SECONDS}s')
+            time.sleep(PLACE_INDEX_RETRY_SECONDS)
+
+    threading.Thread(target=load, name='place-index-loader', daemon=True).start()
+
+
+def _reload_place_index(table: str, _: Optional[List]) -> None:
+    if table in PLACE_TABLES:
+        load_place_index()
+
+
+data_events.subscribe(_reload_place_index)
+
 
 @bp.route('')
+@reads(*PLACE_TABLES)
 def drop_box():
     """
     auto-completion relies on this API.
     frontend send user types through userInput,
-    this API perform DB query through stored procedure (autocomplete.sql)
+    this API searches the in-process place index, or the stored procedure (autocomplete.sql) until it is loaded
 
     return a list/array: [ (city, county, state, id), ... ]
     :return:
@@ -20,6 +86,8 @@ def drop_box():
     user_input = flask_request.args.get('userInput')
     # request_json = flask_request.get_json(force=True)
     # user_input = request_json['userInput']
-    name_list_query = f"select * from fuzzy_search('{user_input + '%'}')"
 
-    return make_response(jsonify(list(Connection.sql_execute(name_list_query))))
+    index = place_index
+    if index is not None:
+        return make_response(jsonify(index.search(user_input)))
+    return make_response(jsonify(list(Connection.sql_execute_prepared(QUERY_FUZZY_SEARCH, (user_input + '%',)))))
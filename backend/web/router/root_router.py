@@ -5,13 +5,33 @@ rootpath.append()
 import time
 from flask import Blueprint, send_file, make_response, jsonify, request as flask_request
 from backend.connection import Connection
+from backend.query_registry import QueryRegistry
+from backend.utilities.result_cache import ResultCache
+from backend.utilities.single_flight import SingleFlight
 
 bp = Blueprint('root', __name__, url_prefix='/')
 
+QUERY_WILDFIRE_PREDICTION = QueryRegistry.register('root_wildfire_prediction', """
+    select l.top_left_long, l.top_left_lat, r.text, r.text from locations l, images i, records r 
+    where l.id = i.id and r.id = l.id and i.wildfire_prob>0.9 and 
+    l.top_left_long>$1 and l.top_left_lat<$2 
+    and l.bottom_right_long<$3 and l.bottom_right_lat>$4 
+    and extract(epoch from r.create_at) >$5 and extract(epoch from r.create_at) <$6""")
+
 @bp.route('/',methods=['GET'])
 def home_page():
   return send_file('static/index.html')
 
+@bp.route("/metrics")
+def send_metrics():
+    """
+    usage counters of the database connection pool, of the result caches and of the request coalescing
+    :return:
+    """
+    return make_response(jsonify({'connection_pool': Connection.metrics(), 'caches': ResultCache.all_metrics(),
+                                  'single_flight': SingleFlight.all_metrics()}))
+
+
 @bp.route("/wildfire-prediction", methods=['POST'])
 def send_wildfire():
     """
@@ -31,9 +51,5 @@ def send_wildfire():
 
     return make_response(
         jsonify([{"long": lon, "lat": lat, "nlp": True, "text": text} for lon, lat, nlp_text, text in
-                 Connection.sql_execute(
-                     f"select l.top_left_long, l.top_left_lat, r.text, r.text from locations l, images i, records r "
-                     f"where l.id = i.id and r.id = l.id and i.wildfire_prob>0.9 and "
-                     f"l.top_left_long>{west} and l.top_left_lat<{north} "
-                     f"and l.bottom_right_long<{east} and l.bottom_right_lat>{south} "
-                     f"and extract(epoch from r.create_at) >{start} and extract(epoch from r.create_at) <{end}")]))
\ No newline at end of file
+                 Connection.sql_execute_prepared(QUERY_WILDFIRE_PREDICTION,
+                                                 (west, north, east, south, start, end))]))
\ No newline at end of file
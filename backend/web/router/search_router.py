@@ -2,15 +2,62 @@ import rootpath
 
 rootpath.append()
 
-import json
 import random
-from flask import Blueprint, make_response, jsonify, request as flask_request
+from typing import List, Optional
+from flask import Blueprint, request as flask_request
+from backend import data_events
 from backend.connection import Connection
+from backend.query_registry import QueryRegistry
+from backend.utilities.conditional import reads
+from backend.utilities.json_response import RawJSON, json_response
+from backend.utilities.result_cache import ResultCache
 
 bp = Blueprint('search', __name__, url_prefix='/search')
 
+QUERY_REGION_GEOMETRY = QueryRegistry.register('search_region_geometry', '''
+    SELECT st_asgeojson(t.geom) as geojson from us_states t where state_id = $1
+    union
+    SELECT st_asgeojson(t.geom) as geojson from us_counties t where county_id = $1
+    union
+    SELECT st_asgeojson(t.geom) as geojson from us_cities t where city_id = $1
+''')
+
+QUERY_SEARCH_STATE = QueryRegistry.register(
+    'search_state', "SELECT st_asgeojson(t.geom) from us_states t where lower(state_name)=lower($1)")
+QUERY_SEARCH_COUNTY = QueryRegistry.register(
+    'search_county', "SELECT st_asgeojson(t.geom) from us_counties t where lower(county_name)=lower($1) limit 1")
+QUERY_SEARCH_CITY = QueryRegistry.register(
+    'search_city', "SELECT st_asgeojson(t.geom) from us_cities t where lower(city_name)=lower($1) limit 1")
+
+# simplification tolerance (degrees) of boundaries, the first level whose max zoom is not below the map zoom,
+# about a pixel wide, the tolerances must be the ones given to refresh_boundaries_simplified (boundaries_simplified.sql)
+BOUNDARY_TOLERANCES = [(5, 0.05), (7, 0.01), (10, 0.002), (None, 0)]
+BOUNDARY_LAYERS = ('states', 'counties', 'cities')
+
+QUERY_BOUNDARY_IDS = QueryRegistry.register('search_boundary_ids', '''
+    SELECT id, name from boundaries_simplified
+    where layer = $1 and tolerance = $2 and ST_intersects(geom, ST_GeomFromText($3))
+''')
+QUERY_BOUNDARY_GEOJSON = QueryRegistry.register('search_boundary_geojson', '''
+    SELECT id, ST_AsGeoJSON(geom) from boundaries_simplified
+    where layer = $1 and tolerance = $2 and id = ANY($3::int[])
+''')
+
+# serialized GeoJSON of simplified boundaries, keyed by (layer, id, tolerance), bounded by its size in characters:
+# geometries of a level differ in size by orders of magnitude. Full geometries (tolerance 0) are not cached
+boundary_cache = ResultCache('boundaries', ttl=24 * 3600, maxsize=20000, maxbytes=64 * 1024 * 1024)
+
+
+def _clear_boundary_cache(table: str, _: Optional[List]) -> None:
+    if table == 'boundaries_simplified':
+        boundary_cache.clear()
+
+
+data_events.subscribe(_clear_boundary_cache)
+
 
 @bp.route('', )
+@reads('us_states', 'us_counties', 'us_cities')
 def search_administrative_boundaries():
     """
     search administrative boundaries
@@ -23,46 +70,35 @@ def search_administrative_boundaries():
     if keyword.isdigit():
         region_id = int(keyword)
         # is a region_id
-        query = f'''
-        SELECT st_asgeojson(t.geom) as geojson from us_states t where state_id = {region_id}
-        union
-        SELECT st_asgeojson(t.geom) as geojson from us_counties t where county_id = {region_id}
-        union
-        SELECT st_asgeojson(t.geom) as geojson from us_cities t where city_id = {region_id}
-        '''
-
-        return make_response(jsonify([json.loads(geom) for geom, in Connection.sql_execute(query)]))
+        return json_response([RawJSON(geom) for geom, in
+                              Connection.sql_execute_prepared(QUERY_REGION_GEOMETRY, (region_id,))])
 
     else:
         # load abbreviation
         # default value is keyword itself if not found in dict
         keyword = us_states_abbr.get(keyword, keyword)
 
-        search_state = "SELECT st_asgeojson(t.geom) from us_states t where lower(state_name)=lower(%s)"
-        search_county = "SELECT st_asgeojson(t.geom) from us_counties t where lower(county_name)=lower(%s) limit 1"
-        search_city = "SELECT st_asgeojson(t.geom) from us_cities t where lower(city_name)=lower(%s) limit 1"
-
         with Connection() as conn:
             cur = conn.cursor()
             results = None
             if not results:
-                cur.execute(search_state, (keyword,))
-                results = [json.loads(geom) for geom, in cur.fetchall()]
+                QueryRegistry.execute(cur, QUERY_SEARCH_STATE, (keyword,))
+                results = [RawJSON(geom) for geom, in cur.fetchall()]
             if not results:
-                cur.execute(search_county, (keyword,))
-                results = [json.loads(geom) for geom, in cur.fetchall()]
+                QueryRegistry.execute(cur, QUERY_SEARCH_COUNTY, (keyword,))
+                results = [RawJSON(geom) for geom, in cur.fetchall()]
             if not results:
-                cur.execute(search_city, (keyword,))
-                results = [json.loads(geom) for geom, in cur.fetchall()]
+                QueryRegistry.execute(cur, QUERY_SEARCH_CITY, (keyword,))
+                results = [RawJSON(geom) for geom, in cur.fetchall()]
             cur.close()
-        return make_response(jsonify(results))
+        return json_response(results)
 
 
 @bp.route("/boundaries", methods=['POST'])
 def send_boundaries_data():
     """
     get administrative boundaries within specific bounding box
-    will DB stored procedure (boundaries.sql)
+    simplified according to the zoom level of the map (boundaries_simplified.sql), full geometries without zoom
     :return:
     """
     request_json = flask_request.get_json(force=True)
@@ -73,33 +109,47 @@ def send_boundaries_data():
     east = request_json['northEast']['lon']
     south = request_json['southWest']['lat']
     west = request_json['southWest']['lon']
+    zoom = request_json.get('zoom')
+    tolerance = next(tolerance for max_zoom, tolerance in BOUNDARY_TOLERANCES
+                     if max_zoom is None or zoom is not None and zoom <= max_zoom)
 
-    select_states = "SELECT * from boundaries_states(%s)"
-    select_counties = "SELECT * from boundaries_counties(%s)"
-    select_cities = "SELECT * from boundaries_cities(%s)"
     poly = 'polygon(({1} {0}, {2} {0}, {2} {3}, {1} {3}, {1} {0}))'.format(north, west, east, south)  # lon lat +-180
 
     with Connection() as conn:
         cur = conn.cursor()
         result_list = list()
-
-        if states:
-            result_list.extend(_get_geometry(cur, select_states, poly))
-        if counties:
-            result_list.extend(_get_geometry(cur, select_counties, poly))
-        if cities:
-            result_list.extend(_get_geometry(cur, select_cities, poly))
+        for layer, requested in zip(BOUNDARY_LAYERS, (states, counties, cities)):
+            if requested:
+                result_list.extend(_get_geometry(cur, layer, tolerance, poly))
         cur.close()
-    return make_response(jsonify(result_list))
+    return json_response(result_list)
 
 
-def _get_geometry(cur, sql, poly) -> list:
+def _get_geometry(cur, layer: str, tolerance: float, poly) -> list:
     # FIXME: density is random...
 
-    cur.execute(sql, (poly,))
+    QueryRegistry.execute(cur, QUERY_BOUNDARY_IDS, (layer, tolerance, poly))
+    regions = cur.fetchall()
+
+    # geometries are serialized once per (layer, id, tolerance), then spliced into responses as they are
+    geometries = dict()
+    missing = list()
+    for _id, _ in regions:
+        found, geojson = boundary_cache.get((layer, _id, tolerance)) if tolerance else (False, None)
+        if found:
+            geometries[_id] = geojson
+        else:
+            missing.append(_id)
+    if missing:
+        QueryRegistry.execute(cur, QUERY_BOUNDARY_GEOJSON, (layer, tolerance, missing))
+        for _id, geojson in cur.fetchall():
+            geometries[_id] = RawJSON(geojson)
+            if tolerance:
+                boundary_cache.set((layer, _id, tolerance), geometries[_id])
+
     return [{"type": "Feature", "id": _id,
              "properties": {"name": name, "density": random.random() * 1200},
-             "geometry": json.loads(geojson)} for _id, name, geojson in cur.fetchall()]
+             "geometry": geometries[_id]} for _id, name in regions]
 
 
 # abbreviation of states
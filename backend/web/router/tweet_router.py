@@ -7,19 +7,146 @@ import rootpath
 rootpath.append()
 
 import json
+import logging
 import re
 import string
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
 import requests
 import twitter
+from dateutil import parser
 from flask import Blueprint, make_response, jsonify, request as flask_request
 from backend.utilities.date_info_series import fill_series, gen_date_series
+from backend import data_events, region_membership
 from backend.connection import Connection
+from backend.query_registry import QueryRegistry
+from backend import tweet_rollups
+from backend.tweet_rollups import GRID_ZOOMS
+from backend.utilities.conditional import reads
+from backend.utilities.json_response import stream_json_array
+from backend.utilities.point_cluster import ClusterIndex, concat_levels, merge_levels, x_lng, y_lat
+from backend.utilities.point_columns import negotiate_binary, points_response
+from backend.utilities.result_cache import ResultCache
+from backend.utilities.single_flight import SingleFlight
+from backend.utilities.tile_cache import lonlat_to_tile
 from paths import TWITTER_API_CONFIG_PATH
 from backend.utilities.ini_parser import parse
 
+logger = logging.getLogger('TaskManager')
+
 bp = Blueprint('tweet', __name__, url_prefix='/tweet')
 api = twitter.Api(**parse(TWITTER_API_CONFIG_PATH, 'twitter-API'))
 
+# located tweets per day, rollup maintained by TweetDumper (tweet_rollups.py)
+QUERY_TWEET_COUNT = QueryRegistry.register('tweet_count', """
+    select day, cnt from tweet_daily_counts where cnt > 0 order by day""")
+# the same from records, until the rollups are built
+QUERY_TWEET_COUNT_RECORDS = QueryRegistry.register('tweet_count_records', """
+    select r.create_at::date, count(*) from records r
+    where r.location is not null and r.create_at is not null
+    group by r.create_at::date order by 1""")
+
+# concurrent identical fire-tweet requests share one query and its serialized response
+fire_tweet_flight = SingleFlight('fire-tweet')
+# decimals of request coordinates kept, identical up to about 10 cm, calls are coalesced on them
+COORDINATE_DECIMALS = 6
+
+# tweets within a polygon and a range of epoch seconds
+QUERY_FIRE_TWEET = QueryRegistry.register('tweet_fire_tweet', """
+    SELECT r.create_at, r.id , st_x(location), st_y(location)
+    FROM records r 
+    where r.create_at BETWEEN to_timestamp($1) AND to_timestamp($2)
+    and ST_CONTAINS(st_geomfromtext($3) , location)""")
+
+# from this map zoom on, tweet-density returns the tweets themselves instead of grid cells
+DENSITY_RAW_POINT_ZOOM = 11
+# grid cells are about 2 ^ DENSITY_CELL_DETAIL times smaller than the map tiles of the requested zoom
+DENSITY_CELL_DETAIL = 3
+
+# tweet counts per grid cell of a zoom level, $2 $3 range of epoch seconds, $4..$7 range of cell x and y
+QUERY_TWEET_GRID = QueryRegistry.register('tweet_grid', """
+    SELECT x, y, sum(cnt), sum(long_sum) / sum(cnt), sum(lat_sum) / sum(cnt) FROM tweet_grid
+    WHERE zoom = $1 AND day BETWEEN to_timestamp($2)::date AND to_timestamp($3)::date
+    AND x BETWEEN $4 AND $5 AND y BETWEEN $6 AND $7
+    GROUP BY x, y HAVING sum(cnt) > 0""")
+# the same from records, until the rollups are built
+QUERY_TWEET_GRID_RECORDS = QueryRegistry.register('tweet_grid_records', """
+    SELECT x, y, count(*), avg(long), avg(lat) FROM (
+        SELECT floor((long + 180) / 360 * 2 ^ $1::int)::int as x,
+               floor((1 - ln(tan(radians(lat)) + 1 / cos(radians(lat))) / pi()) / 2 * 2 ^ $1::int)::int as y,
+               long, lat
+        FROM (
+            SELECT st_x(location) as long, greatest(least(st_y(location), 85.0511), -85.0511) as lat FROM records
+            WHERE location IS NOT NULL
+            AND create_at >= to_timestamp($2)::date AND create_at < to_timestamp($3)::date + 1
+        ) r
+    ) cell
+    WHERE x BETWEEN $4 AND $5 AND y BETWEEN $6 AND $7
+    GROUP BY x, y""")
+
+# tweets within a polygon, or the difference of a new polygon and an old polygon, and a range of epoch seconds,
+# with psycopg2 placeholders, for streaming through a server-side cursor
+STREAM_FIRE_TWEET = """
+    SELECT r.create_at, r.id , st_x(location), st_y(location)
+    FROM records r 
+    where r.create_at BETWEEN to_timestamp(%s) AND to_timestamp(%s)
+    and ST_CONTAINS(st_geomfromtext(%s) , location)"""
+
+STREAM_FIRE_TWEET_DIFFERENCE = """
+    SELECT r.create_at, r.id , st_x(location), st_y(location)
+    FROM records r 
+    where r.create_at BETWEEN to_timestamp(%s) AND to_timestamp(%s)
+    and ST_CONTAINS(st_difference(st_geomfromtext(%s), st_geomfromtext(%s)) , location)"""
+
+# located tweets of a day, and fire centroids of a date range, clustered by /tweet/clusters
+QUERY_CLUSTER_TWEETS = QueryRegistry.register('tweet_cluster_tweets', """
+    SELECT id, st_x(location), st_y(location) FROM records
+    WHERE create_at >= $1::date AND create_at < $1::date + 1 AND location IS NOT NULL""")
+QUERY_CLUSTER_FIRES = QueryRegistry.register('tweet_cluster_fires', """
+    SELECT id, st_x(geom_center), st_y(geom_center) FROM fire_merged
+    WHERE start_time::date <= $2::date AND end_time::date >= $1::date""")
+
+# clusters are kept down to this zoom, raw points are returned above it
+CLUSTER_MAX_ZOOM = DENSITY_RAW_POINT_ZOOM - 1
+# longest range of days of a tweet cluster request, tweets are clustered per day, a day not cached yet is
+# clustered within the request
+CLUSTER_MAX_DAYS = 31
+# one ClusterIndex per day of tweets, per date range of fires, dropped when the data of its day changes
+cluster_cache = ResultCache('clusters', ttl=24 * 3600, maxsize=256)
+# recent days changed by TweetDumper are clustered again in the background, off the request path
+cluster_builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cluster-builder')
+# generation of every cache tag, and of the whole cache, bumped on invalidation: an index computed from data
+# read before an invalidation is not cached after it
+_cluster_lock = threading.Lock()
+_cluster_generations: Dict[str, int] = defaultdict(int)
+_cluster_epoch = 0
+
+# tweets of regions are precomputed in tweet_region (region_membership.sql), maintained by TweetDumper
+QUERY_REGION_TWEET = QueryRegistry.register('tweet_region_tweet', """
+    select date(rec.create_at), count(rec.id) from tweet_region region
+    join records rec on rec.id = region.id
+    where region.region_id = $3
+    and rec.create_at < $1::timestamp -- UTC time zone
+    -- returning PDT without time zone label
+    and rec.create_at > $1::timestamp - $2::int * interval '1 day'
+    GROUP BY date(rec.create_at)""")
+
+# TODO: change the query to support multiple images in a tweet
+QUERY_TWEET_FROM_ID = QueryRegistry.register('tweet_from_id', """
+    select records.id, create_at, text,user_name,profile_pic,image_url from
+    (
+        SELECT id, create_at, text,user_name,profile_pic from records
+        WHERE id = $1
+    ) as records
+    LEFT JOIN images
+    on records.id = images.id
+    LIMIT 1""")
+
 
 @bp.route("/live-tweet")
 def send_live_tweet():
@@ -58,16 +185,16 @@ def send_live_tweet():
 
 
 @bp.route("/tweet-count")
+@reads('records')
 def send_tweet_count_data():
     """
         This func gives all historical tweets objects with id
 
         :returns: a list of tweet objects, each with time, lat, long, id
     """
-    return make_response(jsonify({date.isoformat(): count for date, count in Connection().sql_execute("""
-    select r.create_at::timestamp::date, count(*) from records r where r.location is not null
-    and r.create_at is not null group by r.create_at::timestamp::date""")}))
-
+    query = QUERY_TWEET_COUNT if tweet_rollups.built() else QUERY_TWEET_COUNT_RECORDS
+    return make_response(jsonify({date.isoformat(): count for date, count in
+                                  Connection.sql_execute_prepared(query)}))
 
 @bp.route("/fire-tweet", methods=['post'])
 def send_fire_tweet_data():
@@ -78,25 +205,22 @@ def send_fire_tweet_data():
     """
 
     request_json = flask_request.get_json(force=True)
-    north = request_json['northEast']['lat']
-    east = request_json['northEast']['lon']
-    south = request_json['southWest']['lat']
-    west = request_json['southWest']['lon']
+    north, east, south, west = (round(float(value), COORDINATE_DECIMALS) for value in (
+        request_json['northEast']['lat'], request_json['northEast']['lon'],
+        request_json['southWest']['lat'], request_json['southWest']['lon']))
     start_date_float = request_json['startDate']
     end_date_float = request_json['endDate']
 
     poly = 'polygon(({0} {1}, {0} {2}, {3} {2}, {3} {1}, {0} {1}))'.format(east, south, north, west)
 
-    return make_response(jsonify(
-        [{"create_at": t.isoformat(), "long": long, "lat": lat, "id": str(id)} for t, id, long, lat in
-         Connection.sql_execute(
-             f"""
-                SELECT r.create_at, r.id , st_x(location), st_y(location)
-                FROM records r 
-                where r.create_at BETWEEN to_timestamp({start_date_float / 1000}) 
-                                    AND to_timestamp({end_date_float / 1000})
-                and ST_CONTAINS(st_geomfromtext({repr(poly)}) , location)"""
-         )]))
+    def compute() -> bytes:
+        return jsonify(
+            [{"create_at": t.isoformat(), "long": long, "lat": lat, "id": str(id)} for t, id, long, lat in
+             Connection.sql_execute_prepared(QUERY_FIRE_TWEET,
+                                             (start_date_float / 1000, end_date_float / 1000, poly))]).get_data()
+
+    body = fire_tweet_flight.do((start_date_float, end_date_float, poly), compute)
+    return make_response(body, 200, {'Content-Type': 'application/json'})
 
 
 @bp.route("/fire-tweet2", methods=['post'])
@@ -104,7 +228,8 @@ def send_fire_tweet_data2():
     """
         This func gives all historical tweets objects with id
 
-        :returns: a list of tweet objects, each with time, lat, long, id
+        :returns: a list of tweet objects, each with time, lat, long, id,
+                  or packed columns when requested by Accept (point_columns.py)
     """
 
     request_json = flask_request.get_json(force=True)
@@ -123,27 +248,142 @@ def send_fire_tweet_data2():
     poly = 'polygon(({0} {1}, {0} {2}, {3} {2}, {3} {1}, {0} {1}))'.format(east, south, north, west)
 
     if old_poly == poly:
-        return make_response(jsonify(
-            [{"createAt": t.timestamp(), "lng": long, "lat": lat, "id": str(id)} for t, id, long, lat in
-             Connection.sql_execute(
-                 f"""
-                    SELECT r.create_at, r.id , st_x(location), st_y(location)
-                    FROM records r 
-                    where r.create_at BETWEEN to_timestamp({start_date_float / 1000}) 
-                                        AND to_timestamp({end_date_float / 1000})
-                    and ST_CONTAINS(st_geomfromtext({repr(poly)}) , location)"""
-             )]))
+        rows = Connection.sql_execute_stream(STREAM_FIRE_TWEET, (start_date_float / 1000, end_date_float / 1000, poly))
+    else:
+        rows = Connection.sql_execute_stream(STREAM_FIRE_TWEET_DIFFERENCE,
+                                             (start_date_float / 1000, end_date_float / 1000, poly, old_poly))
+    binary = negotiate_binary()
+    if binary:
+        return points_response(((t.timestamp(), id, long, lat) for t, id, long, lat in rows), binary)
+    response = stream_json_array({"createAt": t.timestamp(), "lng": long, "lat": lat, "id": str(id)}
+                                 for t, id, long, lat in rows)
+    response.vary.add('Accept')
+    return response
+
+
+@bp.route("/tweet-density", methods=['post'])
+def send_tweet_density_data():
+    """
+        This func gives the tweets of the viewport, aggregated into grid cells when the map is zoomed out
+
+        @:param zoom: integer, zoom level of the map
+        :returns: {"type": "grid", "zoom", "cells": [{count, lat, long}, ...]} below DENSITY_RAW_POINT_ZOOM,
+                  {"type": "points", "points": [{createAt, lat, lng, id}, ...]} from it on
+    """
+    request_json = flask_request.get_json(force=True)
+    north = request_json['northEast']['lat']
+    east = request_json['northEast']['lon']
+    south = request_json['southWest']['lat']
+    west = request_json['southWest']['lon']
+    start_date_float = request_json['startDate']
+    end_date_float = request_json['endDate']
+    zoom = int(request_json['zoom'])
+
+    if zoom >= DENSITY_RAW_POINT_ZOOM:
+        poly = 'polygon(({0} {1}, {0} {2}, {3} {2}, {3} {1}, {0} {1}))'.format(east, south, north, west)
+        return make_response(jsonify({"type": "points", "points": [
+            {"createAt": t.timestamp(), "lng": long, "lat": lat, "id": str(id)} for t, id, long, lat in
+            Connection.sql_execute_prepared(QUERY_FIRE_TWEET,
+                                            (start_date_float / 1000, end_date_float / 1000, poly))]}))
+
+    # the finest grid not finer than needed, cells are placed at the centroid of their tweets
+    grid_zoom = max([z for z in GRID_ZOOMS if z <= zoom + DENSITY_CELL_DETAIL], default=GRID_ZOOMS[0])
+    min_x, min_y = lonlat_to_tile(west, north, grid_zoom)
+    max_x, max_y = lonlat_to_tile(east, south, grid_zoom)
+    query = QUERY_TWEET_GRID if tweet_rollups.built() else QUERY_TWEET_GRID_RECORDS
+    return make_response(jsonify({"type": "grid", "zoom": grid_zoom, "cells": [
+        {"count": count, "long": long, "lat": lat} for _, _, count, long, lat in
+        Connection.sql_execute_prepared(query, (grid_zoom, start_date_float / 1000, end_date_float / 1000,
+                                                min_x, max_x, min_y, max_y))]}))
+
+
+@bp.route("/clusters")
+def send_clusters():
+    """
+    tweets, or fire centroids, within a bounding box, clustered at the zoom level of the map
+
+    @:param bbox: west,south,east,north in degrees
+    @:param zoom: integer
+    @:param start: ISO date, first day
+    @:param end: ISO date, last day
+    @:param layer: 'tweet' (default) or 'fire'
+    :return: [ {long, lat, count, id}, ... ], id is null for clusters of more than one point
+    """
+    west, south, east, north = (float(value) for value in flask_request.args['bbox'].split(','))
+    zoom = int(flask_request.args['zoom'])
+    start = parser.parse(flask_request.args['start']).date()
+    end = parser.parse(flask_request.args['end']).date()
+
+    days = (end - start).days + 1
+    if not 0 < days <= CLUSTER_MAX_DAYS:
+        return make_response(f'start to end must span 1 to {CLUSTER_MAX_DAYS} days', 400)
+    if flask_request.args.get('layer', 'tweet') == 'fire':
+        indexes = [_cached_cluster_index(('fire', start, end), 'fire_merged', QUERY_CLUSTER_FIRES, (start, end))]
     else:
-        return make_response(jsonify(
-            [{"createAt": t.timestamp(), "lng": long, "lat": lat, "id": str(id)} for t, id, long, lat in
-             Connection.sql_execute(
-                 f"""
-                SELECT r.create_at, r.id , st_x(location), st_y(location)
-                FROM records r 
-                where r.create_at BETWEEN to_timestamp({start_date_float / 1000}) 
-                                    AND to_timestamp({end_date_float / 1000})
-                and ST_CONTAINS(st_difference(st_geomfromtext({repr(poly)}), st_geomfromtext({repr(old_poly)})) , location)"""
-             )]))
+        indexes = [_tweet_cluster_index(start + timedelta(days=i)) for i in range(days)]
+
+    levels = [index.get_clusters((west, south, east, north), zoom) for index in indexes]
+    # raw points are not clustered across days
+    xs, ys, counts, ids = merge_levels(levels, zoom) if zoom <= CLUSTER_MAX_ZOOM else concat_levels(levels)
+    return make_response(jsonify(
+        [{"long": long, "lat": lat, "count": count, "id": str(id) if id >= 0 else None}
+         for long, lat, count, id in zip(x_lng(xs).tolist(), y_lat(ys).tolist(), counts.tolist(), ids.tolist())]))
+
+
+def _tweet_cluster_index(day: date) -> ClusterIndex:
+    return _cached_cluster_index(('tweet', day), day.isoformat(), QUERY_CLUSTER_TWEETS, (day,))
+
+
+def _cached_cluster_index(key: Tuple, tag: str, query: str, params: Tuple[Any, ...]) -> ClusterIndex:
+    found, index = cluster_cache.get(key)
+    if found:
+        return index
+    with _cluster_lock:
+        generation = _cluster_epoch, _cluster_generations[tag]
+    index = _cluster_index(Connection.sql_execute_prepared(query, params))
+    with _cluster_lock:
+        if (_cluster_epoch, _cluster_generations[tag]) == generation:
+            cluster_cache.set(key, index, tags=(tag,))
+    return index
+
+
+def _cluster_index(rows) -> ClusterIndex:
+    rows = list(rows)
+    # ids are int8 (tweet ids are above 2 ** 53), they never go through float64
+    ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    coordinates = np.array([row[1:] for row in rows], dtype=float).reshape(-1, 2)
+    return ClusterIndex(coordinates[:, 0], coordinates[:, 1], ids, max_zoom=CLUSTER_MAX_ZOOM)
+
+
+def _invalidate_clusters(table: str, dates: Optional[List[date]]) -> None:
+    global _cluster_epoch
+    if table == 'fire_merged':
+        with _cluster_lock:
+            _cluster_generations['fire_merged'] += 1
+            cluster_cache.invalidate('fire_merged')
+    elif table == 'records':
+        with _cluster_lock:
+            if dates is None:
+                _cluster_epoch += 1
+                cluster_cache.clear()
+                return
+            for day in dates:
+                _cluster_generations[day.isoformat()] += 1
+                cluster_cache.invalidate(day.isoformat())
+        oldest = date.today() - timedelta(days=CLUSTER_MAX_DAYS)
+        for day in dates:
+            if day >= oldest:
+                cluster_builder.submit(_rebuild_tweet_cluster_index, day)
+
+
+def _rebuild_tweet_cluster_index(day: date) -> None:
+    try:
+        _tweet_cluster_index(day)
+    except Exception:
+        logger.exception(f'[CLUSTERS] tweets of {day} not clustered')
+
+
+data_events.subscribe(_invalidate_clusters)
 
 
 @bp.route("/recent-tweet")
@@ -157,14 +397,15 @@ def send_recent_tweet_data():
     livetweet_query = "select it.create_at, it.top_left_long, it.top_left_lat, it.bottom_right_long, it.bottom_right_lat, it.id, it.text, i.image_url, it.profile_pic, it.user_name " \
                       "from (select r.create_at, l.top_left_long, l.top_left_lat, l.bottom_right_long, l.bottom_right_lat, l.id, r.text, r.profile_pic, r.user_name " \
                       "from records r, locations l where r.id=l.id and r.profile_pic is not null and r.create_at between (SELECT current_timestamp - interval '10 month') and current_timestamp) AS it LEFT JOIN images i on i.id = it.id where i.image_url is not null "
-    return make_response(jsonify(
-        [{"create_at": time.isoformat(), "long": long, "lat": lat, "id": id, "text": text, "image": image,
-          "profilePic": profilePic, "user": user}
-         for time, long, lat, _, _, id, text, image, profilePic, user in
-         Connection.sql_execute(livetweet_query)]))
+    return stream_json_array(
+        {"create_at": time.isoformat(), "long": long, "lat": lat, "id": id, "text": text, "image": image,
+         "profilePic": profilePic, "user": user}
+        for time, long, lat, _, _, id, text, image, profilePic, user in
+        Connection.sql_execute_stream(livetweet_query))
 
 
 @bp.route('/region-tweet')
+@reads('records')
 def region_tweet():
     """
     tweet count within specific administrative boundary
@@ -181,59 +422,48 @@ def region_tweet():
     # generate date series. values are set to None/null
     date_series = gen_date_series(days, timestamp_str)
 
-    query = f'''
-    select date(rft.create_at), count(rft."id") from
-    (
-        SELECT id, create_at from records rec
-        where rec.create_at < TIMESTAMP '{timestamp_str}' -- UTC time zone
-        -- returning PDT without time zone label
-        and rec.create_at > TIMESTAMP '{timestamp_str}' - interval '{days} day'
-    ) as rft,
-    (
-        SELECT id from locations loc,
-        (
-            SELECT geom from us_states WHERE state_id={region_id}
-            union
-                SELECT geom from us_counties WHERE county_id={region_id}
-                union
-                SELECT geom from us_cities WHERE city_id={region_id}
-        ) as region
-        where st_contains(region.geom, st_makepoint(loc.top_left_long, loc.top_left_lat))
-    ) as gids
-    where rft."id"= gids."id"
-    GROUP BY date(rft.create_at)
-    '''
-
+    if not region_membership.filled('tweet_region'):
+        return make_response('region membership not computed, run sql/region_membership.sql', 503)
     return make_response(jsonify(
-        fill_series(date_series, Connection.sql_execute(query))))
+        fill_series(date_series,
+                    Connection.sql_execute_prepared(QUERY_REGION_TWEET, (timestamp_str, days, region_id)))))
 
 
 @bp.route('/tweet-by-date')
+@reads('records')
 def tweet_by_date():
     """
     tweet count within specific date range
 
     @:param start-date: ISO string
     @:param end-date: ISO string
-    :return: [ {create_at, id, lat, lon}, ... ]
+    :return: [ {create_at, id, lat, lon}, ... ], or packed columns when requested by Accept (point_columns.py)
     """
     start_date_str = flask_request.args.get('start-date').split('.')[0][:-3]
     end_date_str = flask_request.args.get('end-date').split('.')[0][:-3]
 
-    query = f'''
+    query = '''
     select r.create_at, r.id, top_left_long, top_left_lat, bottom_right_long, bottom_right_lat 
-    from records r, locations l where r.id = l.id and r.create_at <  to_timestamp({end_date_str}) and r.create_at >  to_timestamp({start_date_str})
+    from records r, locations l where r.id = l.id 
+    and r.create_at <  to_timestamp(%s) and r.create_at >  to_timestamp(%s)
     '''
 
-    return make_response(
-        jsonify(
-            [{'create_at': create_at, 'id': id, 'lat': (top_left_lat + bottom_right_lat) / 2,
-              'long': (top_left_long + bottom_right_long) / 2}
-             for create_at, id, top_left_long, top_left_lat, bottom_right_long, bottom_right_lat in
-             Connection.sql_execute(query)]))
+    rows = Connection.sql_execute_stream(query, (float(end_date_str), float(start_date_str)))
+    binary = negotiate_binary()
+    if binary:
+        return points_response(
+            ((create_at.timestamp(), id, (top_left_long + bottom_right_long) / 2, (top_left_lat + bottom_right_lat) / 2)
+             for create_at, id, top_left_long, top_left_lat, bottom_right_long, bottom_right_lat in rows), binary)
+    response = stream_json_array(
+        {'create_at': create_at, 'id': id, 'lat': (top_left_lat + bottom_right_lat) / 2,
+         'long': (top_left_long + bottom_right_long) / 2}
+        for create_at, id, top_left_long, top_left_lat, bottom_right_long, bottom_right_lat in rows)
+    response.vary.add('Accept')
+    return response
 
 
 @bp.route("/tweet-from-id")
+@reads('records', 'images')
 def tweet_from_id():
     """
     get detail of specific tweet
@@ -243,20 +473,9 @@ def tweet_from_id():
     """
     tweet_id = int(flask_request.args.get('tweet_id'))
 
-    # TODO: change the query to support multiple images in a tweet
-    query = f'''
-    select records.id, create_at, text,user_name,profile_pic,image_url from
-    (
-        SELECT id, create_at, text,user_name,profile_pic from records
-        WHERE id = {tweet_id}
-    ) as records
-    LEFT JOIN images
-    on records.id = images.id
-    LIMIT 1
-    '''
-
     try:
-        id_, create_at, text, user_name, profile_pic, image_url = next(Connection.sql_execute(query))
+        id_, create_at, text, user_name, profile_pic, image_url = next(
+            Connection.sql_execute_prepared(QUERY_TWEET_FROM_ID, (tweet_id,)))
         return make_response(jsonify({
             'id': str(id_),  # Javascript cannot handle int8, sending as string
             'create_at': create_at,
@@ -39,7 +39,7 @@ export class LocationBoundaryLayer {
             showStateLevel = true;
         }
 
-        this.mapService.getBoundaryData(showStateLevel, showCountyLevel, showCityLevel, boundNE, boundSW)
+        this.mapService.getBoundaryData(showStateLevel, showCountyLevel, showCityLevel, boundNE, boundSW, zoom)
             .subscribe(this.getBoundaryScreenDataHandler);
     };
 
@@ -63,7 +63,7 @@ export class MapService {
         return this.http.get<Wind[]>(`http://${environment.host}:${environment.port}/data/wind`);
     }
 
-    getBoundaryData(stateLevel, countyLevel, cityLevel, northEastBoundaries, southWestBoundaries): Observable<Boundary> {
+    getBoundaryData(stateLevel, countyLevel, cityLevel, northEastBoundaries, southWestBoundaries, zoom): Observable<Boundary> {
 
         return this.http.post<object>(`http://${environment.host}:${environment.port}/search/boundaries`, JSON.stringify({
             states: stateLevel,
@@ -71,6 +71,7 @@ export class MapService {
             counties: countyLevel,
             northEast: northEastBoundaries,
             southWest: southWestBoundaries,
+            zoom,
         })).pipe(map(data => {
 
             return {type: 'FeatureCollection', features: data};
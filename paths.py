@@ -24,6 +24,9 @@ CACHE_DIR = os.path.join(ROOT_DIR, 'cache')
 
 TWITTER_TEXT_CACHE = os.path.join(CACHE_DIR, 'twitter.cache.pickle')
 
+# on-disk cache of fire perimeter vector tiles
+FIRE_TILE_CACHE_DIR = os.path.join(CACHE_DIR, 'fire-tiles')
+
 MODELS_SAVE_PATH = os.path.join(ROOT_DIR, 'backend', 'models')
 
 NLTK_MODEL_PATH = os.path.join(MODELS_SAVE_PATH, 'nltk_model.pickle')
@@ -0,0 +1,45 @@
+-- administrative boundaries simplified at several tolerances (degrees), tolerance 0 keeps the full geometry
+-- served by /search/boundaries, the tolerance is selected from the zoom level of the map
+CREATE TABLE IF NOT EXISTS boundaries_simplified
+(
+    layer     varchar(8),
+    tolerance float8,
+    id        int,
+    name      varchar,
+    geom      geometry,
+    PRIMARY KEY (layer, tolerance, id)
+);
+CREATE INDEX IF NOT EXISTS boundaries_simplified_geom_idx ON boundaries_simplified USING gist (geom);
+
+
+DROP FUNCTION IF EXISTS refresh_boundaries_simplified(tolerances float8[]);
+CREATE or REPLACE FUNCTION refresh_boundaries_simplified(tolerances float8[])
+    RETURNS void
+AS
+$$
+BEGIN
+    TRUNCATE boundaries_simplified;
+
+    INSERT INTO boundaries_simplified (layer, tolerance, id, name, geom)
+    SELECT 'states', t.tolerance, state_id, state_name, ST_SimplifyPreserveTopology(geom, t.tolerance)
+    from us_states,
+         unnest(array_append(tolerances, 0)) as t(tolerance);
+
+    INSERT INTO boundaries_simplified (layer, tolerance, id, name, geom)
+    SELECT 'counties', t.tolerance, county_id, county_name, ST_SimplifyPreserveTopology(geom, t.tolerance)
+    from us_counties,
+         unnest(array_append(tolerances, 0)) as t(tolerance);
+
+    INSERT INTO boundaries_simplified (layer, tolerance, id, name, geom)
+    SELECT 'cities', t.tolerance, city_id, city_name, ST_SimplifyPreserveTopology(geom, t.tolerance)
+    from us_cities,
+         unnest(array_append(tolerances, 0)) as t(tolerance);
+
+    -- web servers drop their cached geometries on commit (data_events.sql)
+    PERFORM publish_data_event('boundaries_simplified');
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- usage: tolerances of BOUNDARY_TOLERANCES (search_router.py), rerun whenever us_states/counties/cities change
+SELECT refresh_boundaries_simplified('{0.05, 0.01, 0.002}');
@@ -0,0 +1,39 @@
+-- versions of the tables announced on the data_changed channel (backend/data_events.py),
+-- web servers validate conditional GETs against them
+CREATE TABLE IF NOT EXISTS data_version
+(
+    table_name  varchar PRIMARY KEY,
+    version     bigint      NOT NULL,
+    modified_at timestamptz NOT NULL
+);
+
+
+-- the SQL counterpart of data_events.publish(): bumps the version of a table and notifies the web servers,
+-- on commit. a bare pg_notify carries no version, servers then stop validating the table until it is published
+DROP FUNCTION IF EXISTS publish_data_event(changed_table varchar, dates text[]);
+CREATE or REPLACE FUNCTION publish_data_event(changed_table varchar, dates text[] DEFAULT NULL)
+    RETURNS void
+AS
+$$
+DECLARE
+    new_version     bigint;
+    new_modified_at timestamptz;
+BEGIN
+    INSERT INTO data_version (table_name, version, modified_at)
+    VALUES (changed_table, 1, now())
+    ON CONFLICT (table_name) DO UPDATE SET version     = data_version.version + 1,
+                                           modified_at = excluded.modified_at
+    RETURNING version, modified_at INTO new_version, new_modified_at;
+
+    PERFORM pg_notify('data_changed', json_build_object(
+            'table', changed_table,
+            'dates', dates,
+            'version', new_version,
+            -- microseconds always written, as parsed by datetime.fromisoformat
+            'modified_at', to_char(new_modified_at AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS.US"+00:00"'))::text);
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- usage: after changing a table out of the data pipeline, e.g. reloads the autocomplete index
+SELECT publish_data_event('us_cities');
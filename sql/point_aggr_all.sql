@@ -0,0 +1,67 @@
+DROP FUNCTION IF EXISTS aggregate_point(long FLOAT, lat FLOAT, radius FLOAT, stamp TIMESTAMP, days int);
+CREATE or REPLACE FUNCTION aggregate_point(long FLOAT, lat FLOAT, radius FLOAT, stamp TIMESTAMP, days int)
+    RETURNS TABLE
+            (
+                timeref   date,
+                cnt_tweet bigint,
+                tmax      double precision,
+                vpdmax    double precision,
+                ppt       double precision
+            )
+AS
+$$
+BEGIN
+    RETURN QUERY
+        with series as (
+            -- one row per day, days without data are kept as null
+            select generate_series(date(stamp) - (days - 1), date(stamp), interval '1 day')::date as d
+        ),
+             gids as (
+                 -- mesh cells around the point, looked up once for all PRISM variables
+                 select mesh.gid
+                 from us_mesh mesh
+                 WHERE st_dwithin(st_makepoint(long, lat), mesh.geom, radius)
+             ),
+             prism_dates as (
+                 SELECT rft."date"
+                 from prism_info rft
+                 where rft."date" <= stamp -- UTC timezong
+                   -- returning PDT without timezong label
+                   and rft."date" > stamp - (days || ' day')::interval
+             ),
+             weather as (
+                 select prism."date"::date                                   as d,
+                        avg(prism.tmax) filter ( where prism.tmax != FLOAT 'NaN' )     as avg_tmax,
+                        avg(prism.vpdmax) filter ( where prism.vpdmax != FLOAT 'NaN' ) as avg_vpdmax,
+                        avg(prism.ppt) filter ( where prism.ppt != FLOAT 'NaN' )       as avg_ppt
+                 from prism,
+                      gids,
+                      prism_dates
+                 where prism.gid = gids.gid
+                   and prism."date" = prism_dates."date"
+                 GROUP BY prism."date"
+             ),
+             tweets as (
+                 select date(rft.create_at) as d, count(t.id) as cnt
+                 from locations t,
+                      records rft
+                 WHERE rft.create_at < stamp -- UTC timezong
+                   -- returning PDT without timezong label
+                   and rft.create_at > stamp - (days || ' day')::interval
+                   and st_dwithin(st_makepoint(long, lat), st_makepoint(t.top_left_long, t.top_left_lat), radius)
+                   and rft."id" = t."id"
+                 GROUP BY date(rft.create_at)
+             )
+        select series.d, tweets.cnt, weather.avg_tmax, weather.avg_vpdmax, weather.avg_ppt
+        from series
+                 left join tweets on tweets.d = series.d
+                 left join weather on weather.d = series.d
+        order by series.d;
+
+END;
+$$
+    LANGUAGE 'plpgsql';
+
+-- usage: lon lat +-180
+SELECT *
+from aggregate_point(-120.026675, 38.683935, 0.5, TIMESTAMP '2019-08-06T15:37:27Z', 7);
@@ -0,0 +1,164 @@
+-- raster storage of the NOAA and PRISM grids (backend/raster_storage.py), used instead of the noaa0p25 and prism
+-- tables when `raster = true` in the [storage] section of configs/database.ini:
+-- one row per timestep and variable, the whole grid as a real[] compressed by TOAST, NULL where there is no value
+
+-- a block of the global 0.25 degree grid, gid = row * 1440 + column, data is row-major
+CREATE TABLE IF NOT EXISTS noaa0p25_raster
+(
+    tid          int4,
+    variable     varchar(8), -- ugnd, vgnd, tmp, soilw
+    first_row    int NOT NULL,
+    first_column int NOT NULL,
+    rows         int NOT NULL,
+    columns      int NOT NULL,
+    data         real[] NOT NULL,
+    PRIMARY KEY (tid, variable)
+);
+
+-- the PRISM grid, data[gid + 1] is the value of gid
+CREATE TABLE IF NOT EXISTS prism_raster
+(
+    date     date,
+    variable varchar(8), -- ppt, tmax, vpdmax
+    data     real[] NOT NULL,
+    PRIMARY KEY (date, variable)
+);
+
+
+-- values of a variable of a tid at gids, gids outside of the stored block are left out.
+-- the array is assigned to a variable once, so that it is detoasted once and not for each gid
+DROP FUNCTION IF EXISTS noaa0p25_raster_values(raster_tid int, raster_variable text, raster_gids int[]);
+CREATE or REPLACE FUNCTION noaa0p25_raster_values(raster_tid int, raster_variable text, raster_gids int[])
+    RETURNS TABLE
+            (
+                gid   int,
+                value real
+            )
+AS
+$$
+DECLARE
+    block_first_row    int;
+    block_first_column int;
+    block_rows         int;
+    block_columns      int;
+    block_data         real[];
+BEGIN
+    SELECT r.first_row, r.first_column, r.rows, r.columns, r.data
+    INTO block_first_row, block_first_column, block_rows, block_columns, block_data
+    from noaa0p25_raster r
+    where r.tid = raster_tid
+      and r.variable = raster_variable;
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+        select g.gid,
+               block_data[(g.gid / 1440 - block_first_row) * block_columns + g.gid % 1440 - block_first_column + 1]
+        from unnest(raster_gids) g(gid)
+        where g.gid / 1440 between block_first_row and block_first_row + block_rows - 1
+          and g.gid % 1440 between block_first_column and block_first_column + block_columns - 1;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+
+DROP FUNCTION IF EXISTS prism_raster_values(raster_date date, raster_variable text, raster_gids int[]);
+CREATE or REPLACE FUNCTION prism_raster_values(raster_date date, raster_variable text, raster_gids int[])
+    RETURNS TABLE
+            (
+                gid   int,
+                value real
+            )
+AS
+$$
+DECLARE
+    grid_data real[];
+BEGIN
+    SELECT r.data
+    INTO grid_data
+    from prism_raster r
+    where r.date = raster_date
+      and r.variable = raster_variable;
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+        select g.gid, grid_data[g.gid + 1]
+        from unnest(raster_gids) g(gid)
+        where g.gid >= 0
+          and g.gid < array_length(grid_data, 1);
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+
+-- aggregate_point (point_aggr_all.sql), reading prism_raster
+DROP FUNCTION IF EXISTS aggregate_point_raster(long FLOAT, lat FLOAT, radius FLOAT, stamp TIMESTAMP, days int);
+CREATE or REPLACE FUNCTION aggregate_point_raster(long FLOAT, lat FLOAT, radius FLOAT, stamp TIMESTAMP, days int)
+    RETURNS TABLE
+            (
+                timeref   date,
+                cnt_tweet bigint,
+                tmax      double precision,
+                vpdmax    double precision,
+                ppt       double precision
+            )
+AS
+$$
+BEGIN
+    RETURN QUERY
+        with series as (
+            -- one row per day, days without data are kept as null
+            select generate_series(date(stamp) - (days - 1), date(stamp), interval '1 day')::date as d
+        ),
+             gids as (
+                 -- mesh cells around the point, looked up once for all PRISM variables
+                 select array_agg(mesh.gid) as gids
+                 from us_mesh mesh
+                 WHERE st_dwithin(st_makepoint(long, lat), mesh.geom, radius)
+             ),
+             prism_dates as (
+                 SELECT rft."date"
+                 from prism_info rft
+                 where rft."date" <= stamp -- UTC timezong
+                   -- returning PDT without timezong label
+                   and rft."date" > stamp - (days || ' day')::interval
+             ),
+             weather as (
+                 select prism_dates."date"::date as d,
+                        (select avg(v.value)
+                         from prism_raster_values(prism_dates."date", 'tmax', gids.gids) v)   as avg_tmax,
+                        (select avg(v.value)
+                         from prism_raster_values(prism_dates."date", 'vpdmax', gids.gids) v) as avg_vpdmax,
+                        (select avg(v.value)
+                         from prism_raster_values(prism_dates."date", 'ppt', gids.gids) v)    as avg_ppt
+                 from prism_dates,
+                      gids
+             ),
+             tweets as (
+                 select date(rft.create_at) as d, count(t.id) as cnt
+                 from locations t,
+                      records rft
+                 WHERE rft.create_at < stamp -- UTC timezong
+                   -- returning PDT without timezong label
+                   and rft.create_at > stamp - (days || ' day')::interval
+                   and st_dwithin(st_makepoint(long, lat), st_makepoint(t.top_left_long, t.top_left_lat), radius)
+                   and rft."id" = t."id"
+                 GROUP BY date(rft.create_at)
+             )
+        select series.d, tweets.cnt, weather.avg_tmax, weather.avg_vpdmax, weather.avg_ppt
+        from series
+                 left join tweets on tweets.d = series.d
+                 left join weather on weather.d = series.d
+        order by series.d;
+
+END;
+$$
+    LANGUAGE 'plpgsql';
+
+
+-- usage: lon lat +-180
+SELECT *
+from noaa0p25_raster_values(2019072218, 'tmp', ARRAY [160 * 1440 + 960, 160 * 1440 + 961]);
+SELECT *
+from aggregate_point_raster(-120.026675, 38.683935, 0.5, TIMESTAMP '2019-08-06T15:37:27Z', 7);
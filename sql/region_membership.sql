@@ -0,0 +1,76 @@
+-- precomputed membership of grid points and tweets in administrative regions (states, counties, cities),
+-- region ids are state_id, county_id or city_id, which do not overlap
+-- read by /data/region-temp, /data/region-moisture and /tweet/region-tweet
+CREATE TABLE IF NOT EXISTS region_noaa_gid
+(
+    region_id int,
+    gid       int,
+    PRIMARY KEY (region_id, gid)
+);
+
+-- no endpoint aggregates PRISM by region, the mesh membership is not kept
+DROP TABLE IF EXISTS region_prism_gid;
+
+-- maintained by TweetDumper for every inserted tweet
+CREATE TABLE IF NOT EXISTS tweet_region
+(
+    region_id int,
+    id        bigint,
+    PRIMARY KEY (region_id, id)
+);
+CREATE INDEX IF NOT EXISTS tweet_region_id_idx ON tweet_region (id);
+
+CREATE OR REPLACE VIEW us_regions AS
+SELECT state_id AS region_id, geom
+from us_states
+UNION ALL
+SELECT county_id, geom
+from us_counties
+UNION ALL
+SELECT city_id, geom
+from us_cities;
+
+
+-- assigns grid points to regions, called by NOAADumper for the points it adds to noaa0p25_geometry
+DROP FUNCTION IF EXISTS refresh_region_noaa_gid(gids int[]);
+CREATE or REPLACE FUNCTION refresh_region_noaa_gid(gids int[])
+    RETURNS void
+AS
+$$
+BEGIN
+    DELETE FROM region_noaa_gid WHERE gid = ANY (gids);
+    INSERT INTO region_noaa_gid (region_id, gid)
+    SELECT region.region_id, geometry.gid
+    from us_regions region,
+         noaa0p25_geometry_neg geometry
+    where geometry.gid = ANY (gids)
+      and st_contains(region.geom, geometry.geom)
+    ON CONFLICT DO NOTHING;
+END;
+$$ LANGUAGE plpgsql;
+
+
+DROP FUNCTION IF EXISTS refresh_region_membership();
+CREATE or REPLACE FUNCTION refresh_region_membership()
+    RETURNS void
+AS
+$$
+BEGIN
+    TRUNCATE region_noaa_gid;
+    PERFORM refresh_region_noaa_gid(array(SELECT gid from noaa0p25_geometry));
+
+    -- backfill, new tweets are assigned by TweetDumper
+    TRUNCATE tweet_region;
+    INSERT INTO tweet_region (region_id, id)
+    SELECT region.region_id, rec.id
+    from us_regions region,
+         records rec
+    where rec.location is not null
+      and st_contains(region.geom, rec.location);
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- usage: run once to backfill, then rerun whenever the boundaries change,
+-- new NOAA grid points and tweets are assigned by the dumpers
+SELECT refresh_region_membership();